@@ -0,0 +1,163 @@
+import logging
+import pathlib
+import threading
+from collections import deque
+from typing import Iterable, Iterator, Optional
+
+from aum.exceptions import PatchSizeError
+
+
+class BatchBudget:
+    """
+    每批输入文件总字节数的上限
+
+    自适应模式下根据各批在浏览器中的耗时估计吞吐量，将上限调整为约target_seconds内能处理完的字节数；
+    批次出错（如浏览器崩溃）时上限减半。可跨多次解锁复用，使常驻模式持续学习。
+    """
+
+    max_bytes: int  # 当前上限，0表示不限
+
+    _adaptive: bool
+    _target_seconds: float
+    _min_bytes: int
+    _max_bytes_limit: int
+    _lock: threading.Lock
+
+    def __init__(self, max_bytes: int = 0, adaptive: bool = False, target_seconds: float = 60,
+                 min_bytes: int = 8 << 20, max_bytes_limit: int = 1 << 30):
+        """
+        :param max_bytes: 每批总字节数上限，0表示不限；自适应模式下为初始值，0时取64MB
+        :param adaptive: 是否根据耗时自动调整
+        :param target_seconds: 自适应模式下每批期望的耗时，单位秒
+        :param min_bytes: 自适应模式下上限的最小值
+        :param max_bytes_limit: 自适应模式下上限的最大值
+        """
+        if max_bytes < 0:
+            raise PatchSizeError(max_bytes)
+        if adaptive and max_bytes == 0:
+            max_bytes = 64 << 20
+
+        self.max_bytes = max_bytes
+        self._adaptive = adaptive
+        self._target_seconds = target_seconds
+        self._min_bytes = min_bytes
+        self._max_bytes_limit = max(max_bytes_limit, min_bytes)
+        self._lock = threading.Lock()
+
+    def report(self, nbytes: int, elapsed: float, ok: bool = True):
+        """报告一批的处理结果
+
+        :param nbytes: 该批输入的总字节数
+        :param elapsed: 该批在浏览器中的耗时，单位秒
+        :param ok: 该批是否正常完成
+        """
+        if not self._adaptive:
+            return
+
+        with self._lock:
+            if not ok:
+                new_bytes = self.max_bytes // 2
+            elif elapsed <= 0 or nbytes < self.max_bytes // 2:  # 零头批次的固定开销占比大，不用于估计
+                return
+            else:
+                estimate = nbytes / elapsed * self._target_seconds
+                new_bytes = min(int((self.max_bytes + estimate) / 2), self.max_bytes * 2)  # 平滑，每次最多翻倍
+
+            new_bytes = min(max(new_bytes, self._min_bytes), self._max_bytes_limit)
+            if new_bytes != self.max_bytes:
+                logging.debug(f'每批字节数上限调整为{new_bytes >> 20}MB（上一批{nbytes >> 20}MB，耗时{elapsed:.1f}秒）')
+                self.max_bytes = new_bytes
+
+
+class Batcher:
+    """
+    按数量与总字节数上限分批，可供多个线程同时取批
+
+    批次在取用时才划分，因此字节数上限的调整对之后的批次立即生效。单个文件超过上限时独占一批。
+    出错的批次可通过split()分为两半重新分配，用于找出导致出错的文件。
+    同一批中不会有stem相同的文件（如不同子目录中的同名歌曲），以便将下载结果准确对应回源文件。
+    """
+
+    _files: deque[tuple[pathlib.Path, int]]  # 尚未分配的(文件, 大小)
+    _retry: deque[list[pathlib.Path]]  # 须优先分配的重试批次
+    _sizes: dict[pathlib.Path, int]
+    _max_count: int
+    _budget: Optional[BatchBudget]
+    _closed: bool
+    _lock: threading.Lock
+
+    def __init__(self, files: Iterable[pathlib.Path], max_count: int = 0, budget: Optional[BatchBudget] = None):
+        """
+        :param files: 被分批的文件
+        :param max_count: 每批文件数上限，0表示不限
+        :param budget: 每批字节数上限，为None时不限
+        """
+        if max_count < 0:
+            raise PatchSizeError(max_count)
+
+        self._sizes = {}
+        for p in files:
+            try:
+                self._sizes[p] = p.stat().st_size
+            except OSError:
+                self._sizes[p] = 0
+        self._files = deque(self._sizes.items())
+        self._retry = deque()
+        self._max_count = max_count
+        self._budget = budget
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def next_batch(self) -> Optional[list[pathlib.Path]]:
+        """取出下一批，全部分配完或已关闭时返回None"""
+        with self._lock:
+            if self._closed or not (self._files or self._retry):
+                return None
+            if self._retry:
+                return self._retry.popleft()
+
+            max_bytes = self._budget.max_bytes if self._budget is not None else 0
+            batch = []
+            stems = set()
+            total = 0
+            while self._files:
+                path, size = self._files[0]
+                if batch and ((self._max_count and len(batch) >= self._max_count)
+                              or (max_bytes and total + size > max_bytes)
+                              or path.stem in stems):
+                    break
+                self._files.popleft()
+                batch.append(path)
+                stems.add(path.stem)
+                total += size
+            return batch
+
+    def report(self, batch: list[pathlib.Path], elapsed: float, ok: bool = True):
+        """报告一批的处理结果，用于调整字节数上限"""
+        if self._budget is not None:
+            self._budget.report(sum(self._sizes.get(p, 0) for p in batch), elapsed, ok)
+
+    def split(self, batch: list[pathlib.Path]) -> bool:
+        """将一批分为两半，优先于其余文件重新分配
+
+        :param batch: 须重试的文件，至少两个
+        :return: 是否已重新分配，分批器已关闭时为False
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            half = (len(batch) + 1) // 2
+            self._retry.extendleft([batch[half:], batch[:half]])
+            return True
+
+    def close(self):
+        """不再分配剩余的批次"""
+        with self._lock:
+            self._closed = True
+
+    def __iter__(self) -> Iterator[list[pathlib.Path]]:
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            yield batch
@@ -0,0 +1,6 @@
+"""
+离线基准测试：合成音乐目录、模拟的WebDriver服务与各阶段的基准测试，通过python -m aum.bench运行
+"""
+from .benchmarks import BENCHMARKS, BenchContext, run_benchmarks
+from .library import generate_library, parse_mix
+from .webdriver_stub import FakeUnlockPage, Latency, StubWebDriverServer
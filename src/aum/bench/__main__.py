@@ -0,0 +1,126 @@
+"""
+离线基准测试
+
+python -m aum.bench [--only scan,rename] [--output result.json]
+python -m aum.bench --compare base.json new.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import pathlib
+import platform
+import subprocess
+import sys
+
+from .benchmarks import BENCHMARKS, BenchContext, run_benchmarks
+from .library import parse_mix
+from .webdriver_stub import Latency
+
+SCHEMA_VERSION = 1
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=pathlib.Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def _flatten(results: dict, prefix: str = '') -> dict[str, float]:
+    """阶段名 -> 耗时中位数，嵌套的子项以"."连接"""
+    flat = {}
+    for name, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        if 'seconds' in value:
+            flat[prefix + name] = value['seconds']
+        flat.update(_flatten(value, prefix + name + '.'))
+    return flat
+
+
+def compare(base_path: pathlib.Path, new_path: pathlib.Path):
+    """输出两次结果中各阶段耗时的对比"""
+    base = _flatten(json.loads(base_path.read_text(encoding='utf-8'))['results'])
+    new = _flatten(json.loads(new_path.read_text(encoding='utf-8'))['results'])
+
+    print(f'{"stage":<24}{"base (s)":>12}{"new (s)":>12}{"ratio":>10}')
+    for name in sorted(base.keys() | new.keys()):
+        b, n = base.get(name), new.get(name)
+        ratio = f'{n / b:.2f}x' if b and n is not None else '-'
+        print(f'{name:<24}{b if b is not None else "-":>12.6}{n if n is not None else "-":>12.6}{ratio:>10}')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m aum.bench', description='Auto Unlock Music离线基准测试')
+    parser.add_argument('--only', default='', help=f'只运行这些测试，以","分隔，可选：{",".join(BENCHMARKS)}')
+    parser.add_argument('--count', type=int, default=200, help='合成音乐目录的文件数')
+    parser.add_argument('--mix', default='', help='格式比例，如".mflac=3;.ncm=2;.mp3=1"')
+    parser.add_argument('--min-size-kb', type=int, default=32, help='文件大小下限，单位KB')
+    parser.add_argument('--max-size-kb', type=int, default=1024, help='文件大小上限，单位KB')
+    parser.add_argument('--sparse', action='store_true', help='生成稀疏文件')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--repeat', type=int, default=3, help='每项测试的运行次数')
+    parser.add_argument('--workers', type=int, default=1, help='unlock测试的会话数')
+    parser.add_argument('--patch-size', type=int, default=6, help='unlock测试的每批文件数')
+    parser.add_argument('--shared-upload', action='store_true', help='unlock测试使用共享音乐目录上传')
+    parser.add_argument('--script-results', action='store_true',
+                        help='unlock测试由页面脚本读回解锁结果并直接发布，不经过下载目录')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='unlock测试中解锁失败的文件比例')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='unlock测试中解锁时卡住的文件比例')
+    parser.add_argument('--file-timeout', type=float, default=0,
+                        help='unlock测试中等待单个文件的最长时间，单位秒，0表示不限（有文件卡住时须设置）')
+    parser.add_argument('--page-load-ms', type=float, default=50, help='unlock测试中打开页面的耗时，单位毫秒')
+    parser.add_argument('--page-reload-batches', type=int, default=1,
+                        help='unlock测试中同一次加载的页面最多处理的批数，1表示每批都重新加载')
+    parser.add_argument('--output', type=pathlib.Path, help='结果写入该文件，默认输出到标准输出')
+    parser.add_argument('--verbose', action='store_true', help='输出各阶段的日志')
+    parser.add_argument('--compare', nargs=2, type=pathlib.Path, metavar=('BASE', 'NEW'), help='对比两次结果')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(message)s',
+                        stream=sys.stderr)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    names = [n for n in args.only.split(',') if n]
+    unknown = set(names) - BENCHMARKS.keys()
+    if unknown:
+        parser.error(f'未知的测试：{",".join(sorted(unknown))}')
+
+    ctx = BenchContext(count=args.count, mix=parse_mix(args.mix) if args.mix else None,
+                       min_size=args.min_size_kb << 10, max_size=args.max_size_kb << 10,
+                       seed=args.seed, sparse=args.sparse, repeat=args.repeat)
+    unlock_options = {'workers': args.workers, 'patch_size': args.patch_size, 'shared_upload': args.shared_upload,
+                      'reload_batches': args.page_reload_batches, 'file_timeout': args.file_timeout,
+                      'stream_results': args.script_results,
+                      'latency': Latency(page_load=args.page_load_ms / 1000, failure_rate=args.failure_rate,
+                                         hang_rate=args.hang_rate)}
+    try:
+        results = run_benchmarks(ctx, names, **unlock_options)
+    finally:
+        ctx.cleanup()
+
+    report = {
+        'schema': SCHEMA_VERSION,
+        'created': datetime.datetime.now().astimezone().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {**ctx.params(), **{k: v for k, v in unlock_options.items() if k != 'latency'},
+                   'failure_rate': args.failure_rate, 'hang_rate': args.hang_rate, 'page_load_ms': args.page_load_ms},
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output is not None:
+        args.output.write_text(text + '\n', encoding='utf-8')
+        logging.info(f'结果已写入{args.output}')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
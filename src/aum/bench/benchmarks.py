@@ -0,0 +1,279 @@
+import io
+import logging
+import pathlib
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Callable, Optional
+
+from aum.batcher import Batcher, BatchBudget
+from aum.decrypt import QmcDecoder
+from aum.helpers import iter_with_patch
+from aum.helpers.dir_filter import filter_dir_by_suffixes
+from aum.index import FileIndex
+from aum.rename import RenameEngine
+from aum.scanner import LibraryScanner
+from .library import DEFAULT_MIX, generate_library, library_bytes
+from .vectors import check_ciphers, qmc_fixture
+from .webdriver_stub import Latency, StubWebDriverServer
+
+LOCKED_SUFFIXES = {'.qmc0', '.qmc2', '.qmc3', '.qmcflac', '.qmcogg', '.mflac', '.mgg', '.mflac0', '.mgg1', '.mggl',
+                   '.ncm'}
+UNLOCKED_SUFFIXES = {'.ogg', '.mp3', '.flac'}
+REMOVING_SUBSTR = {' [mqms]', ' [mqms2]'}
+
+
+def _measure(run: Callable[[], Optional[dict]], repeat: int,
+             setup: Optional[Callable[[], None]] = None) -> dict:
+    """多次运行并记录耗时，setup的耗时不计入
+
+    :param run: 被测函数，可返回附加的指标
+    :param repeat: 运行次数
+    :param setup: 每次运行前的准备工作
+    :return: 耗时的中位数、最小值与每次的耗时，以及最后一次运行返回的指标
+    """
+    runs = []
+    extra = {}
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        extra = run() or {}
+        runs.append(time.perf_counter() - start)
+    return {'seconds': statistics.median(runs), 'min_seconds': min(runs), 'runs': runs, **extra}
+
+
+def _rates(result: dict, files: int, nbytes: int) -> dict:
+    """补充吞吐量"""
+    seconds = result['seconds'] or 1e-9
+    result.update(files=files, bytes=nbytes,
+                  files_per_second=files / seconds, megabytes_per_second=nbytes / seconds / (1 << 20))
+    return result
+
+
+class BenchContext:
+    """
+    一次基准测试运行的参数与工作目录
+    """
+
+    count: int
+    mix: dict[str, int]
+    min_size: int
+    max_size: int
+    seed: int
+    sparse: bool
+    repeat: int
+    work_dir: pathlib.Path
+
+    def __init__(self, count: int = 200, mix: Optional[dict[str, int]] = None,
+                 min_size: int = 32 << 10, max_size: int = 1 << 20, seed: int = 0, sparse: bool = False,
+                 repeat: int = 3, work_dir: Optional[pathlib.Path] = None):
+        self.count = count
+        self.mix = mix or DEFAULT_MIX
+        self.min_size = min_size
+        self.max_size = max_size
+        self.seed = seed
+        self.sparse = sparse
+        self.repeat = repeat
+        self.work_dir = work_dir or pathlib.Path(tempfile.mkdtemp(prefix='aum-bench-'))
+
+    def params(self) -> dict:
+        return {'count': self.count, 'mix': self.mix, 'min_size': self.min_size, 'max_size': self.max_size,
+                'seed': self.seed, 'sparse': self.sparse, 'repeat': self.repeat}
+
+    def library(self, name: str) -> list[pathlib.Path]:
+        """在工作目录下（重新）生成一个合成音乐目录"""
+        root = self.work_dir / name
+        shutil.rmtree(root, ignore_errors=True)
+        return generate_library(root, self.count, self.mix, self.min_size, self.max_size, self.seed, self.sparse)
+
+    def cleanup(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def bench_scan(ctx: BenchContext) -> dict:
+    """列出目录并按后缀筛选加密音乐，以及文件状态索引的首次与再次扫描"""
+    files = ctx.library('scan')
+    music_dir = files[0].parent
+
+    result = _measure(lambda: {'locked': len(list(filter_dir_by_suffixes(music_dir.iterdir(), LOCKED_SUFFIXES)))},
+                      ctx.repeat)
+    _rates(result, len(files), 0)
+
+    scanner = LibraryScanner(music_dir, max_depth=None)
+    result['scanner'] = _rates(_measure(
+        lambda: {'locked': len(list(filter_dir_by_suffixes(scanner.paths(), LOCKED_SUFFIXES)))}, ctx.repeat),
+        len(files), 0)
+
+    db_path = ctx.work_dir / 'scan-index.sqlite3'
+
+    def reset_index():
+        db_path.unlink(missing_ok=True)
+
+    def index_cold():
+        with FileIndex(db_path) as index:
+            changed = index.scan(music_dir)
+            index.record_all(changed, FileIndex.CLEAN)
+            index.mark_scanned(music_dir)
+
+    def index_warm():
+        with FileIndex(db_path) as index:
+            return {'changed': len(index.scan(music_dir))}
+
+    result['index_cold'] = _rates(_measure(index_cold, ctx.repeat, setup=reset_index), len(files), 0)
+    result['index_warm'] = _rates(_measure(index_warm, ctx.repeat), len(files), 0)
+    return result
+
+
+def bench_batch(ctx: BenchContext) -> dict:
+    """按数量分批，以及按数量与字节数分批"""
+    files = ctx.library('batch')
+    nbytes = library_bytes(files)
+
+    result = _rates(_measure(lambda: {'batches': len(list(iter_with_patch(files, 6)))}, ctx.repeat),
+                    len(files), nbytes)
+    budget = BatchBudget(8 << 20)
+    result['by_bytes'] = _rates(_measure(lambda: {'batches': len(list(Batcher(files, 6, budget)))}, ctx.repeat),
+                                len(files), nbytes)
+    return result
+
+
+def bench_rename(ctx: BenchContext) -> dict:
+    """生成重命名计划并执行"""
+    engine = RenameEngine(REMOVING_SUBSTR, [(r'^\d+\. ', '')])  # 再加一条移除曲目编号的正则规则
+    state = {}
+
+    def setup():
+        state['files'] = ctx.library('rename')
+
+    def run():
+        plan = engine.plan(state['files'])
+        return {'renamed': len(engine.apply(plan))}
+
+    return _rates(_measure(run, ctx.repeat, setup), ctx.count, 0)
+
+
+def bench_finalize(ctx: BenchContext, fsync: bool = False) -> dict:
+    """将下载目录中的结果发布到音乐目录"""
+    try:
+        from aum.unlocker import Finalizer
+    except ImportError as e:
+        return {'skipped': f'selenium is not installed: {e}'}
+
+    music_dir = ctx.work_dir / 'finalize-music'
+    state = {}
+
+    def setup():
+        files = ctx.library('finalize-download')
+        shutil.rmtree(music_dir, ignore_errors=True)
+        music_dir.mkdir()
+        state['downloaded'] = {music_dir / (p.stem + '.mflac'): p for p in files}
+        state['bytes'] = library_bytes(files)
+
+    finalizer = Finalizer(music_dir, fsync=fsync, renamer=RenameEngine(REMOVING_SUBSTR))
+    result = _measure(lambda: {'published': len(finalizer.finalize(state['downloaded'])[0])}, ctx.repeat, setup)
+    return _rates(result, ctx.count, state['bytes'])
+
+
+def bench_decrypt(ctx: BenchContext) -> dict:
+    """校验本地解密算法的已知答案，再以合成音乐目录中的文件内容测量映射加密与分段RC4加密的解密速度
+
+    :raise AssertionError: 解密结果与已知答案不符时
+    """
+    result = {'checked': check_ciphers()}
+    files = ctx.library('decrypt')
+    nbytes = library_bytes(files)
+    chunk_size = 1 << 20
+
+    for name, key_len in (('qmc_map', 256), ('qmc_rc4', 512)):
+        data, _ = qmc_fixture(bytes((i * 7 + 1) % 255 + 1 for i in range(key_len)), 4096)
+        decoder = QmcDecoder(io.BytesIO(data), len(data))
+
+        def run():
+            for p in files:
+                with open(p, 'rb') as f:
+                    offset = 0
+                    while chunk := f.read(chunk_size):
+                        decoder.decrypt(chunk, offset)
+                        offset += len(chunk)
+
+        result[name] = _rates(_measure(run, ctx.repeat), len(files), nbytes)
+    return result
+
+
+def bench_unlock(ctx: BenchContext, workers: int = 1, patch_size: int = 6, shared_upload: bool = False,
+                 latency: Latency = Latency(), reload_batches: int = 1, file_timeout: float = 0,
+                 stream_results: bool = False) -> dict:
+    """通过模拟的WebDriver服务完成整个浏览器解锁流程（上传、等待解锁、下载、整理）
+
+    stream_results为True时由页面脚本读回解锁结果并直接发布，不经过下载目录。
+
+    需要安装selenium，其余部分（浏览器、Unlock Music服务）均为模拟。
+    """
+    try:
+        from aum.hub import SeleniumHub
+        from aum.pool import DriverPool
+        from aum.unlocker import ParallelMusicUnlocker, ReloadPolicy, UnlockDeadline
+    except ImportError as e:
+        return {'skipped': f'selenium is not installed: {e}'}
+
+    state = {}
+    download_dir = ctx.work_dir / 'unlock-download'
+
+    def setup():
+        files = [p for p in ctx.library('unlock') if p.suffix in LOCKED_SUFFIXES]
+        shutil.rmtree(download_dir, ignore_errors=True)
+        download_dir.mkdir()
+        state['files'] = files
+        state['bytes'] = library_bytes(files)
+
+    with StubWebDriverServer(download_dir, latency) as stub:
+        def run():
+            music_dir = state['files'][0].parent
+            hub = SeleniumHub(stub.url, download_dir, pathlib.PurePosixPath(download_dir),
+                              music_dir=music_dir if shared_upload else None,
+                              remote_music_dir=pathlib.PurePosixPath(music_dir) if shared_upload else None)
+            pool = DriverPool([hub], size=workers)
+            try:
+                unlocker = ParallelMusicUnlocker(pool, 'http://unlock-music.invalid', music_dir, UNLOCKED_SUFFIXES,
+                                                 patch_size=patch_size, finalize_workers=workers,
+                                                 reload_policy=ReloadPolicy(reload_batches),
+                                                 deadline=UnlockDeadline(file_seconds=file_timeout),
+                                                 stream_results=stream_results)
+                upload_before = stub.upload_bytes
+                unlocked = unlocker.unlock_files(state['files'])
+            finally:
+                pool.quit()
+            return {'unlocked': len(unlocked), 'failed': len(unlocker.failed_files),
+                    'uploaded_bytes': stub.upload_bytes - upload_before}
+
+        result = _measure(run, ctx.repeat, setup)
+
+    result.update(workers=workers, patch_size=patch_size, shared_upload=shared_upload, reload_batches=reload_batches,
+                  file_timeout=file_timeout, stream_results=stream_results)
+    return _rates(result, len(state['files']), state['bytes'])
+
+
+BENCHMARKS = {
+    'scan': bench_scan,
+    'batch': bench_batch,
+    'rename': bench_rename,
+    'finalize': bench_finalize,
+    'decrypt': bench_decrypt,
+    'unlock': bench_unlock,
+}
+
+
+def run_benchmarks(ctx: BenchContext, names: Optional[list[str]] = None, **unlock_options) -> dict[str, dict]:
+    """依次运行基准测试
+
+    :param names: 要运行的基准测试，默认为全部
+    :param unlock_options: 传给bench_unlock的参数
+    """
+    results = {}
+    for name in names or list(BENCHMARKS):
+        logging.info(f'正在运行基准测试：{name}')
+        bench = BENCHMARKS[name]
+        results[name] = bench(ctx, **unlock_options) if name == 'unlock' else bench(ctx)
+    return results
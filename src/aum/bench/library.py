@@ -0,0 +1,78 @@
+import pathlib
+import random
+from typing import Optional
+
+# 默认的格式比例，大致对应QQ音乐与网易云音乐下载目录中的构成
+DEFAULT_MIX = {'.mflac': 3, '.mgg': 1, '.qmcflac': 1, '.qmc0': 1, '.ncm': 2, '.mp3': 2}
+
+_ARTISTS = ['周杰伦', '陈奕迅', '林俊杰', 'Taylor Swift', '五月天', '王菲', 'Coldplay', '孙燕姿', '李荣浩', 'Adele']
+_TAGS = [' [mqms2]', ' [mqms]', '', '']  # QQ音乐下载的文件名常带有的多余子串
+
+
+def parse_mix(text: str) -> dict[str, int]:
+    """解析格式比例，如".mflac=3;.ncm=2;.mp3=1"
+
+    :raise ValueError: 格式不正确时
+    """
+    mix = {}
+    for item in text.split(';'):
+        if not item:
+            continue
+        suffix, _, weight = item.partition('=')
+        if not suffix.startswith('.'):
+            suffix = '.' + suffix
+        mix[suffix] = int(weight or 1)
+        if mix[suffix] < 0:
+            raise ValueError(f'Weight of "{suffix}" must be non-negative.')
+    if not any(mix.values()):
+        raise ValueError(f'Format mix "{text}" is empty.')
+    return mix
+
+
+def generate_library(root: pathlib.Path,
+                     count: int,
+                     mix: Optional[dict[str, int]] = None,
+                     min_size: int = 32 << 10,
+                     max_size: int = 1 << 20,
+                     seed: int = 0,
+                     sparse: bool = False
+                     ) -> list[pathlib.Path]:
+    """生成合成的音乐目录，相同参数总是生成相同的文件
+
+    文件名形如"歌手 - 歌曲N [mqms2].mflac"，内容为随机字节（不是真正的加密音频，只用于衡量调度与文件操作的开销）。
+
+    :param root: 生成到的目录，不存在时创建
+    :param count: 文件数
+    :param mix: 后缀 -> 权重，默认为DEFAULT_MIX
+    :param min_size: 文件大小的下限，单位字节
+    :param max_size: 文件大小的上限，单位字节
+    :param seed: 随机种子
+    :param sparse: 是否生成稀疏文件（只写入开头4KB），用于快速生成大体积的目录
+    :return: 生成的文件
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    suffixes = list(mix.keys())
+    weights = list(mix.values())
+
+    root.mkdir(parents=True, exist_ok=True)
+    files = []
+    for i in range(count):
+        suffix = rng.choices(suffixes, weights)[0]
+        name = f'{rng.choice(_ARTISTS)} - 歌曲{i:05d}{rng.choice(_TAGS)}{suffix}'
+        size = rng.randint(min_size, max_size)
+
+        path = root / name
+        with open(path, 'wb') as f:
+            if sparse:
+                f.write(rng.randbytes(min(size, 4096)))
+                f.truncate(size)
+            else:
+                f.write(rng.randbytes(size))
+        files.append(path)
+    return files
+
+
+def library_bytes(files: list[pathlib.Path]) -> int:
+    """文件的总字节数"""
+    return sum(p.stat().st_size for p in files)
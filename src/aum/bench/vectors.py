@@ -0,0 +1,203 @@
+"""
+本地解密算法的已知答案校验：以逐字节的参考实现（按Unlock Music的算法直译）与固定的摘要核对aum.decrypt的结果
+"""
+import base64
+import hashlib
+import io
+import math
+import struct
+
+from aum.decrypt import NcmDecoder, QmcDecoder
+from aum.decrypt.aes import aes128_ecb_decrypt
+from aum.decrypt.tea import tc_tea_decrypt
+from aum.decrypt.xor import periodic_mask
+from aum.exceptions import DecryptError
+
+_TEA_DELTA = 0x9E3779B9
+_ENC_V2_PREFIX = b'QQMusic EncV2,Key:'
+_MIX_KEY_1 = b'386ZJY!@#*$%^&)('
+_MIX_KEY_2 = b'**#!(#$%&^a1cZ,T'
+
+# FIPS-197附录C.1的AES-128向量：密钥、明文、密文
+_AES_VECTOR = (bytes.fromhex('000102030405060708090a0b0c0d0e0f'),
+               bytes.fromhex('00112233445566778899aabbccddeeff'),
+               bytes.fromhex('69c4e0d86a7b0430d8cdb78070b4c55a'))
+
+# 各算法密钥流（或密文）的SHA-256前16个十六进制字符，参考实现本身被改动时同样可以发现
+_DIGESTS = {
+    'tc_tea': '507e4a4fb067db08',
+    'qmc_map': 'ff7210e82f7ff360',
+    'qmc_rc4': '8093f17f6feece77',
+    'ncm': '6e20684f8e0428fc',
+}
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def _sample_key(length: int, salt: int) -> bytes:
+    """不含0字节的固定密钥（段密钥的种子为0时各实现的行为不一）"""
+    return bytes((i * 7 + salt) % 255 + 1 for i in range(length))
+
+
+def _tea_encrypt_block(block: bytes, key: bytes) -> bytes:
+    v0, v1 = struct.unpack('>2I', block)
+    k0, k1, k2, k3 = struct.unpack('>4I', key)
+    total = 0
+    for _ in range(16):
+        total = (total + _TEA_DELTA) & 0xFFFFFFFF
+        v0 = (v0 + ((((v1 << 4) + k0) ^ (v1 + total) ^ ((v1 >> 5) + k1)) & 0xFFFFFFFF)) & 0xFFFFFFFF
+        v1 = (v1 + ((((v0 << 4) + k2) ^ (v0 + total) ^ ((v0 >> 5) + k3)) & 0xFFFFFFFF)) & 0xFFFFFFFF
+    return struct.pack('>2I', v0, v1)
+
+
+def tc_tea_encrypt(plain: bytes, key: bytes, fill: int = 0xA5) -> bytes:
+    """tc_tea加密（以固定字节代替随机填充），用于构造密文
+
+    每块先与上一块密文异或后以16轮TEA加密，再与上一块的异或结果异或。
+    """
+    pad_len = -(len(plain) + 10) % 8
+    body = bytes([(fill & 0xF8) | pad_len]) + bytes([fill]) * (pad_len + 2) + plain + bytes(7)
+    out = bytearray()
+    prev_plain = prev_cipher = bytes(8)
+    for i in range(0, len(body), 8):
+        mixed = bytes(a ^ b for a, b in zip(body[i:i + 8], prev_cipher))
+        prev_cipher = bytes(a ^ b for a, b in zip(_tea_encrypt_block(mixed, key), prev_plain))
+        prev_plain = mixed
+        out += prev_cipher
+    return bytes(out)
+
+
+def make_ekey(key: bytes, enc_v2: bool = False) -> bytes:
+    """由密钥构造QQ音乐文件尾部的ekey（derive_key()的逆运算）"""
+    simple_key = bytes(int(abs(math.tan(106 + i * 0.1)) * 100.0) & 0xFF for i in range(8))
+    tea_key = bytes(b for pair in zip(simple_key, key[:8]) for b in pair)
+    ekey = base64.b64encode(key[:8] + tc_tea_encrypt(key[8:], tea_key))
+    if enc_v2:
+        ekey = base64.b64encode(_ENC_V2_PREFIX + tc_tea_encrypt(tc_tea_encrypt(ekey, _MIX_KEY_2), _MIX_KEY_1))
+    return ekey
+
+
+def qmc_map_mask(key: bytes, length: int) -> bytes:
+    """QQ音乐映射加密的参考密钥流"""
+    mask = bytearray(length)
+    for offset in range(length):
+        pos = offset % 0x7FFF if offset > 0x7FFF else offset
+        idx = (pos * pos + 71214) % len(key)
+        rotate = ((idx & 0x7) + 4) % 8
+        mask[offset] = ((key[idx] << rotate) | (key[idx] >> rotate)) & 0xFF
+    return bytes(mask)
+
+
+def qmc_rc4_mask(key: bytes, length: int) -> bytes:
+    """QQ音乐分段RC4加密的参考密钥流：首段查表，其余各段从初始状态重新生成"""
+    n = len(key)
+    box = [i & 0xFF for i in range(n)]  # 状态为字节，密钥长于256字节时同样取低8位
+    j = 0
+    for i in range(n):
+        j = (j + box[i] + key[i]) % n
+        box[i], box[j] = box[j], box[i]
+
+    h = 1
+    for v in key:
+        if v == 0:
+            continue
+        next_h = h * v & 0xFFFFFFFF
+        if next_h == 0 or next_h <= h:
+            break
+        h = next_h
+
+    def segment_key(seg_id: int) -> int:
+        return int(h / ((seg_id + 1) * key[seg_id % n]) * 100.0) % n
+
+    mask = bytearray(key[segment_key(i)] for i in range(min(length, 0x80)))
+    seg_id = 0
+    while len(mask) < length:
+        seg_start = max(seg_id * 0x1400, 0x80)
+        seg_end = min((seg_id + 1) * 0x1400, length)
+        s = box[:]
+        j = k = 0
+        for i in range(seg_start % 0x1400 + segment_key(seg_id) + seg_end - seg_start):
+            j = (j + 1) % n
+            k = (s[j] + k) % n
+            s[j], s[k] = s[k], s[j]
+            if i >= seg_start % 0x1400 + segment_key(seg_id):
+                mask.append(s[(s[j] + s[k]) % n])
+        seg_id += 1
+    return bytes(mask)
+
+
+def ncm_mask(key: bytes, length: int) -> bytes:
+    """网易云音乐的参考密钥流"""
+    box = list(range(256))
+    c = 0
+    for i in range(256):
+        c = (box[i] + c + key[i % len(key)]) & 0xFF
+        box[i], box[c] = box[c], box[i]
+    return bytes(box[(box[(i + 1) & 0xFF] + box[(box[(i + 1) & 0xFF] + (i + 1)) & 0xFF]) & 0xFF]
+                 for i in range(length))
+
+
+def qmc_fixture(key: bytes, audio_size: int, enc_v2: bool = False) -> tuple[bytes, bytes]:
+    """构造一个内嵌密钥的QQ音乐加密文件
+
+    :return: 文件内容，以及其中音频的明文
+    """
+    plain = b'fLaC' + bytes(i * 31 % 251 for i in range(audio_size - 4))
+    mask = qmc_rc4_mask(key, audio_size) if len(key) > 300 else qmc_map_mask(key, audio_size)
+    ekey = make_ekey(key, enc_v2)
+    return bytes(a ^ b for a, b in zip(plain, mask)) + ekey + struct.pack('<I', len(ekey)), plain
+
+
+def _check_decoder(data: bytes, plain: bytes, chunk_size: int) -> bool:
+    """以QmcDecoder分块解密，比较结果与明文"""
+    try:
+        decoder = QmcDecoder(io.BytesIO(data), len(data))
+    except DecryptError:  # 密钥未能解出
+        return False
+    if decoder.audio_size != len(plain):
+        return False
+    data = data[decoder.audio_offset:decoder.audio_offset + decoder.audio_size]
+    return all(decoder.decrypt(data[offset:offset + chunk_size], offset) == plain[offset:offset + chunk_size]
+               for offset in range(0, len(plain), chunk_size))
+
+
+def check_ciphers() -> list[str]:
+    """核对各解密算法
+
+    :return: 通过的项
+    :raise AssertionError: 某一项的结果与参考实现或已知答案不符时
+    """
+    checks = {}
+
+    key, plain, cipher = _AES_VECTOR
+    checks['aes'] = aes128_ecb_decrypt(cipher, key, unpad=False) == plain
+
+    tea_key = _sample_key(16, 3)
+    tea_plain = bytes(range(37))
+    tea_cipher = tc_tea_encrypt(tea_plain, tea_key)
+    checks['tc_tea'] = tc_tea_decrypt(tea_cipher, tea_key) == tea_plain and _digest(tea_cipher) == _DIGESTS['tc_tea']
+
+    map_key = _sample_key(256, 11)
+    map_size = 0x8000 + 0x300  # 越过0x7FFF后的周期
+    checks['qmc_map'] = _digest(qmc_map_mask(map_key, map_size)) == _DIGESTS['qmc_map']
+    data, audio = qmc_fixture(map_key, map_size)
+    checks['qmc_map_decoder'] = _check_decoder(data, audio, 1000) and _check_decoder(data, audio, len(audio))
+
+    rc4_key = _sample_key(512, 17)
+    rc4_size = 3 * 0x1400 + 0x123  # 首段、完整的段与不完整的段
+    checks['qmc_rc4'] = _digest(qmc_rc4_mask(rc4_key, rc4_size)) == _DIGESTS['qmc_rc4']
+    data, audio = qmc_fixture(rc4_key, rc4_size, enc_v2=True)  # 同时校验EncV2密钥的解码
+    checks['qmc_rc4_decoder'] = _check_decoder(data, audio, 1000) and _check_decoder(data, audio, len(audio))
+
+    ncm_key = _sample_key(96, 23)
+    stream = ncm_mask(ncm_key, 0x300)
+    checks['ncm'] = _digest(stream) == _DIGESTS['ncm'] and NcmDecoder._key_stream(ncm_key) == stream[:256]
+    checks['ncm_offset'] = all(periodic_mask(stream[:256], offset, 300) == stream[offset:offset + 300]
+                               for offset in (0, 1, 255, 256, 300))
+
+    failed = [name for name, ok in checks.items() if not ok]
+    if failed:
+        raise AssertionError(f'Decryption does not match the known answers: {", ".join(failed)}')
+    return list(checks)
@@ -0,0 +1,439 @@
+"""
+模拟Selenium Hub与Unlock Music页面的W3C WebDriver服务，用于离线的性能测试
+
+只实现本程序用到的命令：创建/关闭会话、打开页面、查找元素、点击、向上传控件输入文件路径、
+设置超时、执行（异步）脚本，以及Selenium客户端上传文件用的/se/file。页面本身不会被执行，
+而是由FakeUnlockPage按设定的延迟模拟解锁与下载（或由页面脚本读回解锁结果）。
+"""
+import base64
+import io
+import json
+import math
+import os
+import pathlib
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+_ELEMENT_KEY = 'element-6066-11e4-a52e-4f735466cecf'
+
+# 定位器 -> 页面元素，与UnlockMusicBroker中使用的定位器对应
+_ELEMENTS = {
+    '//span[contains(text(), "同源文件名")]': 'same-name',
+    '.el-upload__input': 'upload',
+    '//span[text()="下载全部"]': 'download-all',
+    '//span[text()="清除全部"]': 'clear-all',
+}
+
+
+@dataclass(frozen=True)
+class Latency:
+    """
+    模拟的耗时，单位秒；吞吐量单位为字节每秒
+    """
+    page_load: float = 0.05  # 打开页面
+    page_reset: float = 0.002  # 在页面内清空文件列表
+    decrypt_base: float = 0.01  # 每个文件解锁的固定开销
+    decrypt_rate: float = 200e6  # 解锁吞吐量
+    download_base: float = 0.005  # 每个文件下载的固定开销
+    download_rate: float = 400e6  # 下载吞吐量
+    failure_rate: float = 0.0  # 解锁失败的文件比例，按文件名确定，结果可复现
+    hang_rate: float = 0.0  # 解锁时卡住的文件比例，同一页面中其后的文件也不再解锁，直到重新加载页面
+
+
+def _unlocked_suffix(source: pathlib.Path) -> str:
+    suffix = source.suffix.lower()
+    if 'flac' in suffix:
+        return '.flac'
+    if 'ogg' in suffix or suffix.startswith('.mgg'):
+        return '.ogg'
+    return '.mp3'
+
+
+class _Row:
+    def __init__(self, source: pathlib.Path, ready_at: float, failed: bool):
+        self.source = source
+        self.title = source.stem
+        self.ready_at = ready_at
+        self.failed = failed
+        self.taken = False  # 是否已被NEXT_RESULT_SCRIPT取回
+
+
+class FakeUnlockPage:
+    """
+    一个会话中的Unlock Music页面
+    """
+
+    download_dir: pathlib.Path
+
+    _latency: Latency
+    _rows: list[_Row]
+    _errors: list[str]
+    _decrypt_free_at: float  # 页面按顺序解锁，上一个文件解锁完成的时间
+    _results: dict[str, pathlib.Path]  # 脚本登记的解锁结果id -> 源文件（模拟的解锁结果与源文件内容相同）
+    _next_id: int
+    _cond: threading.Condition
+
+    def __init__(self, download_dir: pathlib.Path, latency: Latency):
+        self.download_dir = download_dir
+        self._latency = latency
+        self._rows = []
+        self._errors = []
+        self._decrypt_free_at = 0
+        self._results = {}
+        self._next_id = 0
+        self._cond = threading.Condition()
+
+    def load(self):
+        time.sleep(self._latency.page_load)
+        with self._cond:
+            self._rows.clear()
+            self._errors.clear()
+            self._results.clear()
+            self._decrypt_free_at = 0
+
+    def upload(self, paths: list[pathlib.Path]):
+        lat = self._latency
+        with self._cond:
+            for p in paths:
+                start = max(time.monotonic(), self._decrypt_free_at)
+                self._decrypt_free_at = start + lat.decrypt_base + p.stat().st_size / lat.decrypt_rate
+                failed = zlib.crc32(p.name.encode()) % 10000 < lat.failure_rate * 10000
+                if zlib.crc32(b'hang:' + p.name.encode()) % 10000 < lat.hang_rate * 10000:
+                    self._decrypt_free_at = math.inf
+                self._rows.append(_Row(p, self._decrypt_free_at, failed))
+            self._cond.notify_all()
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._cond:
+            for row in [r for r in self._rows if r.failed and r.ready_at <= now]:
+                self._rows.remove(row)
+                self._errors.append(f'错误 {row.source.name}：不支持的文件格式')
+            return {
+                'rows': [{'title': r.title, 'unlocked': r.ready_at <= now} for r in self._rows],
+                'errors': list(self._errors),
+                'timedOut': False,
+            }
+
+    def wait_table(self, mode: str, expected: int, timeout: float) -> dict:
+        """对应WAIT_TABLE_SCRIPT"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            errors_before = len(self._errors)
+        while True:
+            snap = self.snapshot()
+            unlocked = sum(1 for r in snap['rows'] if r['unlocked'])
+            if mode == 'empty':
+                done = not snap['rows']
+            else:
+                done = unlocked >= expected or len(snap['errors']) > errors_before
+            if done or time.monotonic() >= deadline:
+                snap['timedOut'] = not done
+                return snap
+
+            with self._cond:
+                pending = [r.ready_at for r in self._rows if r.ready_at > time.monotonic()]
+            wake = min(pending + [deadline]) - time.monotonic()  # 卡住的文件为inf，由deadline兜底
+            time.sleep(min(max(wake, 0.001), 0.05))
+
+    def next_result(self, timeout: float) -> dict:
+        """对应NEXT_RESULT_SCRIPT"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            errors_before = len(self._errors)
+        while True:
+            snap = self.snapshot()
+            now = time.monotonic()
+            with self._cond:
+                row = next((r for r in self._rows if not r.taken and not r.failed and r.ready_at <= now), None)
+                if row is not None:
+                    row.taken = True
+                    self._next_id += 1
+                    result_id = str(self._next_id)
+                    self._results[result_id] = row.source
+                    result = {'id': result_id, 'name': row.source.stem, 'title': row.title,
+                              'ext': _unlocked_suffix(row.source)[1:], 'size': row.source.stat().st_size}
+                    return {'ok': True, 'result': result, 'errors': snap['errors'], 'timedOut': False}
+                pending = [r.ready_at for r in self._rows if not r.taken and r.ready_at > now]
+            if len(snap['errors']) > errors_before or now >= deadline:
+                return {'ok': True, 'result': None, 'errors': snap['errors'], 'timedOut': now >= deadline}
+            wake = min(pending + [deadline]) - now
+            time.sleep(min(max(wake, 0.001), 0.05))
+
+    def read_result(self, result_id: str, offset: int, length: int) -> Optional[str]:
+        """对应READ_RESULT_SCRIPT"""
+        with self._cond:
+            source = self._results.get(result_id)
+        if source is None:
+            return None
+        time.sleep(length / self._latency.download_rate)
+        with open(source, 'rb') as f:
+            f.seek(offset)
+            return base64.b64encode(f.read(length)).decode()
+
+    def release_result(self, result_id: str):
+        """对应RELEASE_RESULT_SCRIPT"""
+        with self._cond:
+            self._results.pop(result_id, None)
+
+    def reset_errors(self):
+        with self._cond:
+            self._errors.clear()
+
+    def reset(self) -> dict:
+        """对应RESET_PAGE_SCRIPT"""
+        time.sleep(self._latency.page_reset)
+        with self._cond:
+            revoked = sum(1 for r in self._rows if not r.failed)
+            self._rows.clear()
+            self._errors.clear()
+            self._results.clear()
+        return {'ok': True, 'revoked': revoked, 'heapBytes': None}
+
+    def clear(self):
+        with self._cond:
+            self._rows.clear()
+
+    def download_all(self):
+        """模拟Firefox下载：先创建空的占位文件，写入.part后再重命名"""
+        now = time.monotonic()
+        with self._cond:
+            rows = [r for r in self._rows if not r.failed and r.ready_at <= now]
+
+        def run():
+            lat = self._latency
+            for row in rows:
+                size = row.source.stat().st_size
+                time.sleep(lat.download_base + size / lat.download_rate)
+                target = self._free_name(row.source.stem, _unlocked_suffix(row.source))
+                target.touch()
+                part = target.with_name(target.name + '.part')
+                shutil.copyfile(row.source, part)
+                os.replace(part, target)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _free_name(self, stem: str, suffix: str) -> pathlib.Path:
+        """与Firefox相同，重名时追加"(n)"""
+        path = self.download_dir / (stem + suffix)
+        n = 1
+        while path.exists() or path.with_name(path.name + '.part').exists():
+            path = self.download_dir / f'{stem}({n}){suffix}'
+            n += 1
+        return path
+
+
+class _Session:
+    def __init__(self, download_dir: pathlib.Path, latency: Latency):
+        self.page = FakeUnlockPage(download_dir, latency)
+        self.url = 'about:blank'
+        self.upload_dir = pathlib.Path(tempfile.mkdtemp(prefix='aum-stub-upload-'))
+
+    def close(self):
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+
+class _WebDriverError(Exception):
+    def __init__(self, status: int, error: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.error = error
+
+
+class StubWebDriverServer:
+    """
+    在本地端口上运行的模拟WebDriver服务，可用作上下文管理器
+
+    会话的下载目录取自Firefox配置browser.download.dir（即WebDriverFactory设置的会话下载子目录），
+    未设置时使用download_dir。
+    """
+
+    download_dir: pathlib.Path
+    latency: Latency
+    upload_bytes: int  # 经由/se/file上传的字节数（Base64编码后）
+
+    _server: ThreadingHTTPServer
+    _thread: Optional[threading.Thread]
+    _sessions: dict[str, _Session]
+    _lock: threading.Lock
+
+    def __init__(self, download_dir: pathlib.Path, latency: Latency = Latency(), host: str = '127.0.0.1'):
+        """
+        :param download_dir: 默认的下载目录
+        :param latency: 模拟的耗时
+        :param host: 监听的地址，端口自动分配
+        """
+        self.download_dir = download_dir
+        self.latency = latency
+        self.upload_bytes = 0
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub._handle(self, 'GET')
+
+            def do_POST(self):
+                stub._handle(self, 'POST')
+
+            def do_DELETE(self):
+                stub._handle(self, 'DELETE')
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, 0), Handler)
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/wd/hub'
+
+    def start(self) -> 'StubWebDriverServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def __enter__(self) -> 'StubWebDriverServer':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str):
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = json.loads(handler.rfile.read(length) or b'{}') if length else {}
+
+        try:
+            value = self._dispatch(method, handler.path, body)
+            status, payload = 200, {'value': value}
+        except _WebDriverError as e:
+            status, payload = e.status, {'value': {'error': e.error, 'message': str(e), 'stacktrace': ''}}
+
+        data = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json; charset=utf-8')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _dispatch(self, method: str, path: str, body: dict):
+        match = re.search(r'/(status|session)(?:/([^/]+)(/.*)?)?$', path.split('?')[0])
+        if match is None:
+            raise _WebDriverError(404, 'unknown command', path)
+        kind, sid, rest = match.group(1), match.group(2), match.group(3) or ''
+
+        if kind == 'status':
+            return {'ready': True, 'message': 'stub ready'}
+        if sid is None and method == 'POST':
+            return self._new_session(body)
+
+        with self._lock:
+            session = self._sessions.get(sid)
+        if session is None:
+            raise _WebDriverError(404, 'invalid session id', f'No session {sid}')
+
+        if method == 'DELETE' and rest == '':
+            with self._lock:
+                self._sessions.pop(sid, None)
+            session.close()
+            return None
+        if rest == '/url':
+            if method == 'GET':
+                return session.url
+            session.url = body.get('url', '')
+            session.page.load()
+            return None
+        if rest == '/timeouts':
+            return None
+        if rest == '/element':
+            return self._find_element(body)
+        if rest == '/se/file':
+            return self._receive_file(session, body)
+        if rest == '/execute/sync':
+            script = body.get('script', '')
+            if 'revokeObjectURL' in script:
+                return session.page.reset()
+            if '__aumResults' in script:
+                session.page.release_result(*body.get('args', [''])[:1])
+            elif 'aumErrors' in script:
+                session.page.reset_errors()
+            return None
+        if rest == '/execute/async':
+            script = body.get('script', '')
+            args = body.get('args', [])
+            if 'readAsDataURL' in script:
+                return session.page.read_result(*args[:3])
+            if '__aumTaken' in script:
+                return session.page.next_result(args[0] / 1000)
+            mode, expected, timeout_ms = (args or ['unlocked', 0, 1000])[:3]
+            return session.page.wait_table(mode, expected, timeout_ms / 1000)
+
+        element = re.fullmatch(r'/element/([^/]+)/(click|value)', rest)
+        if element is not None:
+            return self._element_command(session, element.group(1), element.group(2), body)
+        raise _WebDriverError(404, 'unknown command', f'{method} {rest}')
+
+    def _new_session(self, body: dict) -> dict:
+        caps = body.get('capabilities', {}).get('alwaysMatch', {})
+        prefs = caps.get('moz:firefoxOptions', {}).get('prefs', {})
+        download_dir = pathlib.Path(prefs.get('browser.download.dir') or self.download_dir)
+
+        sid = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[sid] = _Session(download_dir, self.latency)
+        return {'sessionId': sid, 'capabilities': {'browserName': 'firefox', 'acceptInsecureCerts': False}}
+
+    @staticmethod
+    def _find_element(body: dict) -> dict:
+        value = body.get('value', '')
+        kind = _ELEMENTS.get(value)
+        if kind is None:
+            raise _WebDriverError(404, 'no such element', f'Unable to locate element: {value}')
+        return {_ELEMENT_KEY: kind}
+
+    def _receive_file(self, session: _Session, body: dict) -> str:
+        """Selenium客户端将文件压缩、Base64编码后上传"""
+        data = body.get('file', '')
+        with self._lock:
+            self.upload_bytes += len(data)
+        with zipfile.ZipFile(io.BytesIO(base64.b64decode(data))) as z:
+            name = z.namelist()[0]
+            target_dir = pathlib.Path(tempfile.mkdtemp(dir=session.upload_dir))
+            z.extract(name, target_dir)
+        return str(target_dir / name)
+
+    @staticmethod
+    def _element_command(session: _Session, element: str, command: str, body: dict):
+        page = session.page
+        if command == 'value':
+            if element != 'upload':
+                raise _WebDriverError(400, 'element not interactable', element)
+            text = body.get('text') or ''.join(body.get('value', []))
+            page.upload([pathlib.Path(p) for p in text.split('\n') if p])
+        elif element == 'download-all':
+            page.download_all()
+        elif element == 'clear-all':
+            page.clear()
+        return None
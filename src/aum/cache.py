@@ -0,0 +1,213 @@
+import hashlib
+import logging
+import os
+import pathlib
+import sqlite3
+import time
+from typing import Iterable, Optional
+
+from aum.helpers.copy import copy_fd
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+'''
+
+
+class UnlockCache:
+    """
+    以加密文件内容为键的解锁结果缓存
+
+    同一首歌以不同文件名或在不同时间再次下载时，直接复用之前的解锁结果而无需再次解锁。
+    键为加密文件后缀与内容的BLAKE2摘要：默认只读取文件大小与开头、结尾各sample_size字节（采样），
+    也可读取全部内容。缓存的结果以独立的副本保存（在支持的文件系统上为reflink），总大小超过上限时按最近使用时间淘汰。
+
+    多个音乐库可同时使用同一个缓存目录：每次查找或存入后立即提交，不会长时间占用数据库的写锁。
+    """
+
+    HASH_SAMPLE = 'sample'
+    HASH_FULL = 'full'
+
+    cache_dir: pathlib.Path
+    max_bytes: int  # 缓存总大小上限，0表示不限
+
+    _hash_mode: str
+    _sample_size: int
+    _conn: sqlite3.Connection
+    _keys: dict[pathlib.Path, str]  # 本次运行中已计算过的源文件 -> 键
+
+    def __init__(self, cache_dir: pathlib.Path, max_bytes: int = 0, hash_mode: str = HASH_SAMPLE,
+                 sample_size: int = 1 << 20):
+        """
+        :param cache_dir: 缓存目录，不存在时自动创建
+        :param max_bytes: 缓存总大小上限，0表示不限
+        :param hash_mode: 计算键的方式，HASH_SAMPLE或HASH_FULL
+        :param sample_size: 采样时读取开头与结尾的字节数
+        """
+        if hash_mode not in {self.HASH_SAMPLE, self.HASH_FULL}:
+            raise ValueError(f'Unknown hash mode: {hash_mode}')
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._hash_mode = hash_mode
+        self._sample_size = sample_size
+        self._keys = {}
+
+        (cache_dir / 'objects').mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(cache_dir / 'index.sqlite3', timeout=30)
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        """提交全部修改并关闭"""
+        self._conn.commit()
+        self._conn.close()
+
+    def __enter__(self) -> 'UnlockCache':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def key(self, path: pathlib.Path) -> str:
+        """加密文件的键，同一次运行中每个文件只计算一次
+
+        :raise OSError: 文件无法读取时
+        """
+        key = self._keys.get(path)
+        if key is not None:
+            return key
+
+        h = hashlib.blake2b(digest_size=20)
+        h.update(path.suffix.lower().encode())
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            h.update(size.to_bytes(8, 'little'))
+            if self._hash_mode == self.HASH_FULL or size <= 2 * self._sample_size:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            else:
+                h.update(f.read(self._sample_size))
+                f.seek(-self._sample_size, os.SEEK_END)
+                h.update(f.read(self._sample_size))
+
+        key = self._keys[path] = h.hexdigest()
+        return key
+
+    def lookup(self, key: str) -> Optional[pathlib.Path]:
+        """查找缓存的解锁结果，命中时更新其最近使用时间
+
+        :return: 缓存中的解锁结果（文件名以解锁后的后缀结尾），未命中时返回None
+        """
+        row = self._conn.execute('SELECT name FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        obj = self._object_path(key, row[0])
+        if not obj.exists():  # 缓存文件被外部删除
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            return None
+        self._conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+        return obj
+
+    def partition(self, files: Iterable[pathlib.Path]
+                  ) -> tuple[dict[pathlib.Path, pathlib.Path], dict[pathlib.Path, list[pathlib.Path]]]:
+        """将待解锁的文件分为缓存命中与需要解锁两部分，内容相同的文件只需解锁其中一个
+
+        :return: 命中的源文件 -> 缓存中的解锁结果；需要解锁的源文件 -> 与之内容相同、可复用其结果的其余源文件，
+                 均保持files中的顺序
+        """
+        hits = {}
+        unlocking = {}
+        first_of_key = {}  # 键 -> 本次需要解锁的第一个文件
+        for p in files:
+            try:
+                key = self.key(p)
+            except OSError as e:
+                logging.warning(f'读取"{p.name}"失败，跳过缓存：{e}')
+                unlocking[p] = []
+                continue
+
+            if key in first_of_key:
+                unlocking[first_of_key[key]].append(p)
+                continue
+            obj = self.lookup(key)
+            if obj is not None:
+                hits[p] = obj
+            else:
+                first_of_key[key] = p
+                unlocking[p] = []
+        self._conn.commit()
+        return hits, unlocking
+
+    def store(self, source: pathlib.Path, result: pathlib.Path) -> Optional[pathlib.Path]:
+        """将源文件的解锁结果存入缓存，必要时淘汰最久未使用的结果
+
+        :param source: 加密的源文件，其键须已通过key()或partition()计算
+        :param result: 解锁结果
+        :return: 缓存中的副本，无法缓存（如超过缓存上限）时返回None
+        """
+        key = self._keys.get(source)
+        if key is None:
+            return None
+
+        size = result.stat().st_size
+        if self.max_bytes and size > self.max_bytes:
+            return None
+
+        obj = self._object_path(key, 'x' + result.suffix)
+        obj.parent.mkdir(exist_ok=True)
+        tmp = obj.with_name('.' + obj.name + '.tmp')
+        try:
+            src_fd = os.open(result, os.O_RDONLY)
+            try:
+                tmp_fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    copy_fd(src_fd, tmp_fd)
+                finally:
+                    os.close(tmp_fd)
+            finally:
+                os.close(src_fd)
+            os.replace(tmp, obj)
+        except OSError as e:
+            logging.warning(f'缓存"{result.name}"失败：{e}')
+            tmp.unlink(missing_ok=True)
+            return None
+
+        self._conn.execute('INSERT OR REPLACE INTO entries (key, name, size, last_used) VALUES (?, ?, ?, ?)',
+                           (key, obj.name, size, time.time()))
+        self._evict(keep=key)
+        self._conn.commit()
+        return obj
+
+    def total_bytes(self) -> int:
+        return self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def _evict(self, keep: str):
+        """淘汰最久未使用的结果，直到总大小不超过上限
+
+        :param keep: 不淘汰的键（刚刚存入的结果）
+        """
+        if not self.max_bytes:
+            return
+
+        excess = self.total_bytes() - self.max_bytes
+        for key, name, size in self._conn.execute(
+                'SELECT key, name, size FROM entries WHERE key != ? ORDER BY last_used', (keep,)).fetchall():
+            if excess <= 0:
+                break
+            self._object_path(key, name).unlink(missing_ok=True)
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            excess -= size
+            logging.debug(f'已从缓存中淘汰{key}。')
+
+    def _object_path(self, key: str, name: str) -> pathlib.Path:
+        """缓存文件的路径，按键的前两位分目录
+
+        :param name: 文件名，只使用其后缀
+        """
+        return self.cache_dir / 'objects' / key[:2] / (key + pathlib.PurePath(name).suffix)
@@ -1,12 +1,15 @@
 import logging
 import logging.config as log_config
 import pathlib
+import re
 from dataclasses import dataclass, field
 from os import environ
 
-import yaml
 from dotenv import load_dotenv, find_dotenv
 
+from aum.driver import FIREFOX_PRESETS
+from aum.rename import RenameEngine
+from aum.schedule import SCHEDULE_ORDERS
 from .helpers import EnvValue, log_depends_bool
 
 load_dotenv()
@@ -42,6 +45,8 @@ class ConfigFactory:
             logging.warning(f'日志配置文件{conf_path}不存在，将使用默认格式。')
             return
 
+        import yaml  # 导入较慢，只在有日志配置文件时导入
+
         with open(conf_path, encoding='utf-8') as f:
             log_conf = yaml.safe_load(f)
         log_config.dictConfig(log_conf)
@@ -49,58 +54,275 @@ class ConfigFactory:
 
 @dataclass(eq=False, frozen=True)
 class Config:
-    sel_hub_url: str = None  # selenium hub url
+    sel_hub_urls: list[str] = field(default_factory=list)  # selenium hub url，可设置多个
 
     unlock_music_server: str = None  # 音乐解锁服务的地址
     unlock_patch_size: int = None  # 分批解锁，每批大小
+    unlock_patch_bytes: int = 0  # 每批输入文件总字节数上限，0表示不限
+    unlock_batching: str = 'fixed'  # 分批方式：fixed（固定上限）或adaptive（根据耗时调整字节数上限）
+    unlock_batch_seconds: int = 60  # 自适应分批时每批期望的耗时，单位秒
+    unlock_order: str = 'scan'  # 解锁顺序，见SCHEDULE_ORDERS
+    unlock_aging: int = 24 * 3600  # 等待超过该时间的加密音乐优先解锁，单位秒，0表示不提前
+    unlock_max_batches: int = 0  # 每次运行最多解锁的批数，0表示不限（常驻模式不限）
+    unlock_backend: str = 'selenium'  # 解锁后端：selenium（浏览器）或local（本地解密，不支持的格式交由浏览器）
+    unlock_transfer: str = 'download'  # 浏览器解锁结果的取回方式：download（经下载目录）或script（由页面脚本读回）
+    unlock_preflight: bool = True  # 解锁前是否按文件头尾识别加密音乐的真实格式，跳过明文音频与无法解锁的文件
+    unlock_workers: int = 1  # 并行的浏览器会话数
+    finalize_workers: int = 1  # 整理（移动、修改所有者）解锁结果的线程数
+    finalize_fsync: bool = True  # 发布解锁结果前是否写入磁盘
+    pipeline_depth: int = 2  # 已下载、等待整理的批次数上限
+    page_reload_batches: int = 20  # 同一次加载的页面最多处理的批数，1表示每批都重新加载，0表示不限
+    page_reload_bytes: int = 1 << 30  # 同一次加载的页面最多处理的字节数（或JS堆大小上限），0表示不限
+    unlock_batch_timeout: int = 900  # 每批从上传到下载完成的时限，单位秒，0表示不限
+    unlock_file_timeout: int = 120  # 等待下一个文件解锁或下载完成的最长时间，单位秒，0表示不限
+    firefox_profile: str = 'lean'  # Firefox配置预设，见FIREFOX_PRESETS
+    firefox_prefs: dict[str, str] = field(default_factory=dict)  # 覆盖预设的Firefox配置
+    daemon_debounce: int = 3  # 常驻模式下，最后一个新文件出现后等待多少秒再开始处理
 
     music_dir: pathlib.Path = None  # 音乐所在文件夹
+    scan_depth: int = 0  # 进入音乐目录的子目录的层数，0表示只处理音乐目录本身，负数表示不限
+    scan_exclude: list[str] = field(default_factory=lambda: ['.*'])  # 扫描时排除的glob，匹配相对音乐目录的路径或名称
+    scan_workers: int = 8  # 并行列出子目录的线程数
     download_dir: pathlib.Path = None  # selenium hub下载目录
+    remote_download_dir: pathlib.PurePosixPath = None  # selenium hub下载目录在浏览器容器内的路径
+    remote_music_dir: pathlib.PurePosixPath = None  # 音乐目录在浏览器容器内的路径，设置后浏览器直接读取待解锁文件
     music_file_uid: int = None  # 音乐所属用户ID
     music_file_gid: int = None  # 音乐所属用户组ID
+    journal: pathlib.Path = None  # 解锁结果的预写日志，用于中途退出后恢复，不设置则不记录
+    state_db: pathlib.Path = None  # 文件状态索引的SQLite数据库路径，不设置则每次运行都完整扫描
+    metrics_textfile: pathlib.Path = None  # 运行指标写入的Prometheus node-exporter textfile路径
+    run_report: pathlib.Path = None  # JSON运行报告的路径
+    profile_dir: pathlib.Path = None  # 各阶段cProfile与tracemalloc快照的保存目录，不设置则不分析
+    cache_dir: pathlib.Path = None  # 解锁结果缓存目录，不设置则不缓存
+    cache_bytes: int = 2 << 30  # 解锁结果缓存的总大小上限，0表示不限
+    cache_hash: str = 'sample'  # 缓存键的计算方式：sample（文件大小与首尾各1MB）或full（全部内容）
 
     locked_suffixes: set[str] = field(default_factory=set)  # 待解锁的后缀
     unlocked_suffixes: set[str] = field(default_factory=set)  # 已解锁的音乐文件后缀
     removing_substr: set[str] = field(default_factory=set)  # 文件名中需要移除的多余子串
+    rename_regex: list[tuple[str, str]] = field(default_factory=list)  # 依次应用于文件名stem的(正则表达式, 替换串)
+    rename_template: str = '{stem}{suffix}'  # 新文件名的模板，可使用文件标签
+    tag_cache: pathlib.Path = None  # 文件标签的持久化缓存，不设置则每次运行重新读取
+
+    library: str = None  # 音乐库名称，为None时为全局配置
+    libraries: list['Config'] = field(default_factory=list)  # 各音乐库的配置，为空时只处理music_dir
 
     def __post_init__(self):
         """在日志中输出配置"""
-        log_depends_bool('Selenium Hub', self.sel_hub_url)
+        if self.library is not None:  # 音乐库的配置随全局配置一同输出
+            return
+
+        log_depends_bool('Selenium Hub', '、'.join(self.sel_hub_urls))
         log_depends_bool('Unlock Music服务地址', self.unlock_music_server)
 
         if self.unlock_patch_size == 0:
             logging.info('分批设置：不分批')
         else:
             logging.info(f'分批设置：一批最多{self.unlock_patch_size}个')
+        if self.unlock_batching == 'adaptive':
+            logging.info(f'自适应分批：每批约{self.unlock_batch_seconds}秒，'
+                         f'初始上限{(self.unlock_patch_bytes >> 20) or 64}MB')
+        elif self.unlock_patch_bytes:
+            logging.info(f'分批设置：一批最多{self.unlock_patch_bytes >> 20}MB')
+
+        if self.unlock_order == 'scan':
+            logging.info('解锁顺序：扫描顺序')
+        else:
+            logging.info(f'解锁顺序：{self.unlock_order}，等待超过{self.unlock_aging // 3600 or "∞"}小时的优先')
+        logging.info(f'每次运行最多解锁：{self.unlock_max_batches or "∞"}批')
+        logging.info(f'解锁后端：{self.unlock_backend}')
+        logging.info(f'浏览器解锁结果取回方式：{self.unlock_transfer}')
+        logging.info(f'解锁前预检：{"是" if self.unlock_preflight else "否"}')
+        logging.info(f'并行会话数：{self.unlock_workers}')
+        logging.info(f'整理线程数：{self.finalize_workers}，最多{self.pipeline_depth}批等待整理')
+        logging.info(f'发布前写入磁盘：{"是" if self.finalize_fsync else "否"}')
+        logging.info(f'页面重新加载：每{self.page_reload_batches or "∞"}批或{(self.page_reload_bytes >> 20) or "∞"}MB')
+        logging.info(f'解锁时限：每批{self.unlock_batch_timeout or "∞"}秒，每首{self.unlock_file_timeout or "∞"}秒')
+        logging.info(f'Firefox配置预设：{self.firefox_profile}')
+        log_depends_bool('自定义Firefox配置', '；'.join(f'{k}={v}' for k, v in self.firefox_prefs.items()))
+        logging.info(f'常驻模式去抖时间：{self.daemon_debounce}秒')
 
         log_depends_bool('Selenium Hub下载目录', self.download_dir)
 
         log_depends_bool('音乐目录', self.music_dir)
-        log_depends_bool('Selenium Hub下载目录', self.download_dir)
+        if self.scan_depth:
+            logging.info(f'子目录：{"不限层数" if self.scan_depth < 0 else f"{self.scan_depth}层"}，'
+                         f'{self.scan_workers}个线程')
+        else:
+            logging.info('子目录：不处理')
+        log_depends_bool('扫描时排除', '；'.join(self.scan_exclude))
+        log_depends_bool('浏览器容器内下载目录', self.remote_download_dir)
+        log_depends_bool('浏览器容器内音乐目录', self.remote_music_dir)
+        log_depends_bool('文件状态索引', self.state_db)
+        log_depends_bool('解锁日志', self.journal)
+        log_depends_bool('运行指标文件', self.metrics_textfile)
+        log_depends_bool('运行报告', self.run_report)
+        log_depends_bool('性能分析目录', self.profile_dir)
+        log_depends_bool('解锁结果缓存', self.cache_dir)
+        if self.cache_dir is not None:
+            logging.info(f'缓存上限：{(self.cache_bytes >> 20) or "∞"}MB，键：{self.cache_hash}')
 
         log_depends_bool('待解锁的后缀', self.locked_suffixes)
         log_depends_bool('已解锁的后缀', self.unlocked_suffixes)
         log_depends_bool('将要移除的子串', self.removing_substr)
+        log_depends_bool('重命名正则规则', '；'.join(f'{p} -> {r}' for p, r in self.rename_regex))
+        logging.info(f'文件名模板：{self.rename_template}')
+        log_depends_bool('标签缓存', self.tag_cache)
+
+        for library in self.libraries:
+            logging.info(f'音乐库{library.library}：{library.music_dir}，'
+                         f'所有者{library.music_file_uid}:{library.music_file_gid}，索引{library.state_db}')
+            if library.locked_suffixes != self.locked_suffixes:
+                log_depends_bool(f'音乐库{library.library}待解锁的后缀', library.locked_suffixes)
+            if library.unlocked_suffixes != self.unlocked_suffixes:
+                log_depends_bool(f'音乐库{library.library}已解锁的后缀', library.unlocked_suffixes)
+            if library.removing_substr != self.removing_substr:
+                log_depends_bool(f'音乐库{library.library}将要移除的子串', library.removing_substr)
+            if library.rename_regex != self.rename_regex:
+                log_depends_bool(f'音乐库{library.library}重命名正则规则',
+                                 '；'.join(f'{p} -> {r}' for p, r in library.rename_regex))
+            if library.rename_template != self.rename_template:
+                logging.info(f'音乐库{library.library}文件名模板：{library.rename_template}')
+
+    def library_configs(self) -> list['Config']:
+        """需要处理的各音乐库的配置，未设置多个音乐库时为全局配置本身"""
+        return self.libraries or [self]
 
     @classmethod
     def from_env(cls) -> 'Config':
         properties = {}
         try:
-            properties = {'sel_hub_url': EnvValue('AUM_SELENIUM_HUB', None).raw(),
+            remote_download_dir = EnvValue('AUM_REMOTE_DOWNLOAD_DIR', None).raw()
+            remote_music_dir = EnvValue('AUM_REMOTE_MUSIC_DIR', None).raw()
+            state_db = EnvValue('AUM_STATE_DB', None)
+            journal = EnvValue('AUM_JOURNAL', None)
+            metrics_textfile = EnvValue('AUM_METRICS_TEXTFILE', None)
+            run_report = EnvValue('AUM_RUN_REPORT', None)
+            profile_dir = EnvValue('AUM_PROFILE', None)
+            cache_dir = EnvValue('AUM_CACHE_DIR', None)
+            tag_cache = EnvValue('AUM_TAG_CACHE', None)
+            properties = {'sel_hub_urls': EnvValue('AUM_SELENIUM_HUB', '').to_str_list(),
                           'unlock_music_server': EnvValue('AUM_UNLOCK_SERVER', None).raw(),
                           'unlock_patch_size': EnvValue('AUM_UNLOCK_PATCH_SIZE', '0').to_int(non_negative=True),
+                          'unlock_patch_bytes': EnvValue('AUM_UNLOCK_PATCH_MB', '0').to_int(non_negative=True) << 20,
+                          'unlock_batching': EnvValue('AUM_UNLOCK_BATCHING', 'fixed').to_choice({'fixed', 'adaptive'}),
+                          'unlock_batch_seconds': EnvValue('AUM_UNLOCK_BATCH_SECONDS', '60').to_int(non_negative=True)
+                                                  or 60,
+                          'unlock_order': EnvValue('AUM_UNLOCK_ORDER', 'scan').to_choice(set(SCHEDULE_ORDERS)),
+                          'unlock_aging': EnvValue('AUM_UNLOCK_AGING_HOURS', '24').to_int(non_negative=True) * 3600,
+                          'unlock_max_batches': EnvValue('AUM_UNLOCK_MAX_BATCHES', '0').to_int(non_negative=True),
+                          'unlock_backend': EnvValue('AUM_UNLOCK_BACKEND', 'selenium').to_choice(
+                              {'selenium', 'local'}),
+                          'unlock_transfer': EnvValue('AUM_UNLOCK_TRANSFER', 'download').to_choice(
+                              {'download', 'script'}),
+                          'unlock_preflight': EnvValue('AUM_UNLOCK_PREFLIGHT', 'true').to_bool(),
+                          'unlock_workers': EnvValue('AUM_UNLOCK_WORKERS', '1').to_int(non_negative=True) or 1,
+                          'finalize_workers': EnvValue('AUM_FINALIZE_WORKERS', '1').to_int(non_negative=True) or 1,
+                          'finalize_fsync': EnvValue('AUM_FINALIZE_FSYNC', 'true').to_bool(),
+                          'pipeline_depth': EnvValue('AUM_PIPELINE_DEPTH', '2').to_int(non_negative=True) or 1,
+                          'page_reload_batches': EnvValue('AUM_PAGE_RELOAD_BATCHES', '20').to_int(non_negative=True),
+                          'page_reload_bytes': EnvValue('AUM_PAGE_RELOAD_MB', '1024').to_int(non_negative=True) << 20,
+                          'unlock_batch_timeout': EnvValue('AUM_UNLOCK_BATCH_TIMEOUT', '900').to_int(
+                              non_negative=True),
+                          'unlock_file_timeout': EnvValue('AUM_UNLOCK_FILE_TIMEOUT', '120').to_int(non_negative=True),
+                          'firefox_profile': EnvValue('AUM_FIREFOX_PROFILE', 'lean').to_choice(set(FIREFOX_PRESETS)),
+                          'firefox_prefs': EnvValue('AUM_FIREFOX_PREFS', '').to_str_dict(),
+                          'daemon_debounce': EnvValue('AUM_DAEMON_DEBOUNCE', '3').to_int(non_negative=True),
                           'music_dir': EnvValue('AUM_MUSIC_DIR').to_path(),
+                          'scan_depth': EnvValue('AUM_SCAN_DEPTH', '0').to_int(),
+                          'scan_exclude': EnvValue('AUM_SCAN_EXCLUDE', '.*').to_str_list(),
+                          'scan_workers': EnvValue('AUM_SCAN_WORKERS', '8').to_int(non_negative=True) or 1,
                           'music_file_uid': EnvValue('AUM_MUSIC_UID').to_int(non_negative=True),
                           'music_file_gid': EnvValue('AUM_MUSIC_GID').to_int(non_negative=True),
                           'download_dir': EnvValue('AUM_DOWNLOAD_DIR').to_path(),
+                          'remote_download_dir': pathlib.PurePosixPath(remote_download_dir)
+                          if remote_download_dir else None,
+                          'remote_music_dir': pathlib.PurePosixPath(remote_music_dir)
+                          if remote_music_dir else None,
+                          'state_db': state_db.to_path(warn_if_not_exists=False) if state_db.raw() else None,
+                          'journal': journal.to_path(warn_if_not_exists=False) if journal.raw() else None,
+                          'metrics_textfile': metrics_textfile.to_path(warn_if_not_exists=False)
+                          if metrics_textfile.raw() else None,
+                          'run_report': run_report.to_path(warn_if_not_exists=False) if run_report.raw() else None,
+                          'profile_dir': profile_dir.to_path(warn_if_not_exists=False) if profile_dir.raw() else None,
+                          'cache_dir': cache_dir.to_path(warn_if_not_exists=False) if cache_dir.raw() else None,
+                          'cache_bytes': EnvValue('AUM_CACHE_MB', '2048').to_int(non_negative=True) << 20,
+                          'cache_hash': EnvValue('AUM_CACHE_HASH', 'sample').to_choice({'sample', 'full'}),
                           'locked_suffixes': EnvValue('AUM_LOCKED_SUFFIXES', '').to_str_set(),
                           'unlocked_suffixes': EnvValue('AUM_UNLOCKED_SUFFIXES', '').to_str_set(),
-                          'removing_substr': EnvValue('AUM_REMOVING_SUBSTR', '').to_str_set()}
+                          'removing_substr': EnvValue('AUM_REMOVING_SUBSTR', '').to_str_set(),
+                          'rename_regex': _rename_rules(EnvValue('AUM_RENAME_REGEX', '')),
+                          'rename_template': EnvValue('AUM_RENAME_TEMPLATE', '{stem}{suffix}').to_str(),
+                          'tag_cache': tag_cache.to_path(warn_if_not_exists=False) if tag_cache.raw() else None}
+            _check_rename_rules(properties)
+
+            # 移除所有None value
+            properties = {k: v for k, v in properties.items() if v is not None}
+
+            library_names = EnvValue('AUM_LIBRARIES', '').to_str_list()
+            if len({name.upper() for name in library_names}) < len(library_names):
+                logging.error('音乐库名称重复（不区分大小写）！')
+                raise ValueError(f'Duplicate library names: {library_names}')
+            libraries = [cls(**cls._library_properties(name, properties)) for name in library_names]
         except ValueError as e:
             logging.debug(e)
             exit(1)
 
-        # 移除所有None value
-        properties = {k: v for k, v in properties.items() if v is not None}
+        return cls(**properties, libraries=libraries)
+
+    @staticmethod
+    def _library_properties(name: str, properties: dict) -> dict:
+        """音乐库name的配置项，由AUM_LIB_<NAME>_*设置，未设置的沿用全局配置
+
+        :param properties: 全局配置项
+        :raise ValueError: 名称无效、未设置音乐目录或配置项无效时
+        """
+        if not re.fullmatch(r'[A-Za-z0-9_]+', name):
+            logging.error(f'音乐库名称"{name}"无效，只能包含字母、数字与下划线。')
+            raise ValueError(f'Invalid library name: {name}')
+
+        prefix = f'AUM_LIB_{name.upper()}_'
+        music_dir = EnvValue(prefix + 'MUSIC_DIR').to_path()
+
+        library = dict(properties, library=name, music_dir=music_dir)
+        for key, env_name in (('music_file_uid', 'MUSIC_UID'), ('music_file_gid', 'MUSIC_GID')):
+            value = EnvValue(prefix + env_name, None)
+            if value.raw():
+                library[key] = value.to_int(non_negative=True)
+        for key, env_name in (('locked_suffixes', 'LOCKED_SUFFIXES'), ('unlocked_suffixes', 'UNLOCKED_SUFFIXES'),
+                              ('removing_substr', 'REMOVING_SUBSTR')):
+            value = EnvValue(prefix + env_name, None)
+            if value.raw() is not None:
+                library[key] = value.to_str_set()
+        rename_regex = EnvValue(prefix + 'RENAME_REGEX', None)
+        if rename_regex.raw() is not None:
+            library['rename_regex'] = _rename_rules(rename_regex)
+        rename_template = EnvValue(prefix + 'RENAME_TEMPLATE', None)
+        if rename_template.raw():
+            library['rename_template'] = rename_template.to_str()
+        _check_rename_rules(library)
+
+        # 各音乐库使用各自的索引，默认位于各自的音乐目录下，避免多个线程争用同一个数据库
+        state_db = EnvValue(prefix + 'STATE_DB', None)
+        if state_db.raw():
+            library['state_db'] = state_db.to_path(warn_if_not_exists=False)
+        elif 'state_db' in properties:
+            library['state_db'] = music_dir / properties['state_db'].name
+        return library
+
+
+def _rename_rules(value: EnvValue) -> list[tuple[str, str]]:
+    """解析"正则表达式=>替换串"形式的重命名规则，省略"=>"时替换为空串"""
+    return [tuple(rule.split('=>', 1)) if '=>' in rule else (rule, '') for rule in value.to_str_list()]
+
+
+def _check_rename_rules(properties: dict):
+    """检查重命名规则能否编译
 
-        return cls(**properties)
+    :raise ValueError: 规则无效时
+    """
+    try:
+        RenameEngine((), properties['rename_regex'], properties['rename_template'])
+    except ValueError as e:
+        logging.error(f'重命名规则无效：{e}')
+        raise
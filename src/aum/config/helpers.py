@@ -58,6 +58,37 @@ class EnvValue:
 
         return value
 
+    def to_choice(self, choices: set[str]) -> str:
+        """将环境变量解析为若干可选值之一
+
+        :param choices: 可选值集合
+        :return: 环境变量值
+        :raise ValueError: 当环境变量值为None或不在可选值中时
+        """
+        self._check_none('可选值')
+
+        if self._env_value not in choices:
+            logging.error(f'环境变量"{self._env_var}"必须为{"、".join(sorted(choices))}之一！')
+            raise ValueError(f'Value of env "{self._env_var}" must be one of {sorted(choices)} '
+                             f'(value: {self._env_value}).')
+        return self._env_value
+
+    def to_bool(self) -> bool:
+        """将环境变量解析为布尔值，可为true/false、yes/no、on/off或1/0（不区分大小写）
+
+        :return: 布尔值
+        :raise ValueError: 当环境变量值为None或无法解析时
+        """
+        self._check_none('布尔值')
+
+        value = self._env_value.strip().lower()
+        if value in {'true', 'yes', 'on', '1'}:
+            return True
+        if value in {'false', 'no', 'off', '0'}:
+            return False
+        logging.error(f'环境变量"{self._env_var}"必须为true或false！')
+        raise ValueError(f'Value of env "{self._env_var}" is not a boolean (value: {self._env_value}).')
+
     def to_path(self, warn_if_not_exists: bool = True) -> pathlib.Path:
         """将环境变量解析为路径
 
@@ -88,6 +119,40 @@ class EnvValue:
             str_set.discard('')
         return str_set
 
+    def to_str_list(self, sep: str = ';', discard_empty: bool = True) -> list[str]:
+        """解析字符串表示的有序列表，重复项只保留第一个
+
+        :param sep: 分隔符
+        :param discard_empty: 是否忽略列表内的空字符串
+        :return: 解析后的字符串list
+        :raise ValueError: 当环境变量值为None时
+        """
+        self._check_none('字符串列表')
+
+        str_list = list(dict.fromkeys(self._env_value.split(sep)))
+        if discard_empty:
+            str_list = [i for i in str_list if i != '']
+        return str_list
+
+    def to_str_dict(self, sep: str = ';', kv_sep: str = '=') -> dict[str, str]:
+        """解析"键=值"组成的列表
+
+        :param sep: 各项之间的分隔符
+        :param kv_sep: 键与值之间的分隔符
+        :return: 键 -> 值，重复的键以最后一个为准
+        :raise ValueError: 当环境变量值为None或某一项缺少分隔符时
+        """
+        self._check_none('键值列表')
+
+        result = {}
+        for item in self.to_str_list(sep):
+            if kv_sep not in item:
+                logging.error(f'环境变量"{self._env_var}"的每一项都必须为"键{kv_sep}值"！')
+                raise ValueError(f'Item "{item}" of env "{self._env_var}" has no "{kv_sep}".')
+            key, value = item.split(kv_sep, 1)
+            result[key.strip()] = value.strip()
+        return result
+
     def _check_none(self, target_name: str) -> None:
         """检查该环境变量是否为None，若是则报错
 
@@ -0,0 +1,5 @@
+from .decoder import Decoder, decode_to_temp, sniff_audio_suffix
+from .ncm import NcmDecoder
+from .qmc import QmcDecoder
+
+DECODERS: dict[str, type[Decoder]] = {s: cls for cls in (NcmDecoder, QmcDecoder) for s in cls.suffixes}  # 后缀 -> 解码器
@@ -0,0 +1,106 @@
+"""
+纯Python实现的AES-128 ECB解密，仅用于解出NCM文件头部的少量密钥数据
+"""
+from aum.exceptions import DecryptError
+
+
+def _gf_mul(a: int, b: int) -> int:
+    """GF(2^8)上的乘法"""
+    p = 0
+    while b:
+        if b & 1:
+            p ^= a
+        a <<= 1
+        if a & 0x100:
+            a ^= 0x11B
+        b >>= 1
+    return p
+
+
+def _build_sboxes() -> tuple[list[int], list[int]]:
+    """由有限域求逆与仿射变换生成S盒及其逆"""
+    # 以3为生成元构造指数/对数表求逆元
+    exp = [0] * 255
+    log = [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x = _gf_mul(x, 3)
+    inverse = [0] + [exp[(255 - log[i]) % 255] for i in range(1, 256)]
+
+    sbox = [0] * 256
+    for i in range(256):
+        x = inverse[i]
+        s = x
+        for shift in range(1, 5):
+            s ^= ((x << shift) | (x >> (8 - shift))) & 0xFF
+        sbox[i] = s ^ 0x63
+
+    inv_sbox = [0] * 256
+    for i, s in enumerate(sbox):
+        inv_sbox[s] = i
+    return sbox, inv_sbox
+
+
+_SBOX, _INV_SBOX = _build_sboxes()
+_MUL = {c: [_gf_mul(i, c) for i in range(256)] for c in (9, 11, 13, 14)}
+
+
+def _expand_key(key: bytes) -> list[list[int]]:
+    """AES-128密钥扩展，返回11个轮密钥"""
+    words = [list(key[i:i + 4]) for i in range(0, 16, 4)]
+    rcon = 1
+    for i in range(4, 44):
+        t = words[i - 1].copy()
+        if i % 4 == 0:
+            t = t[1:] + t[:1]
+            t = [_SBOX[b] for b in t]
+            t[0] ^= rcon
+            rcon = _gf_mul(rcon, 2)
+        words.append([a ^ b for a, b in zip(words[i - 4], t)])
+    return [sum(words[r * 4:r * 4 + 4], []) for r in range(11)]
+
+
+def _decrypt_block(block: bytes, round_keys: list[list[int]]) -> bytes:
+    s = [b ^ k for b, k in zip(block, round_keys[10])]
+    m9, m11, m13, m14 = _MUL[9], _MUL[11], _MUL[13], _MUL[14]
+    for r in range(9, -1, -1):
+        # InvShiftRows + InvSubBytes（状态按列存储，第c列第r行位于下标4c+r）
+        s = [_INV_SBOX[s[((c - row) % 4) * 4 + row]] for c in range(4) for row in range(4)]
+        s = [b ^ k for b, k in zip(s, round_keys[r])]
+        if r == 0:
+            break
+        # InvMixColumns
+        mixed = []
+        for c in range(4):
+            a0, a1, a2, a3 = s[c * 4:c * 4 + 4]
+            mixed += [m14[a0] ^ m11[a1] ^ m13[a2] ^ m9[a3],
+                      m9[a0] ^ m14[a1] ^ m11[a2] ^ m13[a3],
+                      m13[a0] ^ m9[a1] ^ m14[a2] ^ m11[a3],
+                      m11[a0] ^ m13[a1] ^ m9[a2] ^ m14[a3]]
+        s = mixed
+    return bytes(s)
+
+
+def aes128_ecb_decrypt(data: bytes, key: bytes, unpad: bool = True) -> bytes:
+    """AES-128 ECB解密
+
+    :param data: 密文，长度须为16的倍数
+    :param key: 16字节密钥
+    :param unpad: 是否移除PKCS#7填充
+    :return: 明文
+    :raise DecryptError: 密文长度或填充不合法时
+    """
+    if len(key) != 16 or len(data) % 16 != 0:
+        raise DecryptError(f'Invalid AES-128 input (key: {len(key)} bytes, data: {len(data)} bytes).')
+
+    round_keys = _expand_key(key)
+    plain = b''.join(_decrypt_block(data[i:i + 16], round_keys) for i in range(0, len(data), 16))
+
+    if unpad:
+        pad = plain[-1] if plain else 0
+        if not 1 <= pad <= 16 or plain[-pad:] != bytes([pad]) * pad:
+            raise DecryptError('Invalid PKCS#7 padding.')
+        plain = plain[:-pad]
+    return plain
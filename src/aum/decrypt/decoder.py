@@ -0,0 +1,101 @@
+import os
+import pathlib
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Optional
+
+from aum.exceptions import DecryptError
+
+
+def sniff_audio_suffix(head: bytes) -> Optional[str]:
+    """根据文件头判断音频格式
+
+    :param head: 文件开头的若干字节（至少12字节）
+    :return: 对应的后缀（如".flac"），无法识别时返回None
+    """
+    if head.startswith(b'fLaC'):
+        return '.flac'
+    if head.startswith(b'ID3'):
+        return '.mp3'
+    if head.startswith(b'OggS'):
+        return '.ogg'
+    if head[4:8] == b'ftyp':
+        return '.m4a'
+    if head.startswith(b'RIFF') and head[8:12] == b'WAVE':
+        return '.wav'
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:  # 无ID3标签的MPEG帧
+        return '.mp3'
+    return None
+
+
+class Decoder(ABC):
+    """
+    加密音乐格式的解码器，负责解析文件结构并按偏移解密音频数据
+    """
+
+    suffixes: tuple[str, ...] = ()  # 支持的加密文件后缀
+    scheme: str = ''  # 加密方式的名称，与预检识别出的加密方式对应
+
+    audio_offset: int  # 音频数据在文件内的起始位置
+    audio_size: int  # 音频数据长度
+
+    def __init__(self, fp: BinaryIO, size: int):
+        """
+        :param fp: 以二进制模式打开的加密文件
+        :param size: 文件大小
+        :raise DecryptError: 文件结构不合法或缺少密钥时
+        """
+        self._parse(fp, size)
+
+    @abstractmethod
+    def _parse(self, fp: BinaryIO, size: int):
+        """解析文件结构，设置audio_offset、audio_size并准备密钥"""
+
+    @abstractmethod
+    def decrypt(self, data: bytes, offset: int) -> bytes:
+        """解密一段音频数据
+
+        :param data: 密文
+        :param offset: 该段数据相对音频起点的偏移
+        :return: 明文
+        """
+
+
+def decode_to_temp(decoder_cls: type[Decoder],
+                   src: pathlib.Path,
+                   tmp_dir: pathlib.Path,
+                   chunk_size: int = 1 << 20
+                   ) -> tuple[pathlib.Path, str]:
+    """分块解密一个文件，写入tmp_dir下的临时文件，由调用方发布
+
+    :param decoder_cls: 解码器类型
+    :param src: 加密文件
+    :param tmp_dir: 临时文件所在的目录，应与发布的目录在同一文件系统中
+    :param chunk_size: 每次读取并解密的字节数
+    :return: 临时文件（以"."开头，不会被当作新文件处理），以及根据解密结果判断的音频后缀
+    :raise DecryptError: 解密失败或解密结果不是可识别的音频时，临时文件已删除
+    """
+    with open(src, 'rb') as fin:
+        decoder = decoder_cls(fin, os.fstat(fin.fileno()).st_size)
+
+        fin.seek(decoder.audio_offset)
+        first = decoder.decrypt(fin.read(min(chunk_size, decoder.audio_size)), 0)
+        suffix = sniff_audio_suffix(first)
+        if suffix is None:
+            raise DecryptError(f'Decrypted data of "{src.name}" is not a known audio format.')
+
+        tmp = tmp_dir / f'.{src.name}.aum-decoded'
+        try:
+            with open(tmp, 'wb') as fout:
+                fout.write(first)
+                offset = len(first)
+                while offset < decoder.audio_size:
+                    chunk = fin.read(min(chunk_size, decoder.audio_size - offset))
+                    if not chunk:
+                        raise DecryptError(f'"{src.name}" is truncated.')
+                    fout.write(decoder.decrypt(chunk, offset))
+                    offset += len(chunk)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+    return tmp, suffix
+
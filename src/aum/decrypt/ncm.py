@@ -0,0 +1,72 @@
+"""
+网易云音乐加密格式（ncm）
+"""
+import struct
+from typing import BinaryIO
+
+from aum.exceptions import DecryptError
+from .aes import aes128_ecb_decrypt
+from .decoder import Decoder
+from .xor import periodic_mask, xor_bytes
+
+_MAGIC = b'CTENFDAM'
+_CORE_KEY = bytes.fromhex('687A4852416D736F356B496E62617857')
+_KEY_PREFIX = b'neteasecloudmusic'
+
+
+class NcmDecoder(Decoder):
+    suffixes = ('.ncm',)
+    scheme = 'ncm'
+    magic = _MAGIC
+
+    def _parse(self, fp: BinaryIO, size: int):
+        fp.seek(0)
+        if fp.read(8) != _MAGIC:
+            raise DecryptError('Not a ncm file.')
+        fp.seek(2, 1)  # 跳过2字节间隙
+
+        # 解出RC4密钥
+        (key_len,) = struct.unpack('<I', fp.read(4))
+        key_data = bytes(b ^ 0x64 for b in fp.read(key_len))
+        key = aes128_ecb_decrypt(key_data, _CORE_KEY)
+        if not key.startswith(_KEY_PREFIX):
+            raise DecryptError('Invalid ncm key.')
+        key = key[len(_KEY_PREFIX):]
+        if not key:
+            raise DecryptError('Empty ncm key.')
+
+        # 跳过元数据（音频格式由解密后的文件头判断）
+        (meta_len,) = struct.unpack('<I', fp.read(4))
+        fp.seek(meta_len, 1)
+
+        # 跳过封面：CRC32与间隙共5字节，随后依次为封面帧长度、图片长度与图片
+        fp.seek(5, 1)
+        frame_len, image_len = struct.unpack('<II', fp.read(8))
+        self.audio_offset = fp.tell() + max(frame_len, image_len)
+        if self.audio_offset >= size:
+            raise DecryptError('No audio data in ncm file.')
+        self.audio_size = size - self.audio_offset
+
+        self._stream = self._key_stream(key)
+
+    @staticmethod
+    def _key_stream(key: bytes) -> bytes:
+        """以RC4的KSA打乱S盒，并生成周期为256的密钥流"""
+        box = list(range(256))
+        last = 0
+        key_len = len(key)
+        for i in range(256):
+            swap = box[i]
+            c = (swap + last + key[i % key_len]) & 0xFF
+            box[i] = box[c]
+            box[c] = swap
+            last = c
+
+        stream = bytearray(256)
+        for i in range(256):
+            j = (i + 1) & 0xFF
+            stream[i] = box[(box[j] + box[(box[j] + j) & 0xFF]) & 0xFF]
+        return bytes(stream)
+
+    def decrypt(self, data: bytes, offset: int) -> bytes:
+        return xor_bytes(data, periodic_mask(self._stream, offset, len(data)))
@@ -0,0 +1,179 @@
+"""
+QQ音乐加密格式（内嵌密钥的QMCv2：mflac、mgg等）
+"""
+import base64
+import math
+from typing import BinaryIO
+
+from aum.exceptions import DecryptError
+from .decoder import Decoder
+from .tea import tc_tea_decrypt
+from .xor import periodic_mask, xor_bytes
+
+_ENC_V2_PREFIX = b'QQMusic EncV2,Key:'
+_MIX_KEY_1 = b'386ZJY!@#*$%^&)('
+_MIX_KEY_2 = b'**#!(#$%&^a1cZ,T'
+_MAX_KEY_LEN = 0x1000  # 文件尾部裸密钥的最大长度，超过则认为没有内嵌密钥
+
+
+def _simple_make_key(salt: int, length: int) -> bytes:
+    return bytes(int(abs(math.tan(salt + i * 0.1)) * 100.0) & 0xFF for i in range(length))
+
+
+def derive_key(ekey: bytes) -> bytes:
+    """由文件尾部的ekey解出真正的密钥
+
+    :param ekey: base64编码的ekey
+    :return: 密钥
+    :raise DecryptError: ekey不合法时
+    """
+    try:
+        raw = base64.b64decode(ekey)
+        if raw.startswith(_ENC_V2_PREFIX):
+            raw = tc_tea_decrypt(raw[len(_ENC_V2_PREFIX):], _MIX_KEY_1)
+            raw = tc_tea_decrypt(raw, _MIX_KEY_2)
+            raw = base64.b64decode(raw)
+    except ValueError as e:
+        raise DecryptError(f'Invalid ekey: {e}') from e
+
+    if len(raw) < 16:
+        raise DecryptError(f'ekey too short ({len(raw)} bytes).')
+
+    simple_key = _simple_make_key(106, 8)
+    tea_key = bytes(b for pair in zip(simple_key, raw[:8]) for b in pair)
+    return raw[:8] + tc_tea_decrypt(raw[8:], tea_key)
+
+
+class _MapCipher:
+    """密钥长度不超过300字节时使用的映射加密，其掩码序列在0x7FFF后呈周期性，可一次算出"""
+
+    def __init__(self, key: bytes):
+        n = len(key)
+        mask = bytearray(0x8000)
+        for offset in range(0x8000):
+            idx = (offset * offset + 71214) % n
+            rotate = ((idx & 0x7) + 4) % 8
+            value = key[idx]
+            mask[offset] = ((value << rotate) | (value >> rotate)) & 0xFF
+        self._head = bytes(mask)  # 偏移0~0x7FFF的掩码
+        self._period = self._head[:0x7FFF]  # 偏移超过0x7FFF后按0x7FFF取模循环
+
+    def decrypt(self, data: bytes, offset: int) -> bytes:
+        n = len(data)
+        parts = []
+        if offset <= 0x7FFF:
+            head = self._head[offset:offset + n]
+            parts.append(head)
+            offset += len(head)
+        rest = n - sum(len(p) for p in parts)
+        if rest > 0:
+            parts.append(periodic_mask(self._period, offset, rest))
+        return xor_bytes(data, b''.join(parts))
+
+
+class _RC4Cipher:
+    """密钥长度超过300字节时使用的分段RC4加密
+
+    每段都从同一个初始状态开始，只是丢弃的字节数（段密钥加段内偏移）不同，因此各段的密钥流都是同一条RC4
+    密钥流的切片：构造时算出一次（密钥长度加一段的长度），解密时只需截取并向量化异或。
+    """
+
+    _FIRST_SEGMENT_SIZE = 0x80
+    _SEGMENT_SIZE = 0x1400
+
+    def __init__(self, key: bytes):
+        n = len(key)
+        self._key = key
+        self._n = n
+
+        box = bytearray(i & 0xFF for i in range(n))
+        j = 0
+        for i in range(n):
+            j = (j + box[i] + key[i]) % n
+            box[i], box[j] = box[j], box[i]
+
+        h = 1
+        for v in key:
+            if v == 0:
+                continue
+            next_h = (h * v) & 0xFFFFFFFF
+            if next_h == 0 or next_h <= h:
+                break
+            h = next_h
+        self._hash = h
+
+        # 段密钥小于n，段内偏移小于一段的长度
+        stream = bytearray(n + self._SEGMENT_SIZE)
+        j = k = 0
+        for i in range(len(stream)):
+            j = (j + 1) % n
+            k = (box[j] + k) % n
+            box[j], box[k] = box[k], box[j]
+            stream[i] = box[(box[j] + box[k]) % n]
+        self._stream = bytes(stream)
+        self._first_mask = bytes(key[self._segment_key(i)] for i in range(self._FIRST_SEGMENT_SIZE))
+
+    def _segment_key(self, seg_id: int) -> int:
+        seed = self._key[seg_id % self._n]
+        if seed == 0:
+            return 0
+        return int(self._hash / ((seg_id + 1) * seed) * 100.0) % self._n
+
+    def decrypt(self, data: bytes, offset: int) -> bytes:
+        parts = []
+        pos = 0
+        total = len(data)
+        if offset < self._FIRST_SEGMENT_SIZE:
+            size = min(total, self._FIRST_SEGMENT_SIZE - offset)
+            parts.append(self._first_mask[offset:offset + size])
+            pos += size
+        while pos < total:
+            seg_id, seg_pos = divmod(offset + pos, self._SEGMENT_SIZE)
+            size = min(total - pos, self._SEGMENT_SIZE - seg_pos)
+            skip = self._segment_key(seg_id) + seg_pos
+            parts.append(self._stream[skip:skip + size])
+            pos += size
+        return xor_bytes(data, b''.join(parts))
+
+
+class QmcDecoder(Decoder):
+    """内嵌密钥的QQ音乐加密文件
+
+    仅依赖静态密码表的旧版文件（无内嵌密钥）与STag等需要在线取得密钥的文件不在支持范围内。
+    """
+
+    suffixes = ('.qmc0', '.qmc2', '.qmc3', '.qmcflac', '.qmcogg',
+                '.mflac', '.mflac0', '.mgg', '.mgg1', '.mggl')
+    scheme = 'qmc'
+
+    def _parse(self, fp: BinaryIO, size: int):
+        if size < 8:
+            raise DecryptError('File too small.')
+
+        fp.seek(size - 4)
+        tail = fp.read(4)
+        if tail == b'QTag':
+            fp.seek(size - 8)
+            meta_len = int.from_bytes(fp.read(4), 'big')
+            if meta_len > size - 8:
+                raise DecryptError('Invalid QTag length.')
+            fp.seek(size - 8 - meta_len)
+            ekey = fp.read(meta_len).split(b',', 1)[0]
+            audio_size = size - 8 - meta_len
+        elif tail in (b'STag', b'cex\x00', b'musx'):
+            raise DecryptError(f'Key of "{tail.decode(errors="replace")}" file is not embedded.')
+        else:
+            key_len = int.from_bytes(tail, 'little')
+            if key_len == 0 or key_len > min(_MAX_KEY_LEN, size - 4):
+                raise DecryptError('No embedded key found.')
+            fp.seek(size - 4 - key_len)
+            ekey = fp.read(key_len).rstrip(b'\x00')
+            audio_size = size - 4 - key_len
+
+        key = derive_key(ekey)
+        self._cipher = _RC4Cipher(key) if len(key) > 300 else _MapCipher(key)
+        self.audio_offset = 0
+        self.audio_size = audio_size
+
+    def decrypt(self, data: bytes, offset: int) -> bytes:
+        return self._cipher.decrypt(data, offset)
@@ -0,0 +1,79 @@
+"""
+腾讯TEA（tc_tea）解密，用于QQ音乐内嵌密钥（ekey）的解码
+"""
+import struct
+
+from aum.exceptions import DecryptError
+
+_DELTA = 0x9E3779B9
+_ROUNDS = 16
+_SALT_LEN = 2
+_ZERO_LEN = 7
+
+
+def _tea_decrypt_block(block: bytes, k: tuple[int, int, int, int]) -> bytes:
+    v0, v1 = struct.unpack('>2I', block)
+    k0, k1, k2, k3 = k
+    total = (_DELTA * _ROUNDS) & 0xFFFFFFFF
+    for _ in range(_ROUNDS):
+        v1 = (v1 - ((((v0 << 4) + k2) ^ (v0 + total) ^ ((v0 >> 5) + k3)) & 0xFFFFFFFF)) & 0xFFFFFFFF
+        v0 = (v0 - ((((v1 << 4) + k0) ^ (v1 + total) ^ ((v1 >> 5) + k1)) & 0xFFFFFFFF)) & 0xFFFFFFFF
+        total = (total - _DELTA) & 0xFFFFFFFF
+    return struct.pack('>2I', v0, v1)
+
+
+def tc_tea_decrypt(data: bytes, key: bytes) -> bytes:
+    """tc_tea解密
+
+    :param data: 密文，长度须为8的倍数
+    :param key: 16字节密钥
+    :return: 明文
+    :raise DecryptError: 密文不合法或校验失败时
+    """
+    if len(key) != 16 or len(data) % 8 != 0 or len(data) < 16:
+        raise DecryptError(f'Invalid tc_tea input (key: {len(key)} bytes, data: {len(data)} bytes).')
+
+    k = struct.unpack('>4I', key)
+    dest = bytearray(_tea_decrypt_block(data[:8], k))
+    pad_len = dest[0] & 0x7
+    out_len = len(data) - 1 - pad_len - _SALT_LEN - _ZERO_LEN
+    if out_len < 0:
+        raise DecryptError('Invalid tc_tea padding.')
+
+    iv_prev = bytes(8)
+    iv_cur = data[:8]
+    pos = 8
+    dest_idx = 1 + pad_len
+
+    def next_block():
+        nonlocal iv_prev, iv_cur, pos, dest, dest_idx
+        iv_prev = iv_cur
+        iv_cur = data[pos:pos + 8]
+        dest = bytearray(_tea_decrypt_block(bytes(a ^ b for a, b in zip(dest, iv_cur)), k))
+        pos += 8
+        dest_idx = 0
+
+    i = 1
+    while i <= _SALT_LEN:
+        if dest_idx < 8:
+            dest_idx += 1
+            i += 1
+        else:
+            next_block()
+
+    out = bytearray()
+    while len(out) < out_len:
+        if dest_idx < 8:
+            out.append(dest[dest_idx] ^ iv_prev[dest_idx])
+            dest_idx += 1
+        else:
+            next_block()
+
+    for _ in range(_ZERO_LEN):
+        if dest_idx == 8:
+            next_block()
+        if dest[dest_idx] != iv_prev[dest_idx]:
+            raise DecryptError('tc_tea zero check failed.')
+        dest_idx += 1
+
+    return bytes(out)
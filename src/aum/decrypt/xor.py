@@ -0,0 +1,43 @@
+import functools
+
+
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    """首次解密时才导入numpy（导入约需0.1秒），未安装时返回None"""
+    try:
+        import numpy
+    except ImportError:  # 未安装numpy时，使用大整数异或代替
+        return None
+    return numpy
+
+
+def xor_bytes(data: bytes, mask: bytes) -> bytes:
+    """将两段等长的字节串按位异或
+
+    安装了numpy时使用向量化运算，否则将两者视为大整数一次性异或，二者都远快于逐字节循环。
+
+    :param data: 数据
+    :param mask: 掩码，长度须与data相同
+    :return: 异或结果
+    """
+    np = _numpy()
+    if np is not None:
+        return np.bitwise_xor(np.frombuffer(data, dtype=np.uint8),
+                              np.frombuffer(mask, dtype=np.uint8)).tobytes()
+
+    n = len(data)
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(mask, 'little')).to_bytes(n, 'little')
+
+
+def periodic_mask(period: bytes, start: int, length: int) -> bytes:
+    """从周期性的密钥流中截取一段掩码
+
+    :param period: 一个周期的密钥流
+    :param start: 截取起点（可超过一个周期）
+    :param length: 截取长度
+    :return: 掩码
+    """
+    n = len(period)
+    start %= n
+    repeat = (start + length) // n + 1
+    return (period * repeat)[start:start + length]
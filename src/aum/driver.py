@@ -1,27 +1,142 @@
-from dataclasses import dataclass
-
-from selenium import webdriver
-from selenium.webdriver.firefox.webdriver import WebDriver
-from selenium.webdriver.remote.file_detector import LocalFileDetector
+import pathlib
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Optional, Union
 
 from .hub import SeleniumHub
 
+# selenium只在创建、使用会话时才导入，使不需要浏览器的运行方式（如scan）快速启动
+if TYPE_CHECKING:
+    from selenium.webdriver import FirefoxOptions
+    from selenium.webdriver.firefox.webdriver import WebDriver
+
+PrefValue = Union[bool, int, str]
+
+# Firefox配置预设，在会话创建时写入浏览器配置
+FIREFOX_PRESETS: dict[str, dict[str, PrefValue]] = {
+    # Firefox默认配置
+    'default': {},
+    # 只保留解锁所需的功能，降低内存占用、加快启动
+    'lean': {
+        # 下载直接保存至下载目录，不弹出询问或下载面板
+        'browser.download.useDownloadDir': True,
+        'browser.download.always_ask_before_handling_new_types': False,
+        'browser.download.manager.showWhenStarting': False,
+        'browser.download.alwaysOpenPanel': False,
+        'browser.helperApps.neverAsk.saveToDisk': 'audio/flac,audio/x-flac,audio/ogg,audio/mpeg,audio/mp4,'
+                                                  'audio/x-m4a,audio/wav,application/octet-stream',
+        # 不加载图片（专辑封面）
+        'permissions.default.image': 2,
+        # 关闭遥测、安全浏览、更新与后台服务
+        'datareporting.healthreport.uploadEnabled': False,
+        'datareporting.policy.dataSubmissionEnabled': False,
+        'toolkit.telemetry.enabled': False,
+        'toolkit.telemetry.unified': False,
+        'toolkit.telemetry.archive.enabled': False,
+        'app.normandy.enabled': False,
+        'browser.ping-centre.telemetry': False,
+        'browser.safebrowsing.malware.enabled': False,
+        'browser.safebrowsing.phishing.enabled': False,
+        'browser.safebrowsing.blockedURIs.enabled': False,
+        'browser.safebrowsing.downloads.enabled': False,
+        'browser.safebrowsing.downloads.remote.enabled': False,
+        'app.update.auto': False,
+        'app.update.checkInstallTime': False,
+        'extensions.update.enabled': False,
+        'browser.search.update': False,
+        'extensions.pocket.enabled': False,
+        'browser.newtabpage.enabled': False,
+        'browser.startup.page': 0,
+        'browser.shell.checkDefaultBrowser': False,
+        # 关闭预取与预连接
+        'network.prefetch-next': False,
+        'network.dns.disablePrefetch': True,
+        'network.predictor.enabled': False,
+        'network.http.speculative-parallel-limit': 0,
+        # 只使用一个内容进程
+        'dom.ipc.processCount': 1,
+        'dom.ipc.processPrelaunch.enabled': False,
+        'fission.autostart': False,
+        # 保留磁盘缓存并总是缓存脚本字节码，重新加载页面时复用已编译的JS与WASM
+        'browser.cache.disk.enable': True,
+        'dom.script_loader.bytecode_cache.enabled': True,
+        'dom.script_loader.bytecode_cache.strategy': -1,
+        # 限制内存缓存与页面历史
+        'browser.cache.memory.capacity': 16384,  # 单位KB
+        'browser.sessionhistory.max_total_viewers': 0,
+        'browser.sessionhistory.max_entries': 2,
+    },
+}
+
+
+def firefox_prefs(preset: str, overrides: Optional[dict[str, str]] = None) -> dict[str, PrefValue]:
+    """预设与自定义配置合并后的Firefox配置
+
+    :param preset: FIREFOX_PRESETS中的预设名
+    :param overrides: 自定义配置，值为true/false时视为布尔值，为整数时视为整数，覆盖预设中的同名配置
+    :raise ValueError: 预设不存在时
+    """
+    if preset not in FIREFOX_PRESETS:
+        raise ValueError(f'Unknown firefox profile preset: {preset}')
+
+    prefs = dict(FIREFOX_PRESETS[preset])
+    for name, value in (overrides or {}).items():
+        if value.lower() in {'true', 'false'}:
+            prefs[name] = value.lower() == 'true'
+        else:
+            try:
+                prefs[name] = int(value)
+            except ValueError:
+                prefs[name] = value
+    return prefs
+
+
+@dataclass
+class PageState:
+    """
+    会话中已加载页面的状态，会话在批次间复用时据此决定是否重新加载页面
+    """
+    url: Optional[str] = None  # 已加载且处于干净状态的页面，None表示需要重新加载
+    batches: int = 0  # 自上次加载以来处理的批数
+    bytes: int = 0  # 自上次加载以来上传的字节数
+    heap_bytes: Optional[int] = None  # 页面最近报告的JS堆大小，浏览器不支持时为None
+
+    def loaded(self, url: str):
+        """记录页面刚刚加载完成"""
+        self.url = url
+        self.batches = 0
+        self.bytes = 0
+        self.heap_bytes = None
+
 
 @dataclass(frozen=True)
 class SeleniumDriver:
-    driver: WebDriver
+    driver: 'WebDriver'
     hub: SeleniumHub  # 该WebDriver对应的Hub
+    download_sub_dir: Optional[str] = None  # 该会话独占的下载子目录
+    page: PageState = field(default_factory=PageState, compare=False)  # 该会话中页面的状态
 
     @property
-    def download_dir(self):
+    def download_dir(self) -> pathlib.Path:
         """下载目录"""
-        return self.hub.download_dir
+        if self.download_sub_dir is None:
+            return self.hub.download_dir
+        return self.hub.download_dir / self.download_sub_dir
 
     @property
     def hub_url(self):
         """对应Hub的地址"""
         return self.hub.url
 
+    def is_alive(self) -> bool:
+        """会话是否仍然可用（浏览器崩溃或会话因闲置被hub回收后不可用）"""
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            self.driver.current_url  # 任意一次轻量的往返请求
+        except WebDriverException:
+            return False
+        return True
+
     def quit(self):
         return self.driver.quit()
 
@@ -29,38 +144,70 @@ class SeleniumDriver:
 class WebDriverFactory:
     sel_hub: SeleniumHub
     headless: bool
+    download_sub_dir: Optional[str]
+    prefs: dict[str, PrefValue]
 
-    def __init__(self, sel_hub: SeleniumHub, headless: bool = True):
+    def __init__(self, sel_hub: SeleniumHub, headless: bool = True, download_sub_dir: Optional[str] = None,
+                 prefs: Optional[dict[str, PrefValue]] = None):
         """
         :param sel_hub: Selenium Hub
         :param headless: 是否以无头模式启动
+        :param download_sub_dir: 下载至hub下载目录中的该子目录，需要hub设置了容器内下载目录
+        :param prefs: 额外的Firefox配置，如firefox_prefs()的结果
         """
+        if download_sub_dir is not None and sel_hub.remote_download_dir is None:
+            raise ValueError('remote_download_dir of hub must be set to use a download sub dir.')
+
         self.sel_hub = sel_hub
         self.headless = headless
+        self.download_sub_dir = download_sub_dir
+        self.prefs = dict(prefs or {})
 
-    def _generate_opts(self) -> webdriver.FirefoxOptions:
+    def _generate_opts(self) -> 'FirefoxOptions':
         """根据成员变量生成Firefox配置
 
         :return: Firefox配置
         """
+        from selenium import webdriver
+
         opts = webdriver.FirefoxOptions()
         if self.headless:
             opts.add_argument('--headless')
+        for name, value in self.prefs.items():
+            opts.set_preference(name, value)
+
+        # 浏览器容器内的下载目录已知时直接指定，使用会话下载子目录时为其子目录
+        remote_download_dir = self.sel_hub.remote_download_dir
+        if remote_download_dir is not None:
+            if self.download_sub_dir is not None:
+                remote_download_dir = remote_download_dir / self.download_sub_dir
+            opts.set_preference('browser.download.folderList', 2)  # 2表示使用自定义下载目录
+            opts.set_preference('browser.download.dir', str(remote_download_dir))
         return opts
 
     def create(self) -> SeleniumDriver:
         """创建Firefox WebDriver"""
+        from selenium import webdriver
+        from selenium.webdriver.remote.file_detector import LocalFileDetector, UselessFileDetector
+
         opts = self._generate_opts()
 
+        if self.download_sub_dir is not None:  # 子目录由本程序创建，需允许浏览器容器内的用户写入
+            local_dir = self.sel_hub.download_dir / self.download_sub_dir
+            local_dir.mkdir(exist_ok=True)
+            local_dir.chmod(0o777)
+
         _driver = webdriver.Remote(
             command_executor=self.sel_hub.url,
             options=opts
         )
 
-        # 允许向Web App上传文件
-        _driver.file_detector = LocalFileDetector()
+        # 浏览器不能直接读取音乐目录时，上传需将文件经由WebDriver传输至浏览器容器；
+        # 否则直接传递浏览器容器内的路径（Selenium默认使用LocalFileDetector，须显式替换）
+        _driver.file_detector = UselessFileDetector() if self.sel_hub.shares_music_dir else LocalFileDetector()
 
         return SeleniumDriver(
             driver=_driver,
-            hub=self.sel_hub
+            hub=self.sel_hub,
+            download_sub_dir=self.download_sub_dir
         )
@@ -7,3 +7,11 @@ class PatchSizeError(ValueError):
             super().__init__(f'Patch size must be non-negative (value: {patch_size}).')
         else:
             super().__init__(message)
+
+
+class DecryptError(Exception):
+    """本地解密失败（格式不支持、缺少密钥或数据损坏）"""
+
+
+class NoAvailableHubError(RuntimeError):
+    """没有可用的Selenium Hub"""
@@ -0,0 +1,41 @@
+import errno
+import os
+
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}  # 应退回其他复制方式的错误
+
+
+def copy_fd(src_fd: int, dst_fd: int):
+    """在两个文件描述符之间复制全部数据，优先在内核内完成（copy_file_range，其次sendfile）
+
+    在支持的文件系统（如btrfs、XFS）上，copy_file_range会共享数据块（reflink），几乎不占用额外空间。
+    """
+    offset = 0
+
+    def copy_file_range():
+        return os.copy_file_range(src_fd, dst_fd, 1 << 30, offset, offset)
+
+    def sendfile():
+        return os.sendfile(dst_fd, src_fd, offset, 1 << 30)
+
+    for copy in (copy_file_range, sendfile):
+        try:
+            os.lseek(dst_fd, offset, os.SEEK_SET)  # sendfile写入目标的当前位置
+            while True:
+                n = copy()
+                if n == 0:
+                    return
+                offset += n
+        except AttributeError:  # 当前平台不支持
+            continue
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+
+    # 退回到用户态复制
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    while True:
+        chunk = os.pread(src_fd, 1 << 20, offset)
+        if not chunk:
+            return
+        os.write(dst_fd, chunk)
+        offset += len(chunk)
@@ -1,18 +1,34 @@
 import pathlib
-from typing import Iterable
+from typing import Iterable, Optional
+
+
+def match_suffix(name: str, suffixes: set[str]) -> Optional[str]:
+    """文件名以suffixes中的哪个后缀结尾，不区分大小写，可匹配".kgm.flac"这样由多段组成的后缀
+
+    :param name: 文件名
+    :param suffixes: 小写的后缀集合
+    :return: 匹配的最长后缀（小写），不匹配时返回None
+    """
+    lower = name.lower()
+    i = lower.find('.', 1)  # 以"."开头的文件名，第一个"."不是后缀的开始
+    while i != -1:
+        if lower[i:] in suffixes:
+            return lower[i:]
+        i = lower.find('.', i + 1)
+    return None
 
 
 def filter_dir_by_suffixes(dir_generator: Iterable[pathlib.Path],
                            suffixes: set[str]
                            ) -> Iterable[pathlib.Path]:
-    """根据文件名后缀过滤路径Iterable
+    """根据文件名后缀过滤路径Iterable，不区分大小写，支持多段后缀
 
     :param dir_generator: 被过滤的Iterable
     :param suffixes: 滤出的后缀集合
     :return: 过滤出相同后缀文件的filter
     """
-    _suffixes = suffixes.copy()
-    return filter(lambda p: p.suffix in _suffixes, dir_generator)
+    _suffixes = {s.lower() for s in suffixes}
+    return filter(lambda p: match_suffix(p.name, _suffixes) is not None, dir_generator)
 
 
 def filter_dir_by_stems(dir_generator: Iterable[pathlib.Path],
@@ -0,0 +1,117 @@
+"""
+基于ctypes的Linux inotify简易封装，不可用时（非Linux或被禁用）由调用方退回轮询
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from typing import NamedTuple, Optional
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1  # 检查符号是否存在
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+class InotifyEvent(NamedTuple):
+    wd: int  # 触发事件的watch
+    mask: int  # 事件类型
+    name: str  # 事件对应的文件名（相对被监视的目录）
+
+
+class Inotify:
+    """
+    inotify实例，使用完毕后需调用close()或以with语句使用
+    """
+
+    _fd: int
+
+    def __init__(self):
+        """
+        :raise OSError: inotify不可用时
+        """
+        if _libc is None:
+            raise OSError('inotify is not available on this platform.')
+
+        fd = _libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._fd = fd
+
+    @staticmethod
+    def available() -> bool:
+        """当前平台是否支持inotify"""
+        return _libc is not None
+
+    def add_watch(self, path: os.PathLike, mask: int) -> int:
+        """监视目录
+
+        :param path: 被监视的目录
+        :param mask: 关注的事件
+        :return: watch描述符
+        """
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        return wd
+
+    def remove_watch(self, wd: int):
+        _libc.inotify_rm_watch(self._fd, wd)
+
+    def read(self, timeout: Optional[float] = None) -> list[InotifyEvent]:
+        """读取事件
+
+        :param timeout: 没有事件时最长等待时间，单位秒，None表示一直等待
+        :return: 事件列表，超时则为空
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        pos = 0
+        while pos + _EVENT_HEADER.size <= len(buf):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(buf, pos)
+            pos += _EVENT_HEADER.size
+            name = os.fsdecode(buf[pos:pos + name_len].rstrip(b'\0'))
+            pos += name_len
+            events.append(InotifyEvent(wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self._fd)
+
+    def __enter__(self) -> 'Inotify':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
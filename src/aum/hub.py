@@ -1,5 +1,8 @@
+import json
+import logging
 import pathlib
 from dataclasses import dataclass
+from typing import Optional
 
 
 @dataclass(frozen=True)
@@ -9,3 +12,44 @@ class SeleniumHub:
     """
     url: str  # hub url
     download_dir: pathlib.Path  # 该hub的下载目录
+    remote_download_dir: Optional[pathlib.PurePosixPath] = None  # 该hub的下载目录在浏览器容器内的路径
+    music_dir: Optional[pathlib.Path] = None  # 与浏览器容器共享的音乐目录
+    remote_music_dir: Optional[pathlib.PurePosixPath] = None  # 共享的音乐目录在浏览器容器内的路径
+
+    @property
+    def shares_music_dir(self) -> bool:
+        """浏览器能否直接读取音乐目录，此时上传无需经由WebDriver传输文件"""
+        return self.music_dir is not None and self.remote_music_dir is not None
+
+    def remote_path(self, path: pathlib.Path) -> Optional[pathlib.PurePosixPath]:
+        """文件在浏览器容器内的路径
+
+        :param path: 本地文件路径
+        :return: 浏览器容器内的路径，文件不在共享的音乐目录中时返回None
+        """
+        if not self.shares_music_dir:
+            return None
+        try:
+            relative = path.relative_to(self.music_dir)
+        except ValueError:
+            return None
+        return self.remote_music_dir.joinpath(*relative.parts)
+
+    def is_ready(self, timeout: float = 5) -> bool:
+        """通过/status接口检查hub能否接受新会话
+
+        :param timeout: 请求超时时间，单位秒
+        """
+        import urllib.request  # 只在检查hub时用到，不拖慢启动
+
+        try:
+            with urllib.request.urlopen(self.url.rstrip('/') + '/status', timeout=timeout) as resp:
+                status = json.load(resp)
+        except (OSError, ValueError) as e:
+            logging.warning(f'Selenium Hub"{self.url}"不可用：{e}')
+            return False
+
+        ready = bool(status.get('value', {}).get('ready', False))
+        if not ready:
+            logging.warning(f'Selenium Hub"{self.url}"未就绪。')
+        return ready
@@ -0,0 +1,218 @@
+import logging
+import os
+import pathlib
+import sqlite3
+import time
+from typing import Callable, Iterable, Optional
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    reason TEXT,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pending (
+    path TEXT PRIMARY KEY,
+    first_seen REAL NOT NULL
+);
+'''
+
+
+class FileIndex:
+    """
+    持久化的文件状态索引，记录已处理过的文件，使重复运行只处理新增或变化的文件
+
+    文件以(路径, 大小, mtime, inode)标识，状态为以下之一：
+    unlocked（解锁得到的文件）、renamed（已重命名）、clean（无需处理）、failed（解锁失败，变化前不再尝试）。
+    尚未处理的文件另记录其首次发现的时间，供调度器计算等待时间。
+    """
+
+    UNLOCKED = 'unlocked'
+    RENAMED = 'renamed'
+    CLEAN = 'clean'
+    FAILED = 'failed'
+
+    db_path: pathlib.Path
+
+    _conn: sqlite3.Connection
+
+    def __init__(self, db_path: pathlib.Path):
+        """
+        :param db_path: SQLite数据库文件路径，不存在时自动创建
+        """
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.executescript(_SCHEMA)
+
+    def commit(self):
+        """提交目前为止的修改，使进程中途退出时已处理的文件不会被重复处理"""
+        self._conn.commit()
+
+    def close(self):
+        """提交全部修改并关闭"""
+        self._conn.commit()
+        self._conn.close()
+
+    def __enter__(self) -> 'FileIndex':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def scan(self, directory: pathlib.Path, entries: Optional[Iterable[os.DirEntry]] = None) -> list[pathlib.Path]:
+        """列出目录中需要处理的文件（不含子目录中的文件）
+
+        目录mtime自上次mark_scanned()后未变化时不列目录，只检查失败过的文件（原地修改不改变目录的mtime）；否则只列一次目录，
+        索引中没有的文件，以及大小、mtime或inode与记录不符（被修改或被同名的新文件替换）的文件需要处理，
+        后者的旧记录被删除。索引中已不存在于目录的记录同样会被删除。
+
+        :param directory: 被扫描的目录
+        :param entries: 已列出的目录中的文件，如LibraryScanner的结果，为None时由本方法列出
+        :return: 新增或变化的文件
+        """
+        row = self._conn.execute('SELECT mtime_ns FROM dirs WHERE path = ?', (str(directory),)).fetchone()
+        if row is not None and row[0] == directory.stat().st_mtime_ns:
+            logging.debug(f'目录"{directory}"自上次运行后没有变化。')
+            return self._changed_failures(directory)
+
+        if entries is None:
+            with os.scandir(directory) as it:
+                entries = [entry for entry in it if entry.is_file()]
+
+        known = self._known(directory)
+
+        changed = []
+        stale = []
+        present = set()
+        for entry in entries:
+            if self._is_own_file(entry.path):
+                continue
+            present.add(entry.path)
+
+            recorded = known.get(entry.path)
+            if recorded is None:
+                changed.append(pathlib.Path(entry.path))
+                continue
+            st = entry.stat()
+            if recorded != (st.st_size, st.st_mtime_ns, st.st_ino):
+                changed.append(pathlib.Path(entry.path))
+                stale.append((entry.path,))
+
+        vanished = [(p,) for p in known.keys() - present]
+        self._conn.executemany('DELETE FROM files WHERE path = ?', vanished + stale)
+        gone = [(p,) for p in self._children('pending', directory) - present]
+        self._conn.executemany('DELETE FROM pending WHERE path = ?', gone)
+        return changed
+
+    def mark_scanned(self, directory: pathlib.Path, ignore: Optional[Callable[[os.DirEntry], bool]] = None):
+        """记录目录当前的mtime，须在本次对该目录的修改全部完成后调用
+
+        为免漏掉运行期间新增的文件，只有目录中所有文件都已在索引中时才记录。
+
+        :param ignore: 扫描时排除、因而不会记入索引的文件
+        """
+        mtime_ns = directory.stat().st_mtime_ns
+        known = self._known(directory)
+        with os.scandir(directory) as it:
+            if any(e.path not in known for e in it
+                   if e.is_file() and not self._is_own_file(e.path) and not (ignore is not None and ignore(e))):
+                return
+
+        self._conn.execute('INSERT OR REPLACE INTO dirs (path, mtime_ns) VALUES (?, ?)', (str(directory), mtime_ns))
+
+    def first_seen(self, paths: Iterable[pathlib.Path]) -> dict[pathlib.Path, float]:
+        """尚未处理的文件首次被发现的时间（time.time()），本次才发现的文件记为当前时间
+
+        文件被记录状态或删除记录后，其发现时间一并删除。
+        """
+        paths = list(paths)
+        now = time.time()
+        self._conn.executemany('INSERT OR IGNORE INTO pending (path, first_seen) VALUES (?, ?)',
+                               [(str(p), now) for p in paths])
+        seen = {}
+        for p in paths:
+            row = self._conn.execute('SELECT first_seen FROM pending WHERE path = ?', (str(p),)).fetchone()
+            seen[p] = row[0]
+        return seen
+
+    def state_of(self, path: pathlib.Path) -> Optional[str]:
+        """文件在索引中的状态，不存在时返回None"""
+        row = self._conn.execute('SELECT state FROM files WHERE path = ?', (str(path),)).fetchone()
+        return None if row is None else row[0]
+
+    def record(self, path: pathlib.Path, state: str, reason: Optional[str] = None):
+        """记录文件的当前状态
+
+        :param path: 文件路径，须存在
+        :param state: 状态
+        :param reason: 附加说明（如失败原因）
+        """
+        st = path.stat()
+        self._conn.execute(
+            'INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, state, reason, updated) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (str(path), st.st_size, st.st_mtime_ns, st.st_ino, state, reason, time.time())
+        )
+        self._conn.execute('DELETE FROM pending WHERE path = ?', (str(path),))
+
+    def record_all(self, paths: Iterable[pathlib.Path], state: str):
+        """将尚未记录的文件记为state，已有记录的保持不变"""
+        for p in paths:
+            if p.exists() and self.state_of(p) is None:
+                self.record(p, state)
+
+    def move(self, old: pathlib.Path, new: pathlib.Path, state: str):
+        """文件被重命名后更新其记录"""
+        self.forget(old)
+        self.record(new, state)
+
+    def forget(self, path: pathlib.Path):
+        """删除文件的记录"""
+        self._conn.execute('DELETE FROM files WHERE path = ?', (str(path),))
+        self._conn.execute('DELETE FROM pending WHERE path = ?', (str(path),))
+
+    def _changed_failures(self, directory: pathlib.Path) -> list[pathlib.Path]:
+        """目录中（不含子目录）失败过、此后又变化的文件，并删除其旧记录"""
+        changed = []
+        rows = self._select_children('SELECT path, size, mtime_ns, inode, state FROM files', directory).fetchall()
+        for path, size, mtime_ns, inode, state in rows:
+            if state != self.FAILED:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if (size, mtime_ns, inode) != (st.st_size, st.st_mtime_ns, st.st_ino):
+                changed.append(pathlib.Path(path))
+        if changed:  # 旧记录删除后文件不在索引中，下一次须重新列出目录，直至mark_scanned()再次记录
+            self._conn.executemany('DELETE FROM files WHERE path = ?', [(str(p),) for p in changed])
+            self._conn.execute('DELETE FROM dirs WHERE path = ?', (str(directory),))
+        return changed
+
+    def _known(self, directory: pathlib.Path) -> dict[str, tuple[int, int, int]]:
+        """目录中（不含子目录）所有记录的路径 -> (大小, mtime, inode)"""
+        return {row[0]: row[1:] for row in self._select_children('SELECT path, size, mtime_ns, inode FROM files',
+                                                                  directory)}
+
+    def _children(self, table: str, directory: pathlib.Path) -> set[str]:
+        """表中属于目录（不含子目录）的路径"""
+        return {row[0] for row in self._select_children(f'SELECT path FROM {table}', directory)}
+
+    def _select_children(self, select: str, directory: pathlib.Path) -> sqlite3.Cursor:
+        # 按范围比较：区分大小写，仅大小写不同的同级目录互不影响，且可使用主键索引
+        prefix = os.path.join(directory, '')
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return self._conn.execute(select + ' WHERE path >= ? AND path < ? AND instr(substr(path, ?), ?) = 0',
+                                  (prefix, upper, len(prefix) + 1, os.sep))
+
+    def _is_own_file(self, path: str) -> bool:
+        """是否为索引数据库自身的文件（含-journal等）"""
+        return path.startswith(str(self.db_path))
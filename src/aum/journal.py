@@ -0,0 +1,194 @@
+import fcntl
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    source TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    destination TEXT,
+    state TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+'''
+
+
+class JournalEntry:
+    """日志中的一条记录"""
+
+    source: pathlib.Path  # 加密的源文件
+    result: pathlib.Path  # 下载目录中的解锁结果
+    destination: Optional[pathlib.Path]  # 发布路径，开始发布后才有
+    state: str
+
+    _size: int
+    _mtime_ns: int
+
+    def __init__(self, source: str, result: str, destination: Optional[str], state: str, size: int, mtime_ns: int):
+        self.source = pathlib.Path(source)
+        self.result = pathlib.Path(result)
+        self.destination = pathlib.Path(destination) if destination is not None else None
+        self.state = state
+        self._size = size
+        self._mtime_ns = mtime_ns
+
+    def source_unchanged(self) -> bool:
+        """源文件是否仍存在且自下载以来没有变化"""
+        try:
+            st = self.source.stat()
+        except OSError:
+            return False
+        return st.st_size == self._size and st.st_mtime_ns == self._mtime_ns
+
+
+class UnlockJournal:
+    """
+    解锁结果的预写日志，使进程在发布前崩溃或被终止后，下一次运行可直接发布已下载的结果而无需重新解锁
+
+    每批下载完成时记录(源文件, 下载目录中的结果)，状态为downloaded；移入目标目录的临时文件之前记录发布路径，
+    状态为publishing；发布完成、源文件删除后删除记录。由页面脚本取回、直接写入临时文件的结果从publishing开始记录。
+    每次修改立即提交，可供多个线程同时使用。
+    """
+
+    DOWNLOADED = 'downloaded'
+    PUBLISHING = 'publishing'
+
+    db_path: pathlib.Path
+
+    _conn: sqlite3.Connection
+    _lock: threading.Lock
+
+    def __init__(self, db_path: pathlib.Path):
+        """
+        :param db_path: SQLite数据库文件路径，不存在时自动创建
+        """
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self) -> 'UnlockJournal':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def downloaded(self, batch: dict[pathlib.Path, pathlib.Path]):
+        """记录一批已下载、尚未发布的结果
+
+        :param batch: 加密的源文件 -> 下载目录中的解锁结果
+        """
+        rows = []
+        now = time.time()
+        for source, result in batch.items():
+            try:
+                st = source.stat()
+            except OSError:
+                continue
+            rows.append((str(source), str(result), self.DOWNLOADED, st.st_size, st.st_mtime_ns, now))
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO entries (source, result, destination, state, size, '
+                                   'mtime_ns, updated) VALUES (?, ?, NULL, ?, ?, ?, ?)', rows)
+
+    def publishing(self, destinations: dict[pathlib.Path, pathlib.Path]):
+        """记录即将移入目标目录临时文件并发布的结果
+
+        :param destinations: 加密的源文件 -> 发布路径
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany('UPDATE entries SET destination = ?, state = ?, updated = ? WHERE source = ?',
+                                   [(str(dst), self.PUBLISHING, now, str(src)) for src, dst in destinations.items()])
+
+    def staged(self, source: pathlib.Path, tmp: pathlib.Path, destination: pathlib.Path):
+        """记录直接写入目标目录临时文件（不经过下载目录）、即将发布的结果，状态即为publishing
+
+        :param source: 加密的源文件
+        :param tmp: 已写入磁盘的临时文件
+        :param destination: 发布路径
+        """
+        try:
+            st = source.stat()
+        except OSError:
+            return
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO entries (source, result, destination, state, size, mtime_ns, '
+                               'updated) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (str(source), str(tmp), str(destination), self.PUBLISHING, st.st_size, st.st_mtime_ns,
+                                time.time()))
+
+    def reset(self, sources: Iterable[pathlib.Path]):
+        """未能发布、结果已放回下载目录的文件，恢复为downloaded"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany('UPDATE entries SET destination = NULL, state = ?, updated = ? WHERE source = ?',
+                                   [(self.DOWNLOADED, now, str(p)) for p in sources])
+
+    def done(self, sources: Iterable[pathlib.Path]):
+        """删除已发布完成或已放弃的记录"""
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM entries WHERE source = ?', [(str(p),) for p in sources])
+
+    def entries(self) -> list[JournalEntry]:
+        with self._lock:
+            return [JournalEntry(*row) for row in self._conn.execute(
+                'SELECT source, result, destination, state, size, mtime_ns FROM entries ORDER BY source')]
+
+    def results(self) -> set[pathlib.Path]:
+        """所有记录中的解锁结果"""
+        with self._lock:
+            return {pathlib.Path(row[0]) for row in self._conn.execute('SELECT result FROM entries')}
+
+
+class JournalLock:
+    """
+    共用同一解锁日志的各个运行（如常驻运行与定时运行）之间的锁，文件为日志路径加.lock
+
+    每个运行在整个期间持有共享锁；只有取得独占锁、即没有其他运行正在进行时，才可恢复日志中的结果并清理下载目录，
+    以免发布或删除其他运行仍在处理的文件。
+    """
+
+    path: pathlib.Path
+
+    _fd: int
+
+    def __init__(self, journal_path: pathlib.Path):
+        """
+        :param journal_path: 解锁日志的路径
+        """
+        self.path = journal_path.with_name(journal_path.name + '.lock')
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+
+    def try_exclusive(self) -> bool:
+        """尝试取得独占锁，不等待
+
+        :return: 是否取得，有其他运行持有锁时为False
+        """
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def share(self):
+        """取得共享锁（已持有独占锁时转为共享锁），其他运行正在恢复时等待其完成"""
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+
+    def close(self):
+        """释放锁"""
+        os.close(self._fd)
+
+    def __enter__(self) -> 'JournalLock':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
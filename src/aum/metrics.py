@@ -0,0 +1,272 @@
+"""
+运行指标：各阶段的耗时、处理的文件数与字节数、单个文件的耗时分布
+
+指标在进程内累计（常驻模式下跨批次累计），可导出为Prometheus node-exporter的textfile与JSON运行报告。
+"""
+import bisect
+import contextlib
+import cProfile
+import datetime
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+import tracemalloc
+from typing import Optional
+
+STAGE_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600)  # 阶段耗时的分桶上界，单位秒
+FILE_BUCKETS = (0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)  # 单个文件耗时的分桶上界，单位秒
+
+
+class Histogram:
+    """
+    与Prometheus histogram相同的累计分桶
+    """
+
+    buckets: tuple[float, ...]
+    counts: list[int]  # 各桶（不累计）的观测数，最后一个为超出所有上界的观测数
+    count: int
+    sum: float
+    max: float
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """(le, 不超过该上界的观测数)，最后一项的le为"+Inf\""""
+        result = []
+        total = 0
+        for le, n in zip([f'{b:g}' for b in self.buckets] + ['+Inf'], self.counts):
+            total += n
+            result.append((le, total))
+        return result
+
+    def quantile(self, q: float) -> float:
+        """按分桶线性插值估计分位数"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        lower = 0.0
+        for upper, n in zip(self.buckets + (self.max,), self.counts):
+            if n and total + n >= rank:
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - total) / n
+            total += n
+            lower = upper
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'seconds': self.sum, 'max_seconds': self.max,
+                'p50_seconds': self.quantile(0.5), 'p90_seconds': self.quantile(0.9),
+                'p99_seconds': self.quantile(0.99)}
+
+
+def _escape(value: str) -> str:
+    """转义Prometheus标签值"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomic(path: pathlib.Path, text: str):
+    """写入同目录下的临时文件后再替换，避免读取方（如node-exporter）读到写了一半的文件"""
+    tmp = path.with_name(f'.{path.name}.tmp')
+    tmp.write_text(text, encoding='utf-8')
+    os.replace(tmp, path)
+
+
+class Metrics:
+    """
+    线程安全的指标记录器
+    """
+
+    started_at: float  # 开始记录的时间戳
+    profile_dir: Optional[pathlib.Path]  # 各阶段cProfile与tracemalloc快照的保存目录，为None时不分析
+
+    _lock: threading.Lock
+    _export_lock: threading.Lock  # 多个线程同时导出时避免争用同一个临时文件
+    _stages: dict[str, Histogram]  # 阶段 -> 耗时
+    _file_latency: dict[str, Histogram]  # 阶段 -> 单个文件的耗时
+    _files: dict[str, dict[str, int]]  # 阶段 -> 后缀 -> 文件数
+    _bytes: dict[str, int]  # 阶段 -> 字节数
+    _results: dict[str, int]  # 结果（unlocked、failed等） -> 文件数
+    _local: threading.local
+    _profile_seq: int
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.profile_dir = None
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self._stages = {}
+        self._file_latency = {}
+        self._files = {}
+        self._bytes = {}
+        self._results = {}
+        self._local = threading.local()
+        self._profile_seq = 0
+
+    def enable_profiling(self, profile_dir: pathlib.Path):
+        """此后每个阶段结束时，在profile_dir中保存其cProfile统计（.prof）与tracemalloc快照（.tracemalloc）
+
+        同一线程中嵌套的阶段只分析最外层的一个。
+        """
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        self.profile_dir = profile_dir
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def span(self, stage: str):
+        """记录with块的耗时，计入该阶段
+
+        :param stage: 阶段名，子阶段以"."连接，如"browser.upload"
+        """
+        profiler = self._start_profiler()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._stages.setdefault(stage, Histogram(STAGE_BUCKETS)).observe(elapsed)
+            if profiler is not None:
+                self._dump_profile(stage, profiler)
+            logging.debug(f'阶段{stage}耗时{elapsed:.3f}秒。')
+
+    def observe_file(self, stage: str, path: pathlib.Path,
+                     seconds: Optional[float] = None,
+                     size: Optional[int] = None):
+        """记录一个文件
+
+        :param stage: 阶段名
+        :param path: 文件路径，按其后缀计数
+        :param seconds: 该文件的耗时，为None时不计入耗时分布
+        :param size: 文件大小，为None时读取文件状态，文件不存在时不计入字节数
+        """
+        if size is None:
+            try:
+                size = path.stat().st_size
+            except OSError:
+                size = 0
+
+        suffix = path.suffix.lower() or '(none)'
+        with self._lock:
+            by_suffix = self._files.setdefault(stage, {})
+            by_suffix[suffix] = by_suffix.get(suffix, 0) + 1
+            self._bytes[stage] = self._bytes.get(stage, 0) + size
+            if seconds is not None:
+                self._file_latency.setdefault(stage, Histogram(FILE_BUCKETS)).observe(seconds)
+
+    def add_result(self, result: str, count: int = 1):
+        """累计处理结果，如unlocked、failed、renamed"""
+        with self._lock:
+            self._results[result] = self._results.get(result, 0) + count
+
+    def to_prometheus(self) -> str:
+        """Prometheus文本格式"""
+        lines = []
+
+        def histogram(name: str, help_text: str, histograms: dict[str, Histogram]):
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} histogram'])
+            for stage, h in sorted(histograms.items()):
+                label = f'stage="{_escape(stage)}"'
+                lines.extend(f'{name}_bucket{{{label},le="{le}"}} {n}' for le, n in h.cumulative())
+                lines.extend([f'{name}_sum{{{label}}} {h.sum}', f'{name}_count{{{label}}} {h.count}'])
+
+        with self._lock:
+            histogram('aum_stage_duration_seconds', 'Time spent in each stage.', self._stages)
+            histogram('aum_file_latency_seconds', 'Time spent on a single file in each stage.', self._file_latency)
+
+            lines.extend(['# HELP aum_files_total Files processed by stage and suffix.',
+                          '# TYPE aum_files_total counter'])
+            for stage, by_suffix in sorted(self._files.items()):
+                lines.extend(f'aum_files_total{{stage="{_escape(stage)}",suffix="{_escape(suffix)}"}} {n}'
+                             for suffix, n in sorted(by_suffix.items()))
+
+            lines.extend(['# HELP aum_bytes_total Bytes processed by stage.', '# TYPE aum_bytes_total counter'])
+            lines.extend(f'aum_bytes_total{{stage="{_escape(stage)}"}} {n}' for stage, n in sorted(self._bytes.items()))
+
+            lines.extend(['# HELP aum_results_total Files by processing result.', '# TYPE aum_results_total counter'])
+            lines.extend(f'aum_results_total{{result="{_escape(result)}"}} {n}'
+                         for result, n in sorted(self._results.items()))
+
+        lines.extend(['# HELP aum_start_time_seconds Unix time when the process started recording metrics.',
+                      '# TYPE aum_start_time_seconds gauge',
+                      f'aum_start_time_seconds {self.started_at}',
+                      '# HELP aum_last_update_time_seconds Unix time when the metrics were last exported.',
+                      '# TYPE aum_last_update_time_seconds gauge',
+                      f'aum_last_update_time_seconds {time.time()}'])
+        return '\n'.join(lines) + '\n'
+
+    def to_report(self) -> dict:
+        """JSON运行报告"""
+        now = time.time()
+        with self._lock:
+            files = {}
+            for stage in sorted(self._files.keys() | self._file_latency.keys()):
+                by_suffix = self._files.get(stage, {})
+                files[stage] = {'count': sum(by_suffix.values()), 'bytes': self._bytes.get(stage, 0),
+                                'by_suffix': dict(sorted(by_suffix.items()))}
+                if stage in self._file_latency:
+                    files[stage]['latency'] = self._file_latency[stage].to_dict()
+
+            return {
+                'started': datetime.datetime.fromtimestamp(self.started_at).astimezone().isoformat(timespec='seconds'),
+                'finished': datetime.datetime.fromtimestamp(now).astimezone().isoformat(timespec='seconds'),
+                'duration_seconds': now - self.started_at,
+                'stages': {stage: h.to_dict() for stage, h in sorted(self._stages.items())},
+                'files': files,
+                'results': dict(sorted(self._results.items())),
+            }
+
+    def write_textfile(self, path: pathlib.Path):
+        """写入Prometheus node-exporter的textfile（文件名须以.prom结尾）"""
+        with self._export_lock:
+            _write_atomic(path, self.to_prometheus())
+
+    def write_report(self, path: pathlib.Path):
+        """写入JSON运行报告"""
+        with self._export_lock:
+            _write_atomic(path, json.dumps(self.to_report(), ensure_ascii=False, indent=2) + '\n')
+
+    def _start_profiler(self) -> Optional[cProfile.Profile]:
+        """当前线程没有正在分析的阶段时开始分析"""
+        if self.profile_dir is None or getattr(self._local, 'profiling', False):
+            return None
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # Python 3.12起分析器对所有线程生效，其他线程已在分析时无法再开启
+            return None
+        self._local.profiling = True
+        return profiler
+
+    def _dump_profile(self, stage: str, profiler: cProfile.Profile):
+        profiler.disable()
+        self._local.profiling = False
+        with self._lock:
+            self._profile_seq += 1
+            name = f'{self._profile_seq:04d}-{stage}'
+
+        try:
+            profiler.dump_stats(self.profile_dir / f'{name}.prof')
+            if tracemalloc.is_tracing():
+                tracemalloc.take_snapshot().dump(str(self.profile_dir / f'{name}.tracemalloc'))
+        except OSError as e:
+            logging.warning(f'保存阶段{stage}的性能分析结果失败：{e}')
+
+
+metrics = Metrics()  # 进程内共享的指标
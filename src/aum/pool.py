@@ -0,0 +1,191 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+
+from selenium.common.exceptions import WebDriverException
+
+from aum.driver import PrefValue, SeleniumDriver, WebDriverFactory
+from aum.exceptions import NoAvailableHubError
+from aum.hub import SeleniumHub
+
+
+class DriverPool:
+    """
+    WebDriver会话池，在一个或多个Selenium Hub上按需创建并复用会话
+
+    等待会话的线程按先来后到取得会话。多个音乐库共用一个会话池时，各库的批次因此轮流进行，
+    大批量导入的音乐库归还会话后须重新排队，不会让其他音乐库的新文件一直等待。
+    """
+
+    size: int  # 最大会话数
+
+    _hubs: list[SeleniumHub]
+    _prefs: dict[str, PrefValue]  # 新建会话时使用的Firefox配置
+    _idle: list[SeleniumDriver]  # 空闲会话
+    _drivers: list[SeleniumDriver]  # 全部会话
+    _creating: int  # 正在创建的会话数
+    _next_index: int  # 下一个会话的编号
+    _ready_timeout: float
+    _ready: bool  # 是否已确认有就绪的hub
+    _waiting: deque[object]  # 等待会话的线程的排队凭据，按到达顺序排列
+    _cond: threading.Condition
+
+    def __init__(self, hubs: Iterable[SeleniumHub], size: int = 1, ready_timeout: float = 60,
+                 prefs: Optional[dict[str, PrefValue]] = None):
+        """
+        :param hubs: 可用的Selenium Hub，会话按顺序轮流分配到各hub
+        :param size: 最大会话数
+        :param ready_timeout: 首次创建会话前，等待至少一个hub就绪的最长时间，单位秒
+        :param prefs: 新建会话时使用的Firefox配置，如firefox_prefs()的结果
+        """
+        if size < 1:
+            raise ValueError(f'Pool size must be positive (value: {size}).')
+
+        self.size = size
+        self._hubs = list(hubs)
+        self._prefs = dict(prefs or {})
+        self._idle = []
+        self._drivers = []
+        self._creating = 0
+        self._next_index = 0
+        self._ready_timeout = ready_timeout
+        self._ready = False
+        self._waiting = deque()
+        self._cond = threading.Condition()
+
+    def _wait_any_ready(self, timeout: float, poll_interval: float = 3):
+        deadline = time.monotonic() + timeout
+        while True:
+            if any(hub.is_ready() for hub in self._hubs):
+                return
+            if time.monotonic() >= deadline:
+                raise NoAvailableHubError(f'No selenium hub is ready: {[h.url for h in self._hubs]}')
+            time.sleep(poll_interval)
+
+    def _create(self, index: int) -> SeleniumDriver:
+        """在第一个可用的hub上创建会话，从第index % hub数个hub开始尝试
+
+        :param index: 会话编号，同时决定其下载子目录
+        :raise NoAvailableHubError: 没有hub就绪或均无法创建会话时
+        """
+        if not self._ready:  # 直到需要会话时才等待hub，没有文件需要浏览器解锁时不依赖浏览器服务
+            self._wait_any_ready(self._ready_timeout)
+            self._ready = True
+
+        n = len(self._hubs)
+        for hub in (self._hubs[(index + i) % n] for i in range(n)):
+            if not hub.is_ready():
+                continue
+
+            sub_dir = f'session-{index}' if hub.remote_download_dir is not None else None
+            try:
+                sel_driver = WebDriverFactory(hub, download_sub_dir=sub_dir, prefs=self._prefs).create()
+            except WebDriverException as e:
+                logging.warning(f'在"{hub.url}"上创建WebDriver失败：{e.msg}')
+                continue
+
+            logging.debug(f'已在"{hub.url}"上创建第{index + 1}个WebDriver。')
+            return sel_driver
+
+        raise NoAvailableHubError('Failed to create WebDriver on any selenium hub.')
+
+    def acquire(self) -> SeleniumDriver:
+        """取得一个空闲会话，没有空闲会话且未达上限时新建，否则等待
+
+        空闲会话在取出时会检查是否仍然可用，失效的会话被丢弃，从而在长时间运行时自动重建。
+        检查需与hub往返一次，在锁外进行，慢或失效的hub不会阻塞其他线程；检查失败时重新排在队首。
+        多个线程等待时，先到者先得。
+
+        :raise NoAvailableHubError: 需要新建会话但没有可用的hub时
+        """
+        ticket = object()
+        retry = False
+        while True:
+            candidate = None
+            with self._cond:
+                if retry:
+                    self._waiting.appendleft(ticket)
+                else:
+                    self._waiting.append(ticket)
+                try:
+                    while True:
+                        if self._waiting[0] is ticket:
+                            if self._idle:
+                                candidate = self._idle.pop()
+                                break
+                            if len(self._drivers) + self._creating < self.size:
+                                self._creating += 1
+                                index = self._next_index
+                                self._next_index += 1
+                                break
+                        self._cond.wait()
+                finally:  # 无论取得会话与否都让出队首，由下一个线程继续
+                    self._waiting.remove(ticket)
+                    self._cond.notify_all()
+
+            if candidate is None:
+                break
+            if candidate.is_alive():
+                return candidate
+            logging.warning('WebDriver会话已失效，将重新创建。')
+            with self._cond:
+                self._drivers.remove(candidate)
+                self._cond.notify_all()
+            retry = True
+
+        try:
+            sel_driver = self._create(index)
+        except BaseException:
+            with self._cond:
+                self._creating -= 1
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            self._creating -= 1
+            self._drivers.append(sel_driver)
+        return sel_driver
+
+    def release(self, sel_driver: SeleniumDriver):
+        """归还会话"""
+        with self._cond:
+            self._idle.append(sel_driver)
+            self._cond.notify_all()
+
+    def discard(self, sel_driver: SeleniumDriver):
+        """丢弃出错的会话，之后可按需新建"""
+        with self._cond:
+            self._drivers.remove(sel_driver)
+            self._cond.notify_all()
+
+        try:
+            sel_driver.quit()
+        except WebDriverException:
+            pass
+
+    @contextmanager
+    def session(self) -> Iterator[SeleniumDriver]:
+        """取得会话，用毕自动归还；发生异常时丢弃该会话"""
+        sel_driver = self.acquire()
+        try:
+            yield sel_driver
+        except BaseException:
+            self.discard(sel_driver)
+            raise
+        self.release(sel_driver)
+
+    def quit(self):
+        """关闭全部会话"""
+        with self._cond:
+            drivers = self._drivers.copy()
+            self._drivers.clear()
+            self._idle.clear()
+
+        for sel_driver in drivers:
+            try:
+                sel_driver.quit()
+            except WebDriverException as e:
+                logging.warning(f'关闭WebDriver失败：{e.msg}')
@@ -0,0 +1,149 @@
+import collections
+import logging
+import mmap
+import pathlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
+from aum.decrypt import NcmDecoder, QmcDecoder, sniff_audio_suffix
+
+_HEAD_BYTES = 4 << 10  # 读取文件开头的字节数
+_TAIL_BYTES = 8 << 10  # 读取文件末尾的字节数，须容纳QQ音乐文件尾部最长的裸密钥
+_MIN_BYTES = 8 << 10  # 小于该大小的文件不可能是完整的歌曲
+_STRONG_AUDIO_MAGICS = (b'fLaC', b'ID3', b'OggS', b'RIFF')  # 只凭帧同步识别的MP3可能是巧合，不视为明文
+_EKEY = re.compile(rb'[A-Za-z0-9+/=]+\x00*')  # 内嵌密钥为Base64文本，尾部可能补0
+
+LOCKED = 'locked'
+PLAIN = 'plain'
+JUNK = 'junk'
+
+UNKNOWN_SCHEME = 'unknown'
+
+
+class Preflight:
+    """文件的预检结果"""
+
+    kind: str  # locked（加密音乐）、plain（后缀虽为加密格式，实际已是明文音频）或junk（不完整或无法解锁）
+    scheme: Optional[str]  # 加密音乐为其加密方式（ncm、qmc或unknown），明文音频为其实际的后缀（如".flac"）
+    reason: Optional[str]  # junk的原因
+
+    def __init__(self, kind: str, scheme: Optional[str] = None, reason: Optional[str] = None):
+        self.kind = kind
+        self.scheme = scheme
+        self.reason = reason
+
+
+class PreflightClassifier:
+    """
+    在交给浏览器之前识别加密音乐的真实格式
+
+    只通过内存映射读取文件开头与末尾的几KB：空文件、过小或明显不完整的文件以及密钥不在文件中的文件直接判为junk，
+    后缀为加密格式但实际是明文音频的文件判为plain，其余按文件头与文件尾的特征识别加密方式，无法识别的交由浏览器。
+    多个文件并行检查，结果以(设备, inode, mtime, 大小)为键缓存，文件变化后才重新检查。
+    """
+
+    _workers: int
+    _max_cached: int
+    _cache: collections.OrderedDict[tuple[int, int, int, int], Preflight]
+    _lock: threading.Lock
+
+    def __init__(self, workers: int = 8, max_cached: int = 65536):
+        """
+        :param workers: 并行检查的线程数
+        :param max_cached: 最多缓存的结果数，超出时淘汰最早的
+        """
+        self._workers = max(workers, 1)
+        self._max_cached = max_cached
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def classify_all(self, paths: Iterable[pathlib.Path]) -> dict[pathlib.Path, Preflight]:
+        """并行检查多个文件，无法读取的文件不包括在结果中"""
+        paths = list(paths)
+        if len(paths) <= 1:
+            results = map(self._classify_or_none, paths)
+        else:
+            with ThreadPoolExecutor(max_workers=min(self._workers, len(paths)), thread_name_prefix='preflight') as pool:
+                results = list(pool.map(self._classify_or_none, paths))
+        return {p: r for p, r in zip(paths, results) if r is not None}
+
+    def classify(self, path: pathlib.Path) -> Preflight:
+        """检查一个文件
+
+        :raise OSError: 文件无法读取时
+        """
+        st = path.stat()
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            result = self._cache.get(key)
+        if result is not None:
+            return result
+
+        result = self._inspect(path, st.st_size)
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self._max_cached:
+                self._cache.popitem(last=False)
+        return result
+
+    def _classify_or_none(self, path: pathlib.Path) -> Optional[Preflight]:
+        try:
+            return self.classify(path)
+        except OSError as e:
+            logging.warning(f'预检"{path.name}"失败：{e}')
+            return None
+
+    @staticmethod
+    def _inspect(path: pathlib.Path, size: int) -> Preflight:
+        if size == 0:
+            return Preflight(JUNK, reason='empty file')
+        if size < _MIN_BYTES:
+            return Preflight(JUNK, reason='file too small')
+
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            head = m[:_HEAD_BYTES]
+            tail = m[-_TAIL_BYTES:]
+
+        if head.startswith(_STRONG_AUDIO_MAGICS) or head[4:8] == b'ftyp':
+            suffix = sniff_audio_suffix(head)
+            if suffix is not None:
+                return Preflight(PLAIN, scheme=suffix)
+
+        if head.startswith(NcmDecoder.magic):
+            return _inspect_ncm(head, size)
+        return _inspect_qmc(tail, size)
+
+
+def _inspect_ncm(head: bytes, size: int) -> Preflight:
+    """根据文件头中的各段长度判断ncm文件是否完整，文件头超出读取范围时不作判断"""
+    pos = len(NcmDecoder.magic) + 2
+    for _ in range(2):  # 依次跳过密钥与元数据
+        if pos + 4 > len(head):
+            return Preflight(LOCKED, scheme=NcmDecoder.scheme)
+        pos += 4 + int.from_bytes(head[pos:pos + 4], 'little')
+    pos += 5
+    if pos + 8 > len(head):
+        return Preflight(LOCKED, scheme=NcmDecoder.scheme)
+    frame_len = int.from_bytes(head[pos:pos + 4], 'little')
+    image_len = int.from_bytes(head[pos + 4:pos + 8], 'little')
+    if pos + 8 + max(frame_len, image_len) >= size:
+        return Preflight(JUNK, reason='truncated ncm file')
+    return Preflight(LOCKED, scheme=NcmDecoder.scheme)
+
+
+def _inspect_qmc(tail: bytes, size: int) -> Preflight:
+    """根据文件尾识别QQ音乐的内嵌密钥，无法识别的视为其他加密格式"""
+    tag = tail[-4:]
+    if tag == b'QTag':
+        if int.from_bytes(tail[-8:-4], 'big') > size - 8:
+            return Preflight(JUNK, reason='truncated qmc file')
+        return Preflight(LOCKED, scheme=QmcDecoder.scheme)
+    if tag in (b'STag', b'cex\x00', b'musx'):
+        return Preflight(JUNK, reason=f'key of "{tag.decode(errors="replace")}" file is not embedded')
+
+    key_len = int.from_bytes(tag, 'little')
+    if 0 < key_len <= min(len(tail), size) - 4 and _EKEY.fullmatch(tail[-4 - key_len:-4]):
+        return Preflight(LOCKED, scheme=QmcDecoder.scheme)
+    return Preflight(LOCKED, scheme=UNKNOWN_SCHEME)
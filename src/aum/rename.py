@@ -0,0 +1,238 @@
+import logging
+import os
+import pathlib
+import re
+import string
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from aum.metrics import metrics
+from aum.tags import TAG_FIELDS, TagReader, Tags
+
+_UNSAFE_CHARS = re.compile(r'[/\\\x00-\x1f]')  # 标签中不能出现在文件名里的字符
+_SAMPLE_TAGS = {'title': '', 'artist': '', 'album': '', 'albumartist': '', 'track': 0, 'disc': 0, 'year': ''}
+
+
+@dataclass(frozen=True)
+class RenameStep:
+    """
+    重命名计划中的一项
+    """
+    source: pathlib.Path
+    target: pathlib.Path
+    conflict: Optional[str] = None  # 冲突原因，为None时可以执行
+
+    @property
+    def ok(self) -> bool:
+        return self.conflict is None
+
+
+class RenameEngine:
+    """
+    编译后的重命名规则
+
+    规则依次作用于文件名的stem：先一次性移除所有子串（编译为一个按长度降序的正则表达式，每个文件名只扫描一遍），
+    再按顺序应用正则替换规则，最后用模板拼出新文件名。模板可使用{stem}与{suffix}，以及从文件标签读取的
+    {title}、{artist}、{album}、{albumartist}（缺省时同artist）、{track}、{disc}（int，可写作{track:02d}）与{year}；
+    模板中的"/"表示子目录，如"{album}/{track:02d}. {title}{suffix}"将文件移入所在目录下以专辑命名的子目录。
+    用到的标签缺失时按{stem}{suffix}命名。
+    """
+
+    template: str
+
+    _removing: Optional[re.Pattern]
+    _regex_rules: list[tuple[re.Pattern, str]]
+    _fields: set[str]  # 模板用到的字段
+    _tags: Optional[TagReader]  # 模板用到标签时才有
+
+    def __init__(self, removing_substr: Iterable[str] = (),
+                 regex_rules: Iterable[tuple[str, str]] = (),
+                 template: str = '{stem}{suffix}',
+                 tag_reader: Optional[TagReader] = None):
+        """
+        :param removing_substr: 需要移除的子串
+        :param regex_rules: (正则表达式, 替换串)，替换串中可用\\1等引用分组
+        :param template: 新文件名的模板
+        :param tag_reader: 模板用到标签时读取标签的TagReader，默认新建一个只缓存在内存中的
+        :raise ValueError: 正则表达式或模板无效时
+        """
+        # 较长者优先，如" [mqms2]"先于" [mqms]"
+        substrs = sorted({s for s in removing_substr if s}, key=len, reverse=True)
+        self._removing = re.compile('|'.join(map(re.escape, substrs))) if substrs else None
+
+        self._regex_rules = []
+        for pattern, repl in regex_rules:
+            try:
+                self._regex_rules.append((re.compile(pattern), repl))
+            except re.error as e:
+                raise ValueError(f'Invalid rename regex "{pattern}": {e}') from e
+
+        try:
+            template.format(stem='', suffix='', **_SAMPLE_TAGS)
+            self._fields = {re.split(r'[.\[]', field)[0] for _, field, _, _ in string.Formatter().parse(template)
+                            if field}
+        except (KeyError, IndexError, ValueError) as e:
+            raise ValueError(f'Invalid rename template "{template}": {e!r}') from e
+        self.template = template
+
+        self._tags = None
+        if self.needs_tags:
+            self._tags = tag_reader if tag_reader is not None else TagReader()
+
+    @property
+    def is_noop(self) -> bool:
+        """是否不会修改任何文件名"""
+        return self._removing is None and not self._regex_rules and self.template == '{stem}{suffix}'
+
+    @property
+    def needs_tags(self) -> bool:
+        """模板是否用到文件标签"""
+        return not self._fields.isdisjoint(TAG_FIELDS)
+
+    def tags_of(self, path: pathlib.Path) -> Optional[Tags]:
+        """读取模板所需的标签，模板未用到标签时返回None"""
+        return self._tags.read(path) if self._tags is not None else None
+
+    def new_name(self, name: str, tags: Optional[Tags] = None) -> str:
+        """计算新文件名，无需修改时返回原文件名
+
+        :param name: 文件名（含后缀）
+        :param tags: 文件的标签，模板用到标签时须给出
+        :return: 新文件名，模板含"/"时为相对所在目录的路径
+        """
+        path = pathlib.PurePath(name)
+        stem = path.stem
+        if self._removing is not None:
+            stem = self._removing.sub('', stem)
+        for pattern, repl in self._regex_rules:
+            stem = pattern.sub(repl, stem)
+
+        template = self.template  # 用到的标签缺失时改用默认模板
+        values = {'stem': stem, 'suffix': path.suffix}
+        if self.needs_tags:
+            tags = dict(tags or {})
+            tags.setdefault('albumartist', tags.get('artist'))
+            for field in self._fields.intersection(TAG_FIELDS):
+                value = tags.get(field)
+                values[field] = _safe(value) if isinstance(value, str) else value
+                if value is None or values[field] == '':
+                    template = '{stem}{suffix}'
+                    break
+        if not stem and ('stem' in self._fields or template != self.template) or '/' in stem:
+            return name  # 规则产生了无效的文件名，保持原样
+
+        new_name = template.format(**values)
+        if any(not part or part.startswith('.') for part in new_name.split('/')):
+            return name  # 规则产生了无效的文件名，保持原样
+        return new_name
+
+    @staticmethod
+    def place(directory: pathlib.Path, new_name: str) -> pathlib.Path:
+        """新文件名在directory中对应的路径
+
+        新文件名含子目录、而directory本身已是该子目录（如已按专辑整理过的文件）时，不再重复嵌套。
+        """
+        *dirs, name = new_name.split('/')
+        if dirs and directory.parts[-len(dirs):] == tuple(dirs):
+            return directory / name
+        return directory / new_name
+
+    def plan(self, paths: Iterable[pathlib.Path]) -> list[RenameStep]:
+        """生成重命名计划，在内存中检测冲突，不修改磁盘
+
+        新文件名已存在、或多个文件将被重命名为同一个名字时，相关的项被标记为冲突。
+
+        :param paths: 待检查的文件
+        :return: 需要重命名的项，按源文件排序
+        """
+        paths = sorted(paths)
+        tags = self._tags.read_all(paths) if self._tags is not None else {}
+
+        steps = {}
+        claimed: dict[pathlib.Path, list[pathlib.Path]] = {}  # 新路径 -> 将被重命名为它的源文件
+        for p in paths:
+            target = self.place(p.parent, self.new_name(p.name, tags.get(p)))
+            if target == p:
+                continue
+            steps[p] = target
+            claimed.setdefault(target, []).append(p)
+
+        plan = []
+        for source, target in steps.items():
+            conflict = None
+            if len(claimed[target]) > 1:
+                others = '、'.join(f'"{p.name}"' for p in claimed[target] if p != source)
+                conflict = f'与{others}重名'
+            elif os.path.lexists(target) and not self._same_file(source, target) and target not in steps:
+                conflict = '目标文件已存在'
+            plan.append(RenameStep(source, target, conflict))
+        return plan
+
+    @staticmethod
+    def apply(plan: Iterable[RenameStep], dir_owner: Optional[tuple[int, int]] = None
+              ) -> dict[pathlib.Path, pathlib.Path]:
+        """执行重命名计划，跳过冲突项
+
+        目标是计划中另一项的源文件时，等其先被重命名后再执行。
+        某一项重命名失败（如权限不足）时记录日志并计入rename_failed，继续执行其余各项。
+
+        :param dir_owner: 新建的子目录的所有者(uid, gid)，为None时不修改
+        :return: 原路径 -> 新路径
+        """
+        renamed = {}
+        pending = []
+        for step in plan:
+            if step.ok:
+                pending.append(step)
+            else:
+                logging.warning(f'跳过"{step.source.name}" -> "{step.target.name}"：{step.conflict}')
+
+        while pending:
+            blocked = []
+            for step in pending:
+                if os.path.lexists(step.target) and not RenameEngine._same_file(step.source, step.target):
+                    blocked.append(step)
+                    continue
+                try:
+                    make_dirs(step.target.parent, dir_owner)
+                    os.rename(step.source, step.target)
+                except OSError as e:
+                    logging.warning(f'重命名"{step.source.name}" -> "{step.target.name}"失败：{e}')
+                    metrics.add_result('rename_failed')
+                    continue
+                renamed[step.source] = step.target
+
+            if len(blocked) == len(pending):  # 无法继续（目标已被占用或循环重命名）
+                for step in blocked:
+                    logging.warning(f'跳过"{step.source.name}" -> "{step.target.name}"：目标文件已存在')
+                break
+            pending = blocked
+        return renamed
+
+    @staticmethod
+    def _same_file(a: pathlib.Path, b: pathlib.Path) -> bool:
+        """是否为同一文件（如不区分大小写的文件系统上仅大小写不同的文件名）"""
+        try:
+            return os.path.samefile(a, b)
+        except OSError:
+            return False
+
+
+def make_dirs(directory: pathlib.Path, owner: Optional[tuple[int, int]] = None):
+    """创建directory及其不存在的上级目录
+
+    :param owner: 新建的目录的所有者(uid, gid)，为None时不修改
+    """
+    missing = []
+    while not directory.exists():
+        missing.append(directory)
+        directory = directory.parent
+    for d in reversed(missing):
+        d.mkdir(exist_ok=True)
+        if owner is not None:
+            os.chown(d, *owner)
+
+
+def _safe(value: str) -> str:
+    """使标签值可以作为文件名的一部分"""
+    return _UNSAFE_CHARS.sub('_', value).strip().lstrip('.')
@@ -0,0 +1,131 @@
+import fnmatch
+import logging
+import os
+import pathlib
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+
+class LibraryScanner:
+    """
+    基于os.scandir的音乐目录扫描器，可进入子目录
+
+    各目录在线程池中并行列出（NFS、SMB等网络文件系统上，每个目录的往返延迟远大于列出本身），
+    列完一个目录即产出其中的文件，调用方无需等待全部列完即可开始处理。
+    产出的os.DirEntry带有列目录时得到的类型信息，其stat()结果也会被缓存。
+    不进入指向目录的符号链接，以免循环。
+    """
+
+    root: pathlib.Path
+    max_depth: Optional[int]  # 进入子目录的层数，0表示只扫描root本身，None表示不限
+    exclude: tuple[str, ...]  # 排除的glob，匹配相对root的路径或名称，对文件与目录均有效
+    workers: int  # 并行列目录的线程数
+
+    def __init__(self, root: pathlib.Path, max_depth: Optional[int] = 0, exclude: Iterable[str] = (),
+                 workers: int = 8):
+        """
+        :param root: 被扫描的目录
+        :param max_depth: 进入子目录的层数，0表示只扫描root本身，None表示不限
+        :param exclude: 排除的glob，如".*"、"Podcasts/*"，匹配相对root的路径（以"/"分隔）或名称
+        :param workers: 并行列目录的线程数
+        """
+        if workers < 1:
+            raise ValueError(f'Scanner workers must be positive (value: {workers}).')
+
+        self.root = root
+        self.max_depth = max_depth
+        self.exclude = tuple(exclude)
+        self.workers = workers
+
+    def directories(self) -> Iterator[tuple[pathlib.Path, list[os.DirEntry]]]:
+        """逐个目录产出(目录, 其中的文件)，先列完的目录先产出，root总是第一个
+
+        子目录无法列出时记录警告并跳过。
+
+        :raise OSError: root无法列出时
+        """
+        results = queue.Queue()  # 每个列目录任务放入一个(目录, 文件, 异常)
+        submitted = 1
+        lock = threading.Lock()
+        stopped = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scan')
+
+        def list_dir(directory: pathlib.Path, depth: int):
+            nonlocal submitted
+            if stopped.is_set():
+                results.put((directory, [], None))
+                return
+            try:
+                files, subdirs = self._list(directory, depth)
+            except OSError as e:
+                results.put((directory, [], e))
+                return
+
+            # 子目录须在产出本目录之前提交，调用方据此判断是否已全部列完
+            with lock:
+                submitted += len(subdirs)
+            for subdir in subdirs:
+                executor.submit(list_dir, subdir, depth + 1)
+            results.put((directory, files, None))
+
+        executor.submit(list_dir, self.root, 0)
+        received = 0
+        try:
+            while True:
+                with lock:
+                    if received == submitted:
+                        return
+                directory, files, error = results.get()
+                received += 1
+                if error is not None:
+                    if directory == self.root:
+                        raise error
+                    logging.warning(f'无法列出目录"{directory}"，已跳过：{error}')
+                    continue
+                yield directory, files
+        finally:
+            stopped.set()  # 提前停止迭代时不再列出剩余的目录
+            executor.shutdown(wait=False)
+
+    def files(self) -> Iterator[os.DirEntry]:
+        """产出各目录中的文件"""
+        for _, files in self.directories():
+            yield from files
+
+    def paths(self) -> Iterator[pathlib.Path]:
+        """产出各目录中文件的路径"""
+        return (pathlib.Path(entry.path) for entry in self.files())
+
+    def excludes(self, path: os.PathLike) -> bool:
+        """root下的路径是否被排除（只检查其自身，不检查其所在的目录）"""
+        path = pathlib.Path(path)
+        return self._excluded(path.relative_to(self.root).as_posix(), path.name)
+
+    def _list(self, directory: pathlib.Path, depth: int) -> tuple[list[os.DirEntry], list[pathlib.Path]]:
+        """列出一个目录
+
+        :return: 其中未被排除的文件，以及需要进入的子目录
+        """
+        descend = self.max_depth is None or depth < self.max_depth
+        prefix = directory.relative_to(self.root).as_posix() + '/' if depth else ''
+        files = []
+        subdirs = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                if self._excluded(prefix + entry.name, entry.name):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if descend:
+                            subdirs.append(pathlib.Path(entry.path))
+                    elif entry.is_file():
+                        files.append(entry)
+                except OSError:  # 列出后被删除等
+                    continue
+        return files, subdirs
+
+    def _excluded(self, rel_path: str, name: str) -> bool:
+        return any(fnmatch.fnmatchcase(rel_path, pattern) or fnmatch.fnmatchcase(name, pattern)
+                   for pattern in self.exclude)
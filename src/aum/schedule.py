@@ -0,0 +1,122 @@
+import logging
+import pathlib
+import time
+from typing import TYPE_CHECKING, Iterable, Optional
+
+from aum.batcher import Batcher, BatchBudget
+
+if TYPE_CHECKING:
+    from aum.index import FileIndex
+
+# 解锁顺序：scan（扫描顺序，边扫描边解锁）、newest（最新修改的优先）、smallest（最小的优先，使平均等待时间最短）、
+# directory（按目录，同一专辑的歌曲一同解锁）
+SCHEDULE_ORDERS = ('scan', 'newest', 'smallest', 'directory')
+
+
+class UnlockScheduler:
+    """
+    决定一次运行中加密音乐的解锁顺序与数量
+
+    按策略排序后，等待超过aging_seconds的文件提到最前（等待最久的优先），以免大文件或旧文件一直被新文件挤到后面；
+    按扫描顺序时不排序，也不提前。
+    等待时间从文件状态索引首次发现该文件时算起，未设置索引时以文件的ctime（移入音乐目录的时间）近似。
+    设置每次运行的批数上限时，超出上限的文件留待之后的运行，同一调度器在多次调用间累计已分配的批数。
+    """
+
+    order: str
+    aging_seconds: float  # 等待超过该时间的文件优先解锁，0表示不提前
+    max_batches: int  # 每次运行最多解锁的批数，0表示不限
+
+    _patch_size: int
+    _budget: Optional[BatchBudget]
+    _batches_left: Optional[int]  # 剩余可分配的批数，None表示不限
+
+    def __init__(self, order: str = 'scan', aging_seconds: float = 0, max_batches: int = 0,
+                 patch_size: int = 0, budget: Optional[BatchBudget] = None):
+        """
+        :param order: 解锁顺序，见SCHEDULE_ORDERS
+        :param aging_seconds: 等待超过该时间的文件优先解锁，0表示不提前
+        :param max_batches: 每次运行最多解锁的批数，0表示不限
+        :param patch_size: 每批的文件数上限，用于按批数上限选取文件
+        :param budget: 每批的字节数上限，用于按批数上限选取文件
+        """
+        if order not in SCHEDULE_ORDERS:
+            raise ValueError(f'Unknown schedule order: {order}')
+
+        self.order = order
+        self.aging_seconds = aging_seconds
+        self.max_batches = max_batches
+        self._patch_size = patch_size
+        self._budget = budget
+        self._batches_left = max_batches or None
+
+    @property
+    def streaming(self) -> bool:
+        """能否边扫描边解锁：按扫描顺序时无需先看到全部文件"""
+        return self.order == 'scan'
+
+    def schedule(self, files: Iterable[pathlib.Path], index: Optional['FileIndex'] = None
+                 ) -> tuple[list[pathlib.Path], list[pathlib.Path]]:
+        """排序并按批数上限选取本次解锁的文件
+
+        :param files: 待解锁的加密音乐
+        :param index: 文件状态索引，用于记录文件首次发现的时间
+        :return: 按顺序排列的本次解锁的文件，以及留待之后运行的文件
+        """
+        ordered = self._sort(list(dict.fromkeys(files)), index)
+        if self._batches_left is None:
+            return ordered, []
+
+        # 按与解锁时相同的规则预先分批，只取剩余批数内的文件
+        batcher = Batcher(ordered, self._patch_size, self._budget)
+        selected = []
+        while self._batches_left > 0:
+            batch = batcher.next_batch()
+            if batch is None:
+                break
+            selected += batch
+            self._batches_left -= 1
+
+        chosen = set(selected)
+        deferred = [p for p in ordered if p not in chosen]
+        if deferred:
+            logging.info(f'已达到每次运行{self.max_batches}批的上限，{len(deferred)}首加密音乐留待下次运行。')
+        return [p for p in ordered if p in chosen], deferred
+
+    def _sort(self, files: list[pathlib.Path], index: Optional['FileIndex']) -> list[pathlib.Path]:
+        if self.order == 'scan':
+            return files
+
+        stats = {}
+        for p in files:
+            try:
+                stats[p] = p.stat()
+            except OSError:  # 已被删除等，排在最后，由解锁时处理
+                stats[p] = None
+
+        def key(p: pathlib.Path):
+            st = stats[p]
+            if st is None:
+                return 1,
+            if self.order == 'newest':
+                return 0, -st.st_mtime_ns
+            if self.order == 'smallest':
+                return 0, st.st_size
+            return 0, str(p.parent), p.name
+
+        ordered = sorted(files, key=key)
+        if not self.aging_seconds:
+            return ordered
+
+        now = time.time()
+        if index is not None:
+            first_seen = index.first_seen(files)
+        else:
+            first_seen = {p: st.st_ctime for p, st in stats.items() if st is not None}
+        aged = [p for p in ordered if p in first_seen and now - first_seen[p] >= self.aging_seconds]
+        if not aged:
+            return ordered
+        aged.sort(key=lambda p: first_seen[p])
+        logging.debug(f'{len(aged)}首加密音乐等待超过{self.aging_seconds:.0f}秒，优先解锁。')
+        aged_set = set(aged)
+        return aged + [p for p in ordered if p not in aged_set]
@@ -0,0 +1,386 @@
+import json
+import logging
+import mmap
+import pathlib
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Iterable, Optional, Union
+
+Tags = dict[str, Union[str, int]]  # 字段名 -> 值，曲目号与碟号为int，其余为str
+
+TAG_FIELDS = ('title', 'artist', 'album', 'albumartist', 'track', 'disc', 'year')  # 可读取的字段
+
+_MAX_TAG_BYTES = 16 << 20  # 标签区域的长度上限，超出时视为文件损坏
+_NUMBER = re.compile(r'\s*(\d+)')
+_YEAR = re.compile(r'\d{4}')
+
+_ID3_FRAMES = {  # ID3v2.3/2.4与ID3v2.2的帧名 -> 字段
+    b'TIT2': 'title', b'TPE1': 'artist', b'TALB': 'album', b'TPE2': 'albumartist', b'TRCK': 'track',
+    b'TPOS': 'disc', b'TYER': 'year', b'TDRC': 'year',
+    b'TT2': 'title', b'TP1': 'artist', b'TAL': 'album', b'TP2': 'albumartist', b'TRK': 'track',
+    b'TPA': 'disc', b'TYE': 'year',
+}
+_VORBIS_FIELDS = {  # Vorbis comment的键 -> 字段
+    'TITLE': 'title', 'ARTIST': 'artist', 'ALBUM': 'album', 'ALBUMARTIST': 'albumartist',
+    'ALBUM ARTIST': 'albumartist', 'TRACKNUMBER': 'track', 'DISCNUMBER': 'disc', 'DATE': 'year', 'YEAR': 'year',
+}
+_MP4_ITEMS = {  # MP4 ilst中的项 -> 字段
+    b'\xa9nam': 'title', b'\xa9ART': 'artist', b'\xa9alb': 'album', b'aART': 'albumartist', b'trkn': 'track',
+    b'disk': 'disc', b'\xa9day': 'year',
+}
+_ID3_ENCODINGS = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tags (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    tags TEXT NOT NULL,
+    stored REAL NOT NULL,
+    PRIMARY KEY (dev, ino, mtime_ns, size)
+);
+'''
+
+
+class TagReader:
+    """
+    读取音频文件的标签（ID3v1/ID3v2、FLAC与Ogg的Vorbis comment、MP4的ilst）
+
+    通过内存映射只访问标签所在的区域：ID3v2与Vorbis comment位于文件开头，按各段长度跳过其余部分（如封面图片），
+    MP4只读取各box的头部直到找到moov中的ilst，ID3v1只读取最后128字节。音频数据本身不会被读取。
+    解析结果以(设备, inode, mtime, 大小)为键缓存在内存中；给定数据库时同时持久化，使每次运行无需重新解析整个音乐库。
+    可供多个线程同时使用。
+    """
+
+    db_path: Optional[pathlib.Path]
+
+    _memory: dict[tuple[int, int, int, int], Tags]
+    _max_cached: int
+    _lock: threading.Lock
+
+    def __init__(self, db_path: Optional[pathlib.Path] = None, max_cached: int = 65536):
+        """
+        :param db_path: 持久化缓存的SQLite数据库文件路径，不存在时自动创建，为None时只缓存在内存中
+        :param max_cached: 最多缓存的结果数，超出时淘汰最早的
+        """
+        self.db_path = db_path
+        self._memory = {}
+        self._max_cached = max_cached
+        self._lock = threading.Lock()
+
+    def read(self, path: pathlib.Path) -> Tags:
+        """读取一个文件的标签，无法读取或没有标签时返回空dict"""
+        return self.read_all([path]).get(path, {})
+
+    def read_all(self, paths: Iterable[pathlib.Path]) -> dict[pathlib.Path, Tags]:
+        """读取多个文件的标签，无法读取的文件不包括在结果中"""
+        keys = {}
+        for p in paths:
+            try:
+                st = p.stat()
+            except OSError as e:
+                logging.warning(f'读取"{p.name}"的标签失败：{e}')
+                continue
+            keys[p] = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+        results = {}
+        with self._lock:
+            for p, key in keys.items():
+                if key in self._memory:
+                    results[p] = self._memory[key]
+        missing = {p: key for p, key in keys.items() if p not in results}
+        if not missing:
+            return results
+
+        stored = self._load(missing.values())
+        parsed = {}
+        for p, key in missing.items():
+            if key in stored:
+                results[p] = stored[key]
+                continue
+            try:
+                results[p] = parsed[key] = read_tags(p)
+            except (OSError, ValueError) as e:
+                logging.warning(f'读取"{p.name}"的标签失败：{e}')
+
+        self._store(parsed)
+        with self._lock:
+            for p, key in missing.items():
+                if p in results:
+                    self._memory[key] = results[p]
+            while len(self._memory) > self._max_cached:
+                del self._memory[next(iter(self._memory))]
+        return results
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def _load(self, keys: Iterable[tuple[int, int, int, int]]) -> dict[tuple[int, int, int, int], Tags]:
+        if self.db_path is None:
+            return {}
+        loaded = {}
+        try:
+            with closing(self._connect()) as conn:
+                for key in keys:
+                    row = conn.execute('SELECT tags FROM tags WHERE dev = ? AND ino = ? AND mtime_ns = ? AND size = ?',
+                                       key).fetchone()
+                    if row is not None:
+                        loaded[key] = json.loads(row[0])
+        except sqlite3.Error as e:
+            logging.warning(f'读取标签缓存失败：{e}')
+        return loaded
+
+    def _store(self, parsed: dict[tuple[int, int, int, int], Tags]):
+        if self.db_path is None or not parsed:
+            return
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany('INSERT OR REPLACE INTO tags (dev, ino, mtime_ns, size, tags, stored) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)',
+                                 [key + (json.dumps(tags, ensure_ascii=False), now) for key, tags in parsed.items()])
+                # 文件修改或删除后旧的记录不再命中，只保留最近的max_cached条
+                conn.execute('DELETE FROM tags WHERE rowid IN (SELECT rowid FROM tags ORDER BY stored DESC '
+                             'LIMIT -1 OFFSET ?)', (self._max_cached,))
+        except sqlite3.Error as e:
+            logging.warning(f'写入标签缓存失败：{e}')
+
+
+def read_tags(path: pathlib.Path) -> Tags:
+    """解析一个文件的标签，不缓存
+
+    :return: 读到的字段，没有标签或格式不支持时为空dict
+    :raise OSError: 文件无法读取时
+    :raise ValueError: 标签结构损坏时
+    """
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            try:
+                return _parse(m)
+            except IndexError as e:  # 标签比文件还长
+                raise ValueError('Truncated tag') from e
+
+
+def _parse(m: mmap.mmap) -> Tags:
+    tags = {}
+    pos = 0
+    if m[:3] == b'ID3':
+        size = _syncsafe(m[6:10])
+        _check_size(size)
+        tags = _parse_id3v2(m[:10 + size])
+        pos = 10 + size
+
+    head = m[pos:pos + 8]
+    if head[:4] == b'fLaC':
+        vorbis = _parse_flac(m, pos + 4)
+    elif head[:4] == b'OggS':
+        vorbis = _parse_ogg(m, pos)
+    elif head[4:8] == b'ftyp':
+        vorbis = _parse_mp4(m, pos, len(m))
+    else:
+        vorbis = {}
+    for field, value in vorbis.items():
+        tags.setdefault(field, value)
+
+    if not tags and len(m) >= 128 and m[-128:-125] == b'TAG':
+        tags = _parse_id3v1(m[-128:])
+    return {field: value for field, value in tags.items() if value != ''}
+
+
+def _check_size(size: int):
+    if size > _MAX_TAG_BYTES:
+        raise ValueError(f'Tag block of {size} bytes is too large')
+
+
+def _syncsafe(data: bytes) -> int:
+    return data[0] << 21 | data[1] << 14 | data[2] << 7 | data[3]
+
+
+def _set(tags: Tags, field: str, value: str):
+    """按字段类型规整后记录，同一字段只保留第一个值"""
+    value = value.strip('\x00 ')
+    if field in tags or not value:
+        return
+    if field in ('track', 'disc'):  # 形如"3/12"
+        match = _NUMBER.match(value)
+        if match is not None:
+            tags[field] = int(match.group(1))
+    elif field == 'year':  # 形如"2020-05-01"
+        match = _YEAR.search(value)
+        if match is not None:
+            tags[field] = match.group()
+    else:
+        tags[field] = value
+
+
+def _parse_id3v2(data: bytes) -> Tags:
+    version, flags = data[3], data[5]
+    body = data[10:]
+    if flags & 0x80 and version < 4:  # 整个标签经过反同步
+        body = body.replace(b'\xff\x00', b'\xff')
+    pos = 0
+    if flags & 0x40 and version >= 3:  # 跳过扩展头
+        pos = _syncsafe(body[:4]) if version == 4 else 4 + int.from_bytes(body[:4], 'big')
+
+    id_len, header_len = (3, 6) if version == 2 else (4, 10)
+    tags = {}
+    while pos + header_len <= len(body):
+        frame_id = body[pos:pos + id_len]
+        if not frame_id.strip(b'\x00'):  # 填充
+            break
+        if version == 2:
+            size = int.from_bytes(body[pos + 3:pos + 6], 'big')
+            frame_flags = 0
+        else:
+            size_bytes = body[pos + 4:pos + 8]
+            size = _syncsafe(size_bytes) if version == 4 else int.from_bytes(size_bytes, 'big')
+            frame_flags = int.from_bytes(body[pos + 8:pos + 10], 'big')
+        frame = body[pos + header_len:pos + header_len + size]
+        pos += header_len + size
+
+        field = _ID3_FRAMES.get(frame_id)
+        if field is None or not frame or version == 4 and frame_flags & 0x000C:  # 压缩或加密的帧
+            continue
+        if version == 4:
+            if frame_flags & 0x0001:  # 数据长度指示
+                frame = frame[4:]
+            if frame_flags & 0x0002:
+                frame = frame.replace(b'\xff\x00', b'\xff')
+        if frame[0] >= len(_ID3_ENCODINGS):
+            continue
+        text = frame[1:].decode(_ID3_ENCODINGS[frame[0]], errors='replace')
+        _set(tags, field, ', '.join(v for v in text.split('\x00') if v))  # ID3v2.4以\x00分隔多个值
+    return tags
+
+
+def _parse_id3v1(data: bytes) -> Tags:
+    def text(field: bytes) -> str:
+        field = field.split(b'\x00', 1)[0]
+        try:
+            return field.decode('utf-8')
+        except UnicodeDecodeError:
+            return field.decode('latin-1')
+
+    tags = {}
+    for field, start, end in (('title', 3, 33), ('artist', 33, 63), ('album', 63, 93), ('year', 93, 97)):
+        _set(tags, field, text(data[start:end]))
+    if data[125] == 0 and data[126] != 0:  # ID3v1.1
+        tags['track'] = data[126]
+    return tags
+
+
+def _parse_vorbis_comment(data: bytes) -> Tags:
+    vendor_len = int.from_bytes(data[:4], 'little')
+    pos = 4 + vendor_len
+    count = int.from_bytes(data[pos:pos + 4], 'little')
+    pos += 4
+    tags = {}
+    for _ in range(count):
+        length = int.from_bytes(data[pos:pos + 4], 'little')
+        comment = data[pos + 4:pos + 4 + length]
+        pos += 4 + length
+        if len(comment) < length:
+            raise ValueError('Truncated Vorbis comment')
+        key, sep, value = comment.partition(b'=')
+        field = _VORBIS_FIELDS.get(key.decode('ascii', errors='replace').upper())
+        if sep and field is not None:
+            _set(tags, field, value.decode('utf-8', errors='replace'))
+    return tags
+
+
+def _parse_flac(m: mmap.mmap, pos: int) -> Tags:
+    """依次跳过各元数据块，只读取VORBIS_COMMENT块"""
+    while pos + 4 <= len(m):
+        header = m[pos:pos + 4]
+        size = int.from_bytes(header[1:], 'big')
+        if header[0] & 0x7F == 4:
+            _check_size(size)
+            return _parse_vorbis_comment(m[pos + 4:pos + 4 + size])
+        if header[0] & 0x80:  # 最后一个元数据块
+            break
+        pos += 4 + size
+    return {}
+
+
+def _parse_ogg(m: mmap.mmap, pos: int) -> Tags:
+    """拼接前几个页中的第二个数据包（Vorbis或Opus的comment头）"""
+    packets = [b'']
+    while len(packets) < 3 and m[pos:pos + 4] == b'OggS' and pos + 27 <= len(m):
+        segments = m[pos + 26]
+        lacing = m[pos + 27:pos + 27 + segments]
+        pos += 27 + segments
+        for length in lacing:
+            packets[-1] += m[pos:pos + length]
+            pos += length
+            if length < 255:  # 数据包结束
+                packets.append(b'')
+        _check_size(sum(map(len, packets)))
+
+    if len(packets) < 3:
+        return {}
+    packet = packets[1]
+    for prefix in (b'\x03vorbis', b'OpusTags'):
+        if packet.startswith(prefix):
+            return _parse_vorbis_comment(packet[len(prefix):])
+    return {}
+
+
+def _mp4_boxes(m: mmap.mmap, start: int, end: int) -> Iterable[tuple[bytes, int, int]]:
+    """只读取各box的头部
+
+    :return: (类型, 内容的开始位置, 结束位置)
+    """
+    pos = start
+    while pos + 8 <= end:
+        size = int.from_bytes(m[pos:pos + 4], 'big')
+        box_type = m[pos + 4:pos + 8]
+        header = 8
+        if size == 1:  # 64位长度
+            size = int.from_bytes(m[pos + 8:pos + 16], 'big')
+            header = 16
+        elif size == 0:  # 直到文件末尾
+            size = end - pos
+        if size < header:
+            raise ValueError(f'Invalid MP4 box size {size}')
+        yield box_type, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _parse_mp4(m: mmap.mmap, start: int, end: int) -> Tags:
+    """沿moov/udta/meta/ilst向下查找，其余box（包括音频数据mdat）只读取头部后跳过"""
+    path = (b'moov', b'udta', b'meta', b'ilst')
+    for box_type in path:
+        for found, body_start, body_end in _mp4_boxes(m, start, end):
+            if found == box_type:
+                start, end = body_start, body_end
+                if box_type == b'meta':  # meta是full box，内容前有4字节版本与标志
+                    start += 4
+                break
+        else:
+            return {}
+
+    _check_size(end - start)
+    tags = {}
+    for item, item_start, item_end in _mp4_boxes(m, start, end):
+        field = _MP4_ITEMS.get(item)
+        if field is None:
+            continue
+        for box_type, data_start, data_end in _mp4_boxes(m, item_start, item_end):
+            if box_type != b'data':
+                continue
+            value = m[data_start + 8:data_end]  # 跳过类型与地区
+            if field in ('track', 'disc'):  # 2字节保留、2字节序号、2字节总数
+                if len(value) >= 4 and int.from_bytes(value[2:4], 'big'):
+                    tags.setdefault(field, int.from_bytes(value[2:4], 'big'))
+            else:
+                _set(tags, field, value.decode('utf-8', errors='replace'))
+            break
+    return tags
@@ -1 +1,14 @@
-from .unlocker import MusicUnlocker, PatchMusicUnlocker
+from .base import BaseUnlocker
+from .finalize import Finalizer
+from .local import LocalDecryptUnlocker
+from .page import ReloadPolicy, UnlockDeadline
+
+_BROWSER_UNLOCKERS = {'MusicUnlocker', 'ParallelMusicUnlocker', 'PatchMusicUnlocker'}
+
+
+def __getattr__(name: str):
+    """浏览器解锁相关的类依赖selenium，首次使用时才导入"""
+    if name in _BROWSER_UNLOCKERS:
+        from . import unlocker
+        return getattr(unlocker, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,27 @@
+import pathlib
+from abc import ABC, abstractmethod
+from typing import Iterable
+
+
+class BaseUnlocker(ABC):
+    """
+    解锁后端的接口，不同后端（浏览器、本地解密等）均实现此接口
+    """
+
+    failed_files: set[pathlib.Path]  # 上次调用unlock_files时未能解锁的文件
+    failure_reasons: dict[pathlib.Path, str]  # 上次调用unlock_files时未能解锁的文件 -> 原因
+    unlocked_files: dict[pathlib.Path, pathlib.Path]  # 上次调用unlock_files时各源文件解锁后在音乐目录中的路径
+
+    def supports(self, path: pathlib.Path) -> bool:
+        """该后端能否处理此文件，默认全部支持
+
+        :param path: 待解锁的文件路径
+        """
+        return True
+
+    @abstractmethod
+    def unlock_files(self, files: Iterable[pathlib.Path]) -> set[str]:
+        """
+        :param files: 待解锁的文件路径迭代器
+        :return: 解锁后的音频文件名组成的set
+        """
@@ -0,0 +1,201 @@
+import logging
+import os
+import pathlib
+import re
+import time
+from typing import Iterable, Iterator, Optional
+
+from aum.helpers.inotify import IN_CLOSE_WRITE, IN_MOVED_TO, Inotify
+
+_PART_SUFFIX = '.part'  # Firefox下载中的临时文件后缀
+_DEDUP_PATTERN = re.compile(r'(.*)\(\d+\)')  # Firefox为重名下载追加的"(n)"
+
+
+class DownloadMatcher:
+    """
+    将下载目录中出现的文件对应回上传的源文件
+
+    同源文件名模式下结果与源文件同stem；同一批内stem相同的源文件，Firefox会为后下载者追加"(n)"，
+    此时优先按源文件后缀推测的格式对应，保证每个源文件只对应一个结果。
+    """
+
+    _pending: dict[str, list[pathlib.Path]]  # stem -> 尚未对应到结果的源文件
+    _suffixes: set[str]
+    matched: dict[pathlib.Path, pathlib.Path]  # 源文件 -> 下载结果
+
+    def __init__(self, files: Iterable[pathlib.Path], unlocked_suffixes: set[str]):
+        """
+        :param files: 上传的源文件
+        :param unlocked_suffixes: 解锁后的音频文件后缀
+        """
+        self._pending = {}
+        for p in sorted(files):
+            self._pending.setdefault(p.stem, []).append(p)
+        self._suffixes = unlocked_suffixes.copy()
+        self.matched = {}
+
+    @property
+    def left(self) -> int:
+        """尚未下载完成的文件数"""
+        return sum(len(i) for i in self._pending.values())
+
+    @staticmethod
+    def _expected_suffix(source: pathlib.Path) -> Optional[str]:
+        """根据加密后缀推测解锁后的格式"""
+        suffix = source.suffix.lower()
+        if 'flac' in suffix:
+            return '.flac'
+        if 'ogg' in suffix or suffix.startswith('.mgg'):
+            return '.ogg'
+        return None
+
+    def match(self, path: pathlib.Path) -> Optional[pathlib.Path]:
+        """尝试将一个下载完成的文件对应到源文件
+
+        :param path: 下载完成的文件
+        :return: 对应的源文件，无法对应时返回None
+        """
+        if path.suffix not in self._suffixes or path in self.matched.values():
+            return None
+
+        stems = [path.stem]
+        dedup = _DEDUP_PATTERN.fullmatch(path.stem)
+        if dedup is not None:
+            stems.append(dedup.group(1))
+
+        for stem in stems:
+            sources = self._pending.get(stem)
+            if not sources:
+                continue
+
+            source = next((s for s in sources if self._expected_suffix(s) == path.suffix), sources[0])
+            sources.remove(source)
+            if not sources:
+                del self._pending[stem]
+            self.matched[source] = path
+            return source
+        return None
+
+
+class DownloadWatcher:
+    """
+    监视浏览器下载目录，生成下载完成的文件
+
+    优先使用inotify响应写入关闭/移入事件，不可用时退回定时扫描。只有不存在对应的.part文件、
+    非空且大小在settle_time内保持不变的文件才视为下载完成。开始监视时目录中已有的文件
+    （如上一批尚未移走的结果）不会生成。
+    """
+
+    download_dir: pathlib.Path
+
+    _settle_time: float
+    _poll_interval: float
+    _inotify: Optional[Inotify]
+    _candidates: dict[str, tuple[int, float]]  # 文件名 -> (上次观测的大小, 大小最后变化的时间)
+    _reported: set[str]  # 已生成过的文件名
+    _existing: dict[str, tuple[int, int]]  # 开始监视时已有的文件名 -> (inode, mtime)
+
+    def __init__(self, download_dir: pathlib.Path, settle_time: float = 0.2, poll_interval: float = 1):
+        """
+        :param download_dir: 浏览器下载目录
+        :param settle_time: 文件大小保持不变多久后视为写入完成，单位秒
+        :param poll_interval: 不支持inotify时的扫描间隔，单位秒
+        """
+        self.download_dir = download_dir
+        self._settle_time = settle_time
+        self._poll_interval = poll_interval
+        self._inotify = None
+        self._candidates = {}
+        self._reported = set()
+        self._existing = {}
+
+    def __enter__(self) -> 'DownloadWatcher':
+        """开始监视，须在触发下载之前调用以免错过事件"""
+        with os.scandir(self.download_dir) as it:
+            self._existing = {entry.name: (entry.inode(), entry.stat().st_mtime_ns) for entry in it}
+        if Inotify.available():
+            try:
+                self._inotify = Inotify()
+                self._inotify.add_watch(self.download_dir, IN_CLOSE_WRITE | IN_MOVED_TO)
+            except OSError as e:
+                logging.debug(f'inotify不可用，将定时扫描下载目录：{e}')
+                self.close()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _scan(self):
+        """扫描整个目录，将新文件加入候选"""
+        with os.scandir(self.download_dir) as it:
+            for entry in it:
+                if entry.is_file():
+                    self._add_candidate(entry.name)
+
+    def _add_candidate(self, name: str):
+        if name.endswith(_PART_SUFFIX) or name in self._reported or name in self._candidates:
+            return
+        self._candidates[name] = (-1, time.monotonic())
+
+    def _settled(self) -> list[pathlib.Path]:
+        """检查候选文件，返回已下载完成的文件"""
+        now = time.monotonic()
+        done = []
+        for name, (last_size, last_change) in list(self._candidates.items()):
+            path = self.download_dir / name
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                del self._candidates[name]
+                continue
+            size = st.st_size
+
+            if self._existing.get(name) == (st.st_ino, st.st_mtime_ns):  # 开始监视前已有的文件，被移走后同名的新下载仍会生成
+                del self._candidates[name]
+                continue
+
+            # Firefox会先创建空的占位文件，因此空文件也视为未完成
+            if size != last_size or size == 0 or (self.download_dir / (name + _PART_SUFFIX)).exists():
+                self._candidates[name] = (size, now)
+            elif now - last_change >= self._settle_time:
+                del self._candidates[name]
+                self._reported.add(name)
+                done.append(path)
+        return done
+
+    def completed_files(self, idle_timeout: Optional[float] = None,
+                        deadline: Optional[float] = None) -> Iterator[pathlib.Path]:
+        """持续生成下载完成的文件，由调用方决定何时停止
+
+        :param idle_timeout: 超过该秒数没有文件下载完成时停止生成，None表示不限
+        :param deadline: 到达该时刻（time.monotonic()）时停止生成，None表示不限
+        """
+        self._scan()  # 开始监视后、读取事件前出现的文件也需检查
+        last_done = time.monotonic()
+        while True:
+            for path in self._settled():
+                yield path
+                last_done = time.monotonic()
+
+            ends = [t for t in (deadline, last_done + idle_timeout if idle_timeout is not None else None)
+                    if t is not None]
+            remaining = min(ends) - time.monotonic() if ends else None
+            if remaining is not None and remaining <= 0:
+                return
+
+            # 有尚未稳定的候选时，只需等到下一次检查
+            timeout = self._settle_time if self._candidates else self._poll_interval
+            if self._inotify is not None:
+                wait = timeout if self._candidates else None
+                if remaining is not None:
+                    wait = remaining if wait is None else min(wait, remaining)
+                for event in self._inotify.read(timeout=wait):
+                    self._add_candidate(event.name)
+            else:
+                time.sleep(timeout if remaining is None else min(timeout, remaining))
+                self._scan()
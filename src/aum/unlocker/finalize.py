@@ -0,0 +1,392 @@
+import errno
+import logging
+import os
+import pathlib
+from typing import Iterable, Optional
+
+from aum.helpers.copy import copy_fd
+from aum.journal import UnlockJournal
+from aum.metrics import metrics
+from aum.rename import RenameEngine, make_dirs
+
+_TMP_FORMAT = '.{}.aum-tmp'  # 目标目录中临时文件的名称，以"."开头以免被当作新文件处理
+
+
+def output_dir(music_dir: pathlib.Path, source: pathlib.Path) -> pathlib.Path:
+    """源文件的解锁结果所在的目录：音乐目录中（含子目录）的源文件为其所在目录，其余为音乐目录"""
+    try:
+        source.parent.relative_to(music_dir)
+    except ValueError:
+        return music_dir
+    return source.parent
+
+
+class Finalizer:
+    """
+    将浏览器下载目录中的解锁结果发布到音乐目录
+
+    每个文件一次完成：先移入目标目录中的临时文件，同一文件系统时直接rename，否则以copy_file_range/sendfile
+    流式复制；在文件描述符上设置所有者与权限；同一批全部就绪后统一fsync，再原子地rename为最终文件名，
+    并删除下载目录中的结果与加密的源文件。目录只在每批结束时fsync一次。
+    给定重命名规则时，最终文件名在发布时即按规则计算，无需之后再扫描目录重命名；模板用到标签时从解锁结果中读取。
+    音乐目录的子目录中的源文件，其结果发布到源文件所在的子目录。
+    给定预写日志时，下载完成与开始发布时分别记入日志，进程中途退出后由下一次运行的recover()完成发布。
+    由页面脚本取回的结果经publish_stream()逐个直接写入目标目录，不经过下载目录。
+    """
+
+    music_dir: pathlib.Path
+
+    _file_owner: Optional[tuple[int, int]]
+    _file_mode: Optional[int]
+    _fsync: bool
+    _remove_sources: bool
+    _renamer: Optional[RenameEngine]
+    _keep_results: bool
+    _journal: Optional[UnlockJournal]
+
+    def __init__(self, music_dir: pathlib.Path,
+                 file_owner: Optional[tuple[int, int]] = None,
+                 file_mode: Optional[int] = None,
+                 fsync: bool = False,
+                 remove_sources: bool = False,
+                 renamer: Optional[RenameEngine] = None,
+                 keep_results: bool = False,
+                 journal: Optional[UnlockJournal] = None):
+        """
+        :param music_dir: 音乐目录
+        :param file_owner: 发布的文件的所有者(uid, gid)，为None时不修改
+        :param file_mode: 发布的文件的权限，为None时保持下载结果的权限
+        :param fsync: 发布前是否将文件与目录写入磁盘
+        :param remove_sources: 发布后是否删除加密的源文件
+        :param renamer: 发布时应用的重命名规则，为None时保持下载结果的文件名
+        :param keep_results: 是否保留结果（总是复制），用于从缓存等处发布副本
+        :param journal: 记录发布进度的预写日志，为None时不记录
+        """
+        self.music_dir = music_dir
+        self._file_owner = file_owner
+        self._file_mode = file_mode
+        self._fsync = fsync
+        self._remove_sources = remove_sources
+        self._renamer = renamer
+        self._keep_results = keep_results
+        self._journal = journal
+
+    def log_downloaded(self, downloaded: dict[pathlib.Path, pathlib.Path]):
+        """在提交发布之前记录一批已下载的结果，使进程在发布前退出时，下一次运行可直接发布
+
+        :param downloaded: 加密的源文件 -> 下载目录中的解锁结果
+        """
+        if self._journal is not None and downloaded:
+            self._journal.downloaded(downloaded)
+
+    def discard(self, sources: Iterable[pathlib.Path]):
+        """放弃未能发布、且结果已由调用方删除的文件，删除其日志记录"""
+        if self._journal is not None:
+            self._journal.done(sources)
+
+    def finalize(self, downloaded: dict[pathlib.Path, pathlib.Path]) -> tuple[set[str], set[pathlib.Path]]:
+        """发布一批解锁结果
+
+        :param downloaded: 加密的源文件 -> 下载目录中的解锁结果
+        :return: 发布后的文件名，以及未能发布的源文件（其解锁结果留在下载目录中）
+        """
+        published, failed = self.finalize_paths(downloaded)
+        return {p.name for p in published.values()}, failed
+
+    def finalize_paths(self, downloaded: dict[pathlib.Path, pathlib.Path],
+                       names: Optional[dict[pathlib.Path, str]] = None
+                       ) -> tuple[dict[pathlib.Path, pathlib.Path], set[pathlib.Path]]:
+        """发布一批解锁结果
+
+        :param downloaded: 加密的源文件 -> 解锁结果
+        :param names: 加密的源文件 -> 发布的文件名（应用重命名规则之前），默认与解锁结果同名
+        :return: 加密的源文件 -> 发布后的路径，以及未能发布的源文件（其解锁结果保持原样）
+        """
+        with metrics.span('finalize'):
+            return self._finalize(downloaded, names or {})
+
+    def _finalize(self, downloaded: dict[pathlib.Path, pathlib.Path],
+                  names: dict[pathlib.Path, str]
+                  ) -> tuple[dict[pathlib.Path, pathlib.Path], set[pathlib.Path]]:
+        failed = set()
+        targets = {}  # 源文件 -> 发布路径
+        for source, result in downloaded.items():
+            dst = self._destination(source, names.get(source, result.name), result)
+            try:
+                if dst in targets.values():
+                    raise FileExistsError(errno.EEXIST, 'Destination path is used by another file', str(dst))
+                if os.path.lexists(dst):
+                    raise FileExistsError(errno.EEXIST, 'Destination path already exists', str(dst))
+            except OSError as e:
+                logging.warning(f'整理"{result.name}"失败：{e}')
+                failed.add(source)
+                continue
+            targets[source] = dst
+
+        # 移入临时文件之前记录发布路径，中途退出时recover()可据此找到临时文件
+        if self._journal is not None and targets:
+            self._journal.publishing(targets)
+
+        staged = []  # (源文件, 下载结果, 发布路径, 临时文件, 临时文件的描述符, 是否复制)
+        restored = []  # 未能发布、结果已放回下载目录的源文件
+        try:
+            for source, dst in targets.items():
+                result = downloaded[source]
+                try:
+                    staged.append((source, result, dst) + self._stage(result, dst))
+                except OSError as e:
+                    logging.warning(f'整理"{result.name}"失败：{e}')
+                    failed.add(source)
+                    if os.path.lexists(result):
+                        restored.append(source)
+
+            if self._fsync:  # 全部复制完成后统一落盘，减少等待
+                for *_, fd, _ in staged:
+                    os.fsync(fd)
+        except BaseException:
+            for source, result, _, tmp, _, copied in staged:
+                if self._unstage(result, tmp, copied):
+                    restored.append(source)
+            if self._journal is not None:
+                self._journal.reset(restored)
+            raise
+        finally:
+            for *_, fd, _ in staged:
+                os.close(fd)
+
+        published = {}
+        for source, result, dst, tmp, _, copied in staged:
+            try:
+                os.rename(tmp, dst)
+            except OSError as e:
+                logging.warning(f'发布"{dst.name}"失败：{e}')
+                failed.add(source)
+                if self._unstage(result, tmp, copied):
+                    restored.append(source)
+                # 否则保留发布中的日志记录，由下一次运行的recover()完成发布
+                continue
+
+            if copied and not self._keep_results:
+                result.unlink(missing_ok=True)
+            if self._remove_sources:
+                source.unlink(missing_ok=True)
+            published[source] = dst
+            metrics.observe_file('finalize', dst)
+
+        if self._fsync:
+            self._fsync_dirs({dst.parent for dst in published.values()})
+        if self._journal is not None:
+            self._journal.reset(restored)
+            self._journal.done(published)
+        return published, failed
+
+    def publish_stream(self, source: pathlib.Path, name: str, chunks: Iterable[bytes]) -> pathlib.Path:
+        """将逐块收到的解锁结果直接写入目标目录中的临时文件并发布，不经过下载目录
+
+        :param source: 加密的源文件
+        :param name: 发布的文件名（应用重命名规则之前）
+        :param chunks: 解锁结果的各块数据
+        :return: 发布后的路径
+        :raise OSError: 写入或发布失败时，临时文件已删除；读取chunks时的异常同样删除临时文件后原样抛出
+        """
+        with metrics.span('finalize'):
+            # 模板用到标签时，须先写完临时文件才能从中读取标签、确定发布路径
+            dst = None if self._renamer is not None and self._renamer.needs_tags else self._destination(source, name)
+            if dst is not None and os.path.lexists(dst):
+                raise FileExistsError(errno.EEXIST, 'Destination path already exists', str(dst))
+            if dst is None:
+                tmp = output_dir(self.music_dir, source) / _TMP_FORMAT.format(name)
+            else:
+                tmp = dst.parent / _TMP_FORMAT.format(dst.name)
+
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                with open(fd, 'wb', closefd=False) as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+                self._set_attrs(fd, None)
+                if self._fsync:
+                    os.fsync(fd)
+            except BaseException:
+                tmp.unlink(missing_ok=True)
+                raise
+            finally:
+                os.close(fd)
+
+            if dst is None:
+                dst = self._destination(source, name, tmp)
+                try:
+                    if os.path.lexists(dst):
+                        raise FileExistsError(errno.EEXIST, 'Destination path already exists', str(dst))
+                    make_dirs(dst.parent, self._file_owner)
+                except OSError:
+                    tmp.unlink(missing_ok=True)
+                    raise
+
+            if self._journal is not None:
+                self._journal.staged(source, tmp, dst)
+            try:
+                os.rename(tmp, dst)
+            except OSError:
+                tmp.unlink(missing_ok=True)
+                if self._journal is not None:
+                    self._journal.done([source])
+                raise
+
+            if self._remove_sources:
+                source.unlink(missing_ok=True)
+            if self._fsync:
+                self._fsync_dirs([dst.parent])
+            if self._journal is not None:
+                self._journal.done([source])
+            metrics.observe_file('finalize', dst)
+            return dst
+
+    def recover(self) -> tuple[dict[pathlib.Path, pathlib.Path], set[pathlib.Path]]:
+        """完成日志中上次运行已下载、尚未发布完成的结果，只处理音乐目录（含子目录）中的源文件
+
+        已移入临时文件的直接发布，仍在下载目录中的重新发布（删除可能未复制完的临时文件）；
+        源文件已变化或不存在时放弃其结果。
+
+        :return: 加密的源文件 -> 发布后的路径，以及仍未能发布的源文件（记录保留至下一次）
+        """
+        if self._journal is None:
+            return {}, set()
+
+        published = {}
+        pending = {}  # 须重新发布的源文件 -> 下载目录中的结果
+        finished = []  # 已无需处理的记录
+        for entry in self._journal.entries():
+            source = entry.source
+            if not source.is_relative_to(self.music_dir):
+                continue
+
+            if entry.state == UnlockJournal.PUBLISHING:
+                dst = entry.destination
+                tmp = dst.parent / _TMP_FORMAT.format(dst.name)
+                try:
+                    if os.path.lexists(tmp):
+                        if entry.result != tmp and os.path.lexists(entry.result):
+                            tmp.unlink()  # 结果仍在下载目录中，临时文件可能是未复制完的副本，从结果重新发布
+                        elif os.path.lexists(dst):
+                            raise FileExistsError(errno.EEXIST, 'Destination path already exists', str(dst))
+                        else:
+                            os.rename(tmp, dst)
+                    is_published = os.path.lexists(dst)
+                except OSError as e:
+                    logging.warning(f'恢复发布"{dst.name}"失败：{e}')
+                    continue
+                if is_published:
+                    entry.result.unlink(missing_ok=True)  # 复制发布时下载目录中还有一份
+                    if self._remove_sources:
+                        source.unlink(missing_ok=True)
+                    published[source] = dst
+                    finished.append(source)
+                    continue
+
+            if entry.result.exists() and entry.source_unchanged():
+                pending[source] = entry.result
+            else:
+                entry.result.unlink(missing_ok=True)
+                finished.append(source)
+
+        if self._fsync:
+            self._fsync_dirs({dst.parent for dst in published.values()})
+        self._journal.done(finished)
+
+        failed = set()
+        if pending:
+            republished, failed = self.finalize_paths(pending)
+            published.update(republished)
+        return published, failed
+
+    @staticmethod
+    def _fsync_dirs(directories: Iterable[pathlib.Path]):
+        for directory in directories:
+            dir_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def _destination(self, source: pathlib.Path, name: str, result: Optional[pathlib.Path] = None) -> pathlib.Path:
+        """在音乐目录中的发布路径
+
+        :param result: 解锁结果，重命名模板用到标签时从中读取
+        """
+        directory = output_dir(self.music_dir, source)
+        if self._renamer is None:
+            return directory / name
+        tags = self._renamer.tags_of(result) if result is not None else None
+        return self._renamer.place(directory, self._renamer.new_name(name, tags))
+
+    def _stage(self, result: pathlib.Path, dst: pathlib.Path) -> tuple[pathlib.Path, int, bool]:
+        """将下载结果移入目标目录中的临时文件，并设置所有者与权限
+
+        :param dst: 发布路径
+        :return: 临时文件、其打开的描述符，以及是否经过复制
+        :raise FileExistsError: 目标目录中已有同名文件时
+        """
+        if os.path.lexists(dst):
+            raise FileExistsError(errno.EEXIST, 'Destination path already exists', str(dst))
+        make_dirs(dst.parent, self._file_owner)
+        tmp = dst.parent / _TMP_FORMAT.format(dst.name)
+
+        src_fd = os.open(result, os.O_RDONLY)
+        if not self._keep_results:
+            try:
+                os.rename(result, tmp)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    os.close(src_fd)
+                    raise
+            else:
+                try:
+                    self._set_attrs(src_fd, None)
+                except BaseException:
+                    os.close(src_fd)
+                    self._unstage(result, tmp, False)
+                    raise
+                return tmp, src_fd, False
+
+        # 跨文件系统或须保留结果，复制到临时文件
+        try:
+            tmp_fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                copy_fd(src_fd, tmp_fd)
+                self._set_attrs(tmp_fd, os.fstat(src_fd).st_mode)
+            except BaseException:
+                os.close(tmp_fd)
+                tmp.unlink(missing_ok=True)
+                raise
+        finally:
+            os.close(src_fd)
+        return tmp, tmp_fd, True
+
+    @staticmethod
+    def _unstage(result: pathlib.Path, tmp: pathlib.Path, copied: bool) -> bool:
+        """撤销_stage()：删除复制得到的临时文件，或将移入的结果放回下载目录（临时文件是唯一的一份）
+
+        :return: 是否成功，失败时只记录日志
+        """
+        try:
+            if copied:
+                tmp.unlink(missing_ok=True)
+            else:
+                os.rename(tmp, result)
+        except OSError as e:
+            logging.warning(f'撤销临时文件"{tmp}"失败：{e}')
+            return False
+        return True
+
+    def _set_attrs(self, fd: int, src_mode: Optional[int]):
+        """在描述符上设置所有者与权限
+
+        :param src_mode: 复制时为源文件的权限，用于保持原有权限
+        """
+        if self._file_owner is not None:
+            os.fchown(fd, *self._file_owner)
+        if self._file_mode is not None:
+            os.fchmod(fd, self._file_mode)
+        elif src_mode is not None:
+            os.fchmod(fd, src_mode & 0o7777)
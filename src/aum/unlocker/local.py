@@ -0,0 +1,87 @@
+import logging
+import pathlib
+import time
+from typing import Iterable, Optional
+
+from aum.decrypt import DECODERS, decode_to_temp
+from aum.exceptions import DecryptError
+from aum.metrics import metrics
+from .base import BaseUnlocker
+from .finalize import Finalizer, output_dir
+
+
+class LocalDecryptUnlocker(BaseUnlocker):
+    """
+    在本进程内直接解密的unlocker，无需浏览器
+
+    解密结果先写入目标目录中的临时文件，再与浏览器的解锁结果一样交由Finalizer发布：设置所有者、写入磁盘、
+    按重命名规则命名并记入预写日志。每个文件解密完成后立即发布，使额外占用的磁盘空间不超过一个文件。
+    """
+
+    _finalizer: Finalizer
+    _chunk_size: int
+
+    def __init__(self, finalizer: Finalizer, chunk_size: int = 1 << 20):
+        """
+        :param finalizer: 发布解密结果的Finalizer，其音乐目录的子目录中的文件解锁到所在的子目录
+        :param chunk_size: 每次解密的字节数
+        """
+        self._finalizer = finalizer
+        self._chunk_size = chunk_size
+        self.failed_files = set()
+        self.failure_reasons = {}
+        self.unlocked_files = {}
+
+    def supports(self, path: pathlib.Path, scheme: Optional[str] = None) -> bool:
+        """
+        :param path: 加密的文件
+        :param scheme: 预检识别出的加密方式，为None时只按后缀判断
+        """
+        decoder_cls = DECODERS.get(path.suffix.lower())
+        return decoder_cls is not None and (scheme is None or decoder_cls.scheme == scheme)
+
+    def unlock_files(self, files: Iterable[pathlib.Path]) -> set[str]:
+        """
+        :param files: 待解锁的文件路径迭代器
+        :return: 解锁后的音频文件名组成的set
+        """
+        with metrics.span('local'):
+            return self._unlock_files(files)
+
+    def _unlock_files(self, files: Iterable[pathlib.Path]) -> set[str]:
+        self.failed_files = set()
+        self.failure_reasons = {}
+        self.unlocked_files = {}
+
+        for p in files:
+            decoder_cls = DECODERS.get(p.suffix.lower())
+            if decoder_cls is None:
+                self._fail(p, 'unsupported format')
+                continue
+
+            start = time.perf_counter()
+            try:
+                size = p.stat().st_size
+                tmp, suffix = decode_to_temp(decoder_cls, p, output_dir(self._finalizer.music_dir, p),
+                                             self._chunk_size)
+            except (DecryptError, OSError) as e:
+                logging.warning(f'本地解密"{p.name}"失败：{e}')
+                self._fail(p, str(e))
+                continue
+            metrics.observe_file('local', p, time.perf_counter() - start, size)
+
+            self._finalizer.log_downloaded({p: tmp})
+            published, failed = self._finalizer.finalize_paths({p: tmp}, {p: p.stem + suffix})
+            if p in failed:
+                tmp.unlink(missing_ok=True)
+                self._finalizer.discard([p])
+                self._fail(p, 'publish failed')
+                continue
+            logging.info(f'本地解密完成：{p.name} -> {published[p].name}')
+            self.unlocked_files[p] = published[p]
+
+        return {p.name for p in self.unlocked_files.values()}
+
+    def _fail(self, path: pathlib.Path, reason: str):
+        self.failed_files.add(path)
+        self.failure_reasons[path] = reason
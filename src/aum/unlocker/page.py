@@ -0,0 +1,60 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from aum.driver import PageState
+
+
+@dataclass(frozen=True)
+class ReloadPolicy:
+    """
+    何时重新加载Unlock Music页面
+
+    批次之间默认在页面内清空文件列表并释放解锁结果占用的内存，重新加载页面（及其脚本与WASM解码器）
+    只在同一次加载已处理了足够多的批次或数据、或页面内存过高时进行，以限制浏览器内存的增长。
+    页面内清空失败时总是重新加载。
+    """
+    max_batches: int = 1  # 同一次加载最多处理的批数，1表示每批都重新加载，0表示不限
+    max_bytes: int = 0  # 同一次加载最多处理的字节数（浏览器报告JS堆大小时，也作为堆大小的上限），0表示不限
+
+    def should_reload(self, page: PageState, url: str) -> bool:
+        """在开始下一批之前，判断是否需要重新加载页面
+
+        :param page: 会话中页面的状态
+        :param url: 音乐解锁服务的url
+        """
+        if page.url != url:  # 尚未加载，或上一批没有正常清空
+            return True
+        if self.max_batches and page.batches >= self.max_batches:
+            return True
+        if self.max_bytes and (page.bytes >= self.max_bytes or (page.heap_bytes or 0) >= self.max_bytes):
+            return True
+        return False
+
+
+@dataclass(frozen=True)
+class UnlockDeadline:
+    """
+    每批在浏览器中解锁与下载的时限
+
+    超时后不再等待，已解锁的文件照常下载，其余文件视为可疑：同一批中有多个时分为两批重试，
+    只剩一个时即认定为导致超时的文件，将其隔离（记为解锁失败）。
+    """
+    batch_seconds: float = 0  # 每批从上传到下载完成的时限，0表示不限
+    file_seconds: float = 0  # 等待下一个文件解锁或下载完成的最长时间，0表示不限
+
+    def batch_end(self, started: float) -> Optional[float]:
+        """该批的截止时刻（time.monotonic()），不限时返回None
+
+        :param started: 该批开始上传的时刻
+        """
+        return started + self.batch_seconds if self.batch_seconds else None
+
+    def next_end(self, started: float, last_progress: float) -> Optional[float]:
+        """等待下一个文件的截止时刻，取批次时限与单个文件时限中较早者，均不限时返回None
+
+        :param started: 该批开始上传的时刻
+        :param last_progress: 上一个文件完成的时刻
+        """
+        ends = [t for t in (self.batch_end(started), last_progress + self.file_seconds if self.file_seconds else None)
+                if t is not None]
+        return min(ends) if ends else None
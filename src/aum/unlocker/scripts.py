@@ -0,0 +1,184 @@
+"""
+在Unlock Music页面中执行的脚本
+"""
+
+# 错误通知会在数秒后自动消失，因此由collectErrors()累计记录在window.__aumErrors中
+_COLLECT_ERRORS = '''
+window.__aumErrors = window.__aumErrors || [];
+window.__aumSeenErrors = window.__aumSeenErrors || new WeakSet();
+
+function collectErrors() {
+    for (const n of document.querySelectorAll('.el-notification')) {
+        if (!n.querySelector('.el-icon-error') || window.__aumSeenErrors.has(n)) continue;
+        window.__aumSeenErrors.add(n);
+        window.__aumErrors.push(n.innerText.trim());
+    }
+}
+'''
+
+# 定位应用的文件列表：从预览表格的Vue实例向上查找以其数据数组为data的组件，找不到时返回null
+_FIND_FILES = '''
+function findFiles() {
+    const table = document.querySelector('.el-table');
+    if (!table || !table.__vue__ || !Array.isArray(table.__vue__.data)) return null;
+    const rows = table.__vue__.data;
+    for (let vm = table.__vue__.$parent; vm; vm = vm.$parent) {
+        if (Object.values(vm.$data || {}).includes(rows)) return rows;
+    }
+    return null;
+}
+'''
+
+# 等待解锁预览表格达到指定状态，一次调用即返回表格中每一行的状态。
+# 参数：mode（"unlocked"：已解锁行数达到expected，或出现新的错误；"empty"：表格为空）、expected、超时毫秒数。
+WAIT_TABLE_SCRIPT = '''
+const [mode, expected, timeoutMs] = arguments;
+const done = arguments[arguments.length - 1];
+
+''' + _COLLECT_ERRORS + '''const errorsBefore = window.__aumErrors.length;
+
+function snapshot(timedOut) {
+    const table = document.querySelector('table.el-table__body');
+    const rows = table ? Array.from(table.querySelectorAll('tr.el-table__row')) : [];
+    return {
+        rows: rows.map(r => ({
+            title: (r.querySelector('td:nth-child(2)') || r).innerText.trim(),
+            unlocked: r.querySelector('.el-icon-download') !== null,
+        })),
+        errors: window.__aumErrors.slice(),
+        timedOut: timedOut,
+    };
+}
+
+function satisfied(s) {
+    if (mode === 'empty') return s.rows.length === 0;
+    return s.rows.filter(r => r.unlocked).length >= expected || s.errors.length > errorsBefore;
+}
+
+let finished = false;
+let observer = null;
+let timer = null;
+function finish(timedOut) {
+    if (finished) return;
+    finished = true;
+    if (observer !== null) observer.disconnect();
+    clearTimeout(timer);
+    done(snapshot(timedOut));
+}
+
+function check() {
+    collectErrors();
+    if (satisfied(snapshot(false))) finish(false);
+}
+
+observer = new MutationObserver(check);
+observer.observe(document.body, {childList: true, subtree: true});
+timer = setTimeout(() => finish(true), timeoutMs);
+check();
+'''
+
+# 清空已记录的错误
+RESET_ERRORS_SCRIPT = 'window.__aumErrors = [];'
+
+# 在页面内清空应用的文件列表，代替重新加载页面。
+# 撤销列表项与页面元素引用的blob URL后原地清空文件列表；同时清空已记录的错误与待取回的解锁结果。
+# 返回{ok：是否找到并清空了文件列表, revoked：撤销的blob URL数, heapBytes：JS堆大小（浏览器不支持performance.memory时为null）}。
+RESET_PAGE_SCRIPT = '''
+const revoked = new Set();
+function revoke(value) {
+    if (typeof value === 'string' && value.startsWith('blob:') && !revoked.has(value)) {
+        URL.revokeObjectURL(value);
+        revoked.add(value);
+    }
+}
+
+''' + _FIND_FILES + '''
+const files = findFiles();
+if (files !== null) {
+    for (const item of files) Object.values(item).forEach(revoke);
+    files.splice(0);  // 原地清空，保持响应式
+}
+
+for (const el of document.querySelectorAll('[src^="blob:"], [href^="blob:"]')) {
+    const attr = el.hasAttribute('src') ? 'src' : 'href';
+    revoke(el.getAttribute(attr));
+    el.removeAttribute(attr);
+}
+
+window.__aumErrors = [];
+window.__aumResults = {};
+return {
+    ok: files !== null,
+    revoked: revoked.size,
+    heapBytes: performance.memory ? performance.memory.usedJSHeapSize : null,
+};
+'''
+
+# 等待应用的文件列表中出现尚未取回的解锁结果，登记其Blob以便分块读取。
+# 参数：超时毫秒数。有新结果、出现新的错误或超时即返回{ok：是否找到文件列表, result：{id, name：源文件名（不含后缀）,
+# title, ext：解锁后的后缀（不含"."）, size：字节数}或null, errors：累计的错误, timedOut}。
+NEXT_RESULT_SCRIPT = '''
+const [timeoutMs] = arguments;
+const done = arguments[arguments.length - 1];
+
+''' + _COLLECT_ERRORS + _FIND_FILES + '''const errorsBefore = window.__aumErrors.length;
+window.__aumResults = window.__aumResults || {};
+window.__aumTaken = window.__aumTaken || new WeakSet();
+window.__aumNextId = window.__aumNextId || 0;
+
+let finished = false;
+let taking = false;  // 正在读取Blob，其间不再取用其他结果，也不因超时放弃该结果
+let observer = null;
+let timer = null;
+function finish(ok, result, timedOut) {
+    if (finished) return;
+    finished = true;
+    if (observer !== null) observer.disconnect();
+    clearTimeout(timer);
+    done({ok: ok, result: result, errors: window.__aumErrors.slice(), timedOut: timedOut});
+}
+
+function take(item) {
+    taking = true;
+    window.__aumTaken.add(item);
+    const id = String(++window.__aumNextId);
+    const blob = item.blob instanceof Blob ? Promise.resolve(item.blob) : fetch(item.file).then(r => r.blob());
+    blob.then(b => {
+        window.__aumResults[id] = b;
+        finish(true, {id: id, name: item.rawFilename, title: item.title, ext: item.ext || '', size: b.size}, false);
+    }, () => finish(true, null, false));
+}
+
+function check() {
+    if (finished || taking) return;
+    collectErrors();
+    const files = findFiles();
+    if (files === null) return finish(false, null, false);
+    const item = files.find(i => !window.__aumTaken.has(i) && (i.blob instanceof Blob || typeof i.file === 'string'));
+    if (item !== undefined) return take(item);
+    if (window.__aumErrors.length > errorsBefore) finish(true, null, false);
+}
+
+observer = new MutationObserver(check);
+observer.observe(document.body, {childList: true, subtree: true});
+timer = setTimeout(() => taking || finish(true, null, true), timeoutMs);
+check();
+'''
+
+# 以Base64读取已登记的解锁结果的一段。参数：结果的id、偏移、最大长度。结果已释放时返回null。
+READ_RESULT_SCRIPT = '''
+const [id, offset, length] = arguments;
+const done = arguments[arguments.length - 1];
+const blob = (window.__aumResults || {})[id];
+if (blob === undefined) {
+    done(null);
+} else {
+    const reader = new FileReader();
+    reader.onload = () => done(reader.result.slice(reader.result.indexOf(',') + 1));
+    reader.onerror = () => done(null);
+    reader.readAsDataURL(blob.slice(offset, offset + length));
+}
+'''
+
+# 释放已取回的解锁结果。参数：结果的id。
+RELEASE_RESULT_SCRIPT = 'delete (window.__aumResults || {})[arguments[0]];'
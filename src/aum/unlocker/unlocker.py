@@ -1,19 +1,61 @@
+import base64
 import logging
 import pathlib
-import shutil
+import threading
 import time
-from typing import Iterable, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
 
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.file_detector import LocalFileDetector
 from selenium.webdriver.remote.webdriver import WebDriver
-from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.support import expected_conditions as expected_cond
 from selenium.webdriver.support.wait import WebDriverWait
 
+from aum.batcher import Batcher, BatchBudget
 from aum.driver import SeleniumDriver
 from aum.exceptions import PatchSizeError
-from aum.helpers import iter_with_patch
-from aum.helpers.dir_filter import filter_dir_by_stems, filter_dir_by_suffixes
+from aum.hub import SeleniumHub
+from aum.metrics import metrics
+from aum.pool import DriverPool
+from .base import BaseUnlocker
+from .download import DownloadMatcher, DownloadWatcher
+from .finalize import Finalizer
+from .page import ReloadPolicy, UnlockDeadline
+from .scripts import (NEXT_RESULT_SCRIPT, READ_RESULT_SCRIPT, RELEASE_RESULT_SCRIPT, RESET_ERRORS_SCRIPT,
+                      RESET_PAGE_SCRIPT, WAIT_TABLE_SCRIPT)
+
+_FinalizeFuture = Future[tuple[dict[pathlib.Path, pathlib.Path], set[pathlib.Path]]]  # 整理结果：源文件 -> 发布后的路径，以及未能发布的源文件
+
+# 未能解锁的原因，页面报告了错误时为其错误信息
+REASON_FAILED = 'unlock failed'
+REASON_TIMED_OUT = 'timed out'
+REASON_PUBLISH_FAILED = 'publish failed'
+REASON_UNKNOWN_FORMAT = 'unknown output format'
+
+RESULT_CHUNK_BYTES = 2 << 20  # 由页面脚本取回解锁结果时每次读取的字节数（Base64编码前）
+
+
+def _isolate(batcher: Batcher, batch: list[pathlib.Path], suspects: set[pathlib.Path],
+             failure_reasons: dict[pathlib.Path, str]) -> dict[pathlib.Path, str]:
+    """处理一批中原因不明的失败（超时或浏览器出错）
+
+    可疑的文件有多个时分为两批重新解锁，以免一个问题文件连累同批的其余文件；只剩一个时即认定其为问题文件，记为失败。
+
+    :param batch: 该批的文件
+    :param suspects: 原因不明、未能完成的文件
+    :param failure_reasons: 该批未能解锁的文件 -> 原因
+    :return: 确定未能解锁的文件 -> 原因，重新分批的文件不包括在内
+    """
+    retry = [p for p in batch if p in suspects]
+    if len(retry) > 1 and batcher.split(retry):
+        logging.warning(f'{len(retry)}首音乐未能完成，将分为两批重试以找出问题文件。')
+        return {p: reason for p, reason in failure_reasons.items() if p not in suspects}
+
+    for p in retry:
+        logging.warning(f'已隔离问题文件"{p.name}"：{failure_reasons[p]}')
+    return failure_reasons
 
 
 class UnlockMusicBroker:
@@ -22,31 +64,52 @@ class UnlockMusicBroker:
     """
 
     driver: WebDriver
+    hub: SeleniumHub
     wait: WebDriverWait
     download_dir: pathlib.Path  # 浏览器下载路径
     unlocked_suffixes: set[str]  # 已解锁的音频文件后缀
 
-    locking_files: set[pathlib.Path] = set()
+    locking_files: set[pathlib.Path]  # 已上传、正在解锁的文件
+    unlocked_files: dict[pathlib.Path, pathlib.Path]  # 源文件 -> 下载目录中的解锁结果
+    unlocked_cnt: int  # 页面中解锁成功的文件数
+    unlock_errors: list[str]  # 页面报告的解锁错误
+    failure_reasons: dict[pathlib.Path, str]  # 页面报告了错误的文件 -> 错误信息
+    timed_out: bool  # 等待解锁或下载是否超时
+    heap_bytes: Optional[int]  # 清空后页面报告的JS堆大小，浏览器不支持时为None
 
-    __table_ele: Optional[WebElement] = None  # 页面下部的解锁预览表格的缓存
+    _deadline: UnlockDeadline
+    _started: float  # 开始上传的时刻
+    _last_progress: float  # 上一个文件解锁（或失败）的时刻
 
     def __init__(self, sel_driver: SeleniumDriver,
                  files: Iterable[pathlib.Path],
                  unlocked_suffixes: set[str],
-                 wait_time: int = 10
+                 wait_time: int = 10,
+                 deadline: Optional[UnlockDeadline] = None
                  ):
         """
         :param sel_driver: 已打开Unlock Music服务的SeleniumDriver
         :param files: 待解锁的文件路径迭代器
         :param unlocked_suffixes: 解锁的音频文件后缀组成的set
         :param wait_time: 寻找浏览器元素的超时时间
+        :param deadline: 解锁与下载的时限，默认不限
         """
         self.driver = sel_driver.driver
+        self.hub = sel_driver.hub
         self.wait = WebDriverWait(sel_driver.driver, timeout=wait_time)
 
         self.files = files
         self.download_dir = sel_driver.download_dir
         self.unlocked_suffixes = unlocked_suffixes.copy()
+        self.locking_files = set()  # 每个broker独立维护，避免多个会话间互相干扰
+        self.unlocked_files = {}
+        self.unlocked_cnt = 0
+        self.unlock_errors = []
+        self.failure_reasons = {}
+        self.timed_out = False
+        self.heap_bytes = None
+        self._deadline = deadline if deadline is not None else UnlockDeadline()
+        self._started = self._last_progress = time.monotonic()
 
     def set_same_filename_mode(self):
         """设置歌曲命名格式与源文件相同"""
@@ -63,139 +126,393 @@ class UnlockMusicBroker:
         input_field = self.wait.until(
             expected_cond.presence_of_element_located((By.CLASS_NAME, 'el-upload__input'))
         )
-        filepath_str = (str(i) for i in file_set)  # 文件路径转字符串
-        input_field.send_keys('\n'.join(filepath_str))
+        # 共享音乐目录中的文件以浏览器容器内的路径上传，由浏览器直接读取；其余文件经由WebDriver传输
+        remote_paths = []
+        local_paths = []
+        for p in file_set:
+            remote_path = self.hub.remote_path(p)
+            if remote_path is not None:
+                remote_paths.append(str(remote_path))
+            else:
+                local_paths.append(str(p))
+
+        if remote_paths:
+            input_field.send_keys('\n'.join(remote_paths))
+        if local_paths:
+            if self.hub.shares_music_dir:
+                with self.driver.file_detector_context(LocalFileDetector):
+                    input_field.send_keys('\n'.join(local_paths))
+            else:
+                input_field.send_keys('\n'.join(local_paths))
         logging.info('正在上传...')
 
         self.locking_files |= {i for i in file_set}
+        self._started = self._last_progress = time.monotonic()
 
-    def wait_until_unlocked(self, poll_interval: int = 1):
-        """等待所有上传的文件解锁完成
+    def wait_until_unlocked(self, slice_time: int = 20):
+        """等待所有上传的文件解锁完成（或解锁失败），超过时限时停止等待并设置timed_out
 
-        :param poll_interval: 检查解锁完成的频率，单位秒
+        :param slice_time: 单次页面内等待的最长时间，单位秒，超时后重新发起等待
         """
         expected_cnt = len(self.locking_files)
-
-        finished_cnt = self._count_unlocked()
-        while finished_cnt < expected_cnt:
-            time.sleep(poll_interval)
-            finished_cnt = self._count_unlocked()
+        unlocked_cnt = 0
+
+        while True:
+            end = self._deadline.next_end(self._started, self._last_progress)
+            wait_time = slice_time if end is None else min(slice_time, end - time.monotonic())
+            if wait_time <= 0:
+                self.timed_out = True
+                logging.warning(f'等待解锁超时，已解锁{unlocked_cnt}/{expected_cnt}首。')
+                break
+
+            # 解锁失败的文件不会出现在表格中，已报告的错误须从期望行数中扣除，否则只能等到超时
+            status = self._wait_table('unlocked', expected_cnt - len(self.unlock_errors), wait_time)
+            done_before = unlocked_cnt + len(self.unlock_errors)
+            unlocked_cnt = sum(1 for row in status['rows'] if row['unlocked'])
+            self.unlock_errors = status['errors']
+
+            if unlocked_cnt + len(self.unlock_errors) >= expected_cnt:
+                break
+            if unlocked_cnt + len(self.unlock_errors) > done_before:
+                self._last_progress = time.monotonic()
+            logging.info(f'已解锁{unlocked_cnt}/{expected_cnt}首...')
+
+        for message in self.unlock_errors:
+            logging.warning(f'解锁失败：{message}')
+        self._attribute_errors()
+        self.unlocked_cnt = unlocked_cnt
         logging.info('上传完成。')
 
-    def save_all(self, poll_interval: int = 1) -> set[str]:
+    def _attribute_errors(self):
+        """根据错误信息中的文件名，确定页面报告了错误的文件"""
+        files = sorted(self.locking_files, key=lambda p: len(p.name), reverse=True)  # 先匹配长文件名，以免被其子串误配
+        for message in self.unlock_errors:
+            source = next((p for p in files if p.name in message), None)
+            if source is not None:
+                self.failure_reasons.setdefault(source, message)
+
+    def save_all(self) -> set[str]:
         """保存全部解锁文件至浏览器下载目录
 
-        :param poll_interval: 检查下载完成的频率，单位秒
-        :return: 解锁后的音频文件名组成的list
+        :return: 解锁后的音频文件名组成的set
         """
-        # 开始下载
-        download_all_btn = self.wait.until(
-            expected_cond.presence_of_element_located((By.XPATH, '//span[text()="下载全部"]'))
-        )
-        download_all_btn.click()
-        logging.info('开始下载...')
-
-        # 生成并返回所有的文件名stem
-        downloading_stems = {i.stem for i in self.files}
-
-        # 等待下载完成后返回
-        unlocked_files = set()
-        while len(downloading_stems) > 0:  # 当下载未完成全部时
-            valid_stem_file_filter = filter_dir_by_stems(self.download_dir.iterdir(), downloading_stems)
-            valid_file_filter = filter_dir_by_suffixes(valid_stem_file_filter, self.unlocked_suffixes)
-
-            for new_unlocked_file in valid_file_filter:  # 如果本次解锁的文件出现
-                unlocked_files.add(new_unlocked_file)
-                downloading_stems.remove(new_unlocked_file.stem)
-
-            file_left = len(downloading_stems)  # 剩余正在下载文件的总数
-            if file_left > 0:  # 未全部下载完，等待后再检查
+        matcher = DownloadMatcher(self.files, self.unlocked_suffixes)
+        self.unlocked_files = matcher.matched
+        if self.unlocked_cnt <= 0:  # 没有可下载的文件，不会有下载完成的事件
+            logging.info('没有需要下载的文件。')
+            return set()
+
+        with DownloadWatcher(self.download_dir) as watcher:  # 须在点击下载前开始监视
+            # 开始下载
+            download_all_btn = self.wait.until(
+                expected_cond.presence_of_element_located((By.XPATH, '//span[text()="下载全部"]'))
+            )
+            download_all_btn.click()
+            logging.info('开始下载...')
+
+            # 等待下载完成后返回
+            for new_file in watcher.completed_files(self._deadline.file_seconds or None,
+                                                    self._deadline.batch_end(self._started)):
+                if matcher.match(new_file) is None:  # 不属于本批的文件
+                    continue
+
+                file_left = self.unlocked_cnt - len(matcher.matched)  # 剩余正在下载文件的总数，解锁失败的文件不会被下载
+                if file_left <= 0:
+                    break
                 logging.info(f'剩余{file_left}首...')
-                time.sleep(poll_interval)
+            else:
+                self.timed_out = True
+                logging.warning(f'等待下载超时，{self.unlocked_cnt - len(matcher.matched)}首未能下载。')
+
         logging.info(f'下载完成。')
-        return {p.name for p in unlocked_files}
+        return {p.name for p in matcher.matched.values()}
 
-    def clear_all(self, poll_interval: int = 1):
+    def clear_all(self, slice_time: int = 20) -> bool:
         """清空页面中所有已解锁的文件
 
-        :param poll_interval: 检查清理完成的频率，单位秒
+        优先通过页面脚本直接清空应用的文件列表并撤销解锁结果的blob URL，以便下一批复用页面；
+        脚本无法定位文件列表时退而点击“清除全部”按钮，但其占用的内存不会释放。
+
+        :param slice_time: 页面内等待表格清空的最长时间，单位秒
+        :return: 页面是否已清空并释放了内存，为False时应在下一批之前重新加载页面
         """
-        clear_all_btn = self.wait.until(
-            expected_cond.presence_of_element_located((By.XPATH, '//span[text()="清除全部"]'))
-        )
-        clear_all_btn.click()
+        result = self.driver.execute_script(RESET_PAGE_SCRIPT) or {}
+        self.heap_bytes = result.get('heapBytes')
+        if result.get('ok'):
+            logging.debug(f'已在页面内清空文件列表，撤销{result.get("revoked", 0)}个blob URL。')
+        else:
+            logging.debug('无法在页面内清空文件列表，将点击“清除全部”。')
+            clear_all_btn = self.wait.until(
+                expected_cond.presence_of_element_located((By.XPATH, '//span[text()="清除全部"]'))
+            )
+            clear_all_btn.click()
 
         self.locking_files.clear()
 
-        while self._count_unlocked() > 0:  # 等待解锁文件数归零
-            time.sleep(poll_interval)
+        status = self._wait_table('empty', 0, slice_time)  # 等待解锁文件数归零
+        self.driver.execute_script(RESET_ERRORS_SCRIPT)
+        if status['timedOut']:
+            logging.warning(f'页面未能在{slice_time}秒内清空，将重新加载。')
+        return bool(result.get('ok')) and not status['timedOut']
 
-        self.__table_ele = None  # 清除缓存，以免其它模块改变页面后丢失元素
+    def _wait_table(self, mode: str, expected: int, slice_time: float) -> dict:
+        """在页面内监听解锁预览表格的变化，直到满足条件或超时
 
-    def _count_unlocked(self) -> int:
-        """计数网页中已解锁的文件格数
+        :param mode: "unlocked"表示等待已解锁行数达到expected或出现错误，"empty"表示等待表格清空
+        :param expected: 期望的已解锁行数
+        :param slice_time: 页面内等待的最长时间，单位秒
+        :return: 表格状态，包括各行的title与unlocked、累计的errors以及是否timedOut
+        """
+        self.driver.set_script_timeout(slice_time + 10)  # 留出余量，由页面脚本先行超时
+        return self.driver.execute_async_script(WAIT_TABLE_SCRIPT, mode, expected, slice_time * 1000)
+
+
+class ScriptUnlockBroker(UnlockMusicBroker):
+    """
+    由页面脚本取回解锁结果的代理人
+
+    上传后不点击任何按钮，而是在应用的文件列表中等待解锁结果，逐个以Base64分块读回其Blob并立即发布，
+    不经过浏览器下载目录，也无需按下载的文件名匹配源文件。先解锁的文件先发布，无需等待整批完成。
+    """
+
+    published: dict[pathlib.Path, pathlib.Path]  # 源文件 -> 发布后的路径
+    publish_failed: set[pathlib.Path]  # 解锁成功但未能发布的源文件
 
-        :return: 网页中目前已解锁的文件个数
+    def __init__(self, sel_driver: SeleniumDriver,
+                 files: Iterable[pathlib.Path],
+                 unlocked_suffixes: set[str],
+                 wait_time: int = 10,
+                 deadline: Optional[UnlockDeadline] = None
+                 ):
+        super().__init__(sel_driver, files, unlocked_suffixes, wait_time, deadline)
+        self.published = {}
+        self.publish_failed = set()
+
+    def receive_all(self, finalizer: Finalizer, slice_time: int = 20):
+        """逐个取回并发布解锁结果，直到所有上传的文件发布、解锁失败，或超过时限（此时设置timed_out）
+
+        :param finalizer: 发布解锁结果的Finalizer
+        :param slice_time: 单次页面内等待的最长时间，单位秒，超时后重新发起等待
+        :raise WebDriverException: 页面中找不到应用的文件列表，或解锁结果在读取中途失效时，
+                                   此前已发布的文件仍在published与publish_failed中
+        """
+        expected_cnt = len(self.locking_files)
+        pending = {p.stem: p for p in self.locking_files}  # 同一批中没有同名（不含后缀）的文件
+        received_cnt = 0
+
+        while received_cnt + len(self.unlock_errors) < expected_cnt:
+            end = self._deadline.next_end(self._started, self._last_progress)
+            wait_time = slice_time if end is None else min(slice_time, end - time.monotonic())
+            if wait_time <= 0:
+                self.timed_out = True
+                logging.warning(f'等待解锁超时，已取回{received_cnt}/{expected_cnt}首。')
+                break
+
+            self.driver.set_script_timeout(wait_time + 10)  # 留出余量，由页面脚本先行超时
+            status = self.driver.execute_async_script(NEXT_RESULT_SCRIPT, wait_time * 1000)
+            if not status['ok']:
+                raise WebDriverException('Cannot locate the file list of the unlock page')
+            if len(status['errors']) > len(self.unlock_errors):
+                self._last_progress = time.monotonic()
+                for message in status['errors'][len(self.unlock_errors):]:
+                    logging.warning(f'解锁失败：{message}')
+                self.unlock_errors = status['errors']
+                self._attribute_errors()
+
+            result = status['result']
+            if result is None:
+                continue
+            received_cnt += 1
+            self._last_progress = time.monotonic()
+            try:
+                self._publish(result, pending.pop(result['name'] or result['title'], None), finalizer)
+            finally:
+                self.driver.execute_script(RELEASE_RESULT_SCRIPT, result['id'])
+            logging.info(f'已取回{received_cnt}/{expected_cnt}首...')
+
+        self.unlocked_cnt = received_cnt
+        logging.info('取回完成。')
+
+    def _publish(self, result: dict, source: Optional[pathlib.Path], finalizer: Finalizer):
+        """发布一个取回的解锁结果
+
+        :param result: NEXT_RESULT_SCRIPT返回的result
+        :param source: 对应的源文件，无法确定时为None
         """
-        if self.__table_ele is None:
-            self.__table_ele = self.driver.find_element(By.CSS_SELECTOR, 'table.el-table__body')  # 选中页面下部的解锁预览表格
+        if source is None:
+            logging.warning(f'无法确定解锁结果"{result["title"]}"对应的文件，已跳过。')
+            return
+        if not result['ext']:
+            self.failure_reasons[source] = REASON_UNKNOWN_FORMAT
+            logging.warning(f'无法确定"{source.name}"解锁后的格式，已跳过。')
+            return
+
+        name = f'{source.stem}.{result["ext"]}'
+        try:
+            self.published[source] = finalizer.publish_stream(source, name, self._chunks(result))
+        except OSError as e:
+            logging.warning(f'整理"{name}"失败：{e}')
+            self.publish_failed.add(source)
+
+    def _chunks(self, result: dict) -> Iterator[bytes]:
+        """分块读取页面中的解锁结果
+
+        :raise WebDriverException: 结果已失效时
+        """
+        self.driver.set_script_timeout(60)
+        for offset in range(0, result['size'], RESULT_CHUNK_BYTES):
+            data = self.driver.execute_async_script(READ_RESULT_SCRIPT, result['id'], offset, RESULT_CHUNK_BYTES)
+            if data is None:
+                raise WebDriverException(f'Unlocked result {result["id"]} is no longer available')
+            yield base64.b64decode(data)
 
-        finished_cnt = len(self.__table_ele.find_elements(By.CLASS_NAME, 'el-icon-download'))  # 统计下载预览表格中下载按钮的个数
-        return finished_cnt
 
+class MusicUnlocker(BaseUnlocker):
+    """
+    通过浏览器操作Unlock Music服务解锁的unlocker
+    """
 
-class MusicUnlocker:
     _sel_driver: SeleniumDriver
 
     _service_url: str  # 音乐解锁服务的url
     _unlocked_suffixes: set[str]  # 解锁的音频文件后缀组成的set
     _music_dir: pathlib.Path
+    _reload_policy: ReloadPolicy
+    _deadline: Optional[UnlockDeadline]
+
+    timed_out_files: set[pathlib.Path]  # 上次调用时因超时而未能完成、原因不明的文件
+    published_files: dict[pathlib.Path, pathlib.Path]  # 上次调用unlock_by_script()时已发布的文件，浏览器中途出错时同样有效
+    publish_failed_files: set[pathlib.Path]  # 上次调用unlock_by_script()时解锁成功但未能发布的文件
 
     def __init__(self, sel_driver: SeleniumDriver,
                  unlock_music_url: str,
                  music_dir: pathlib.Path,
-                 unlocked_suffixes: set[str]
+                 unlocked_suffixes: set[str],
+                 reload_policy: Optional[ReloadPolicy] = None,
+                 deadline: Optional[UnlockDeadline] = None
                  ):
         """
         :param sel_driver: SeleniumDriver
         :param unlock_music_url: 音乐解锁服务的url
         :param music_dir: 音乐目录
         :param unlocked_suffixes: 解锁的音频文件后缀组成的set
+        :param reload_policy: 何时重新加载页面，默认每批都重新加载
+        :param deadline: 每批解锁与下载的时限，默认不限
         """
         self._sel_driver = sel_driver
         self._service_url = unlock_music_url
         self._music_dir = music_dir
         self._unlocked_suffixes = unlocked_suffixes.copy()
+        self._reload_policy = reload_policy if reload_policy is not None else ReloadPolicy()
+        self._deadline = deadline
+        self.failed_files = set()
+        self.failure_reasons = {}
+        self.unlocked_files = {}
+        self.timed_out_files = set()
+        self.published_files = {}
+        self.publish_failed_files = set()
 
     def unlock_files(self, files: Iterable[pathlib.Path]) -> set[str]:
         """
         :param files: 待解锁的文件路径迭代器
         :return: 解锁后的音频文件名组成的list
         """
-        # 页面上的“清除全部”按钮无法正确工作，因此每次重新加载一遍页面
-        self._sel_driver.driver.get(self._service_url)
-
-        # 通过broker操作浏览器解锁音频文件
-        broker = UnlockMusicBroker(self._sel_driver, files, unlocked_suffixes=self._unlocked_suffixes)
-        broker.set_same_filename_mode()
-        broker.upload()
-        broker.wait_until_unlocked()
-        downloaded_filename_set = broker.save_all()
-        broker.clear_all()
+        downloaded = self.unlock_in_browser(files)
 
         # 将解锁后的音乐从浏览器下载目录移动至音乐目录
         logging.debug('将解锁后的音乐从下载目录移动至音乐目录...')
-        self._move_down_to_music(downloaded_filename_set)
+        self.unlocked_files, failed = Finalizer(self._music_dir).finalize_paths(downloaded)
+        self.failed_files |= failed
+        self.failure_reasons.update(dict.fromkeys(failed, REASON_PUBLISH_FAILED))
         logging.debug('移动完成。')
-        return downloaded_filename_set
+        return {p.name for p in self.unlocked_files.values()}
+
+    def unlock_in_browser(self, files: Iterable[pathlib.Path]) -> dict[pathlib.Path, pathlib.Path]:
+        """在浏览器中解锁并下载，结果留在浏览器下载目录中
+
+        :param files: 待解锁的文件路径迭代器
+        :return: 源文件 -> 下载目录中的解锁结果
+        """
+        files = list(files)
+        reload = self._open_page()
 
-    def _move_down_to_music(self, filename_set: set[str]):
-        """将浏览器下载路径的音乐移动到
+        # 通过broker操作浏览器解锁音频文件
+        broker = UnlockMusicBroker(self._sel_driver, files, unlocked_suffixes=self._unlocked_suffixes,
+                                   deadline=self._deadline)
+        if reload:  # 命名格式在页面内保持
+            with metrics.span('browser.set_mode'):
+                broker.set_same_filename_mode()
+        with metrics.span('browser.upload'):
+            broker.upload()
+        with metrics.span('browser.wait'):
+            broker.wait_until_unlocked()
+        with metrics.span('browser.save'):
+            broker.save_all()
+        self._close_page(broker, files)
+        self._collect_failures(broker, files, broker.unlocked_files.keys())
+        return broker.unlocked_files
+
+    def unlock_by_script(self, files: Iterable[pathlib.Path],
+                         finalizer: Finalizer
+                         ) -> tuple[dict[pathlib.Path, pathlib.Path], set[pathlib.Path]]:
+        """在浏览器中解锁，由页面脚本逐个取回解锁结果并直接发布，不经过浏览器下载目录
 
-        :param filename_set: 下载文件名组成的集合
+        :param files: 待解锁的文件路径迭代器
+        :param finalizer: 发布解锁结果的Finalizer
+        :return: 源文件 -> 发布后的路径，以及解锁成功但未能发布的源文件
+        :raise WebDriverException: 浏览器出错时，此前已发布的文件仍记录在published_files与publish_failed_files中
+        """
+        files = list(files)
+        self.published_files = {}
+        self.publish_failed_files = set()
+        self._open_page()
+
+        broker = ScriptUnlockBroker(self._sel_driver, files, unlocked_suffixes=self._unlocked_suffixes,
+                                    deadline=self._deadline)
+        self.published_files = broker.published  # 随取回逐个更新
+        self.publish_failed_files = broker.publish_failed
+        with metrics.span('browser.upload'):
+            broker.upload()
+        with metrics.span('browser.receive'):
+            broker.receive_all(finalizer)
+        self._close_page(broker, files)
+        self._collect_failures(broker, files, broker.published.keys() | broker.publish_failed)
+        return broker.published, broker.publish_failed
+
+    def _open_page(self) -> bool:
+        """准备本批使用的页面：页面在批次间复用，达到上限或上一批未能清空时才重新加载
+
+        :return: 是否重新加载了页面
         """
-        for i in filename_set:
-            shutil.move(self._sel_driver.download_dir / i, self._music_dir)
+        page = self._sel_driver.page
+        reload = self._reload_policy.should_reload(page, self._service_url)
+        if reload:
+            with metrics.span('browser.page_load'):
+                self._sel_driver.driver.get(self._service_url)
+            page.loaded(self._service_url)
+        page.url = None  # 本批正常清空后才可复用
+        return reload
+
+    def _close_page(self, broker: UnlockMusicBroker, files: list[pathlib.Path]):
+        """本批结束后清空页面，并记录页面处理过的批数与数据量"""
+        page = self._sel_driver.page
+        if not broker.timed_out:  # 超时后页面可能仍在处理文件，不再清空，下一批重新加载
+            with metrics.span('browser.clear'):
+                if broker.clear_all():
+                    page.url = self._service_url
+        page.batches += 1
+        page.bytes += sum(p.stat().st_size for p in files if p.exists())
+        page.heap_bytes = broker.heap_bytes
+
+    def _collect_failures(self, broker: UnlockMusicBroker, files: list[pathlib.Path], unlocked: Iterable[pathlib.Path]):
+        """根据broker的状态记录本批未能解锁的文件及原因
+
+        :param unlocked: 已解锁的源文件
+        """
+        self.failed_files = set(files) - set(unlocked)
+        self.timed_out_files = self.failed_files - broker.failure_reasons.keys() if broker.timed_out else set()
+        self.failure_reasons = {p: broker.failure_reasons.get(p, REASON_FAILED) for p in self.failed_files}
+        self.failure_reasons.update(dict.fromkeys(self.timed_out_files, REASON_TIMED_OUT))
 
 
 class PatchMusicUnlocker(MusicUnlocker):
@@ -206,15 +523,19 @@ class PatchMusicUnlocker(MusicUnlocker):
     _patch_size: int
 
     def __init__(self, sel_driver: SeleniumDriver, unlock_music_url: str, music_dir: pathlib.Path,
-                 unlocked_suffixes: set[str], patch_size: int = 0):
+                 unlocked_suffixes: set[str], patch_size: int = 0,
+                 reload_policy: Optional[ReloadPolicy] = None,
+                 deadline: Optional[UnlockDeadline] = None):
         """
         :param sel_driver: SeleniumDriver
         :param unlock_music_url: 音乐解锁服务的url
         :param music_dir: 音乐目录
         :param unlocked_suffixes: 解锁的音频文件后缀组成的set
         :param patch_size: 每批的音乐数量
+        :param reload_policy: 何时重新加载页面，默认每批都重新加载
+        :param deadline: 每批解锁与下载的时限，默认不限；超时的批次会被二分重试
         """
-        super().__init__(sel_driver, unlock_music_url, music_dir, unlocked_suffixes)
+        super().__init__(sel_driver, unlock_music_url, music_dir, unlocked_suffixes, reload_policy, deadline)
 
         if patch_size < 0:
             logging.error(f'解锁批大小必须为非负整数（设置值：{patch_size}）！')
@@ -226,10 +547,206 @@ class PatchMusicUnlocker(MusicUnlocker):
         :param files: 待解锁的文件路径迭代器
         :return: 解锁后的音频文件名组成的list
         """
-        unlocked_filename_set = set()
+        unlocked_files = {}
+        failure_reasons = {}
+
+        batcher = Batcher(files, self._patch_size)
+        for path_patch in batcher:
+            super().unlock_files(files=path_patch)
+            unlocked_files.update(self.unlocked_files)
+            failure_reasons.update(_isolate(batcher, path_patch, self.timed_out_files, self.failure_reasons))
+
+        self.unlocked_files = unlocked_files
+        self.failure_reasons = failure_reasons
+        self.failed_files = set(failure_reasons)
+        return {p.name for p in unlocked_files.values()}
 
-        for path_patch in iter_with_patch(files, self._patch_size):
-            filename_patch = super().unlock_files(files=path_patch)
-            unlocked_filename_set |= filename_patch
 
-        return unlocked_filename_set
+class ParallelMusicUnlocker(BaseUnlocker):
+    """
+    分批解锁，各批交由会话池中的空闲会话并行处理
+
+    按流水线执行：浏览器阶段（加载页面、上传、解锁、下载）完成后立即归还会话，
+    发布到音乐目录（移动、修改所有者、删除源文件）交由独立的整理线程完成，使浏览器在整理上一批的同时处理下一批。
+    已下载、尚未整理的批次数有上限，超出时浏览器阶段等待，以限制下载目录的占用。
+    由页面脚本取回结果时不经过下载目录，各文件在浏览器阶段取回后即直接发布，不再使用整理线程。
+    批次按数量与字节数上限划分，由各会话的工作线程在空闲时取用。
+    超时或浏览器出错的批次被二分重试，直到找出问题文件；连续多批浏览器出错时视为服务故障，停止解锁。
+    """
+
+    _pool: DriverPool
+    _service_url: str
+    _music_dir: pathlib.Path
+    _unlocked_suffixes: set[str]
+    _patch_size: int
+    _budget: Optional[BatchBudget]
+    _finalizer: Finalizer
+    _finalize_workers: int
+    _pipeline_depth: int
+    _reload_policy: Optional[ReloadPolicy]
+    _deadline: Optional[UnlockDeadline]
+    _stream_results: bool
+    _max_batch_errors: int
+    _batch_errors: int  # 连续浏览器出错的批数
+    _lock: threading.Lock
+
+    def __init__(self, driver_pool: DriverPool, unlock_music_url: str, music_dir: pathlib.Path,
+                 unlocked_suffixes: set[str], patch_size: int = 0,
+                 budget: Optional[BatchBudget] = None,
+                 finalizer: Optional[Finalizer] = None,
+                 finalize_workers: int = 1,
+                 pipeline_depth: int = 2,
+                 reload_policy: Optional[ReloadPolicy] = None,
+                 deadline: Optional[UnlockDeadline] = None,
+                 stream_results: bool = False,
+                 max_batch_errors: int = 3):
+        """
+        :param driver_pool: WebDriver会话池，其大小即浏览器阶段的并行度
+        :param unlock_music_url: 音乐解锁服务的url
+        :param music_dir: 音乐目录
+        :param unlocked_suffixes: 解锁的音频文件后缀组成的set
+        :param patch_size: 每批的音乐数量
+        :param budget: 每批的字节数上限，为None时不限
+        :param finalizer: 整理阶段使用的Finalizer，默认只移动至音乐目录
+        :param finalize_workers: 整理阶段的线程数
+        :param pipeline_depth: 已下载、等待整理的批次数上限
+        :param reload_policy: 何时重新加载页面，默认每批都重新加载
+        :param deadline: 每批解锁与下载的时限，默认不限
+        :param stream_results: 是否由页面脚本逐个取回解锁结果并直接发布，不经过浏览器下载目录
+        :param max_batch_errors: 连续多少批浏览器出错后停止解锁并抛出异常
+        """
+        if patch_size < 0:
+            logging.error(f'解锁批大小必须为非负整数（设置值：{patch_size}）！')
+            raise PatchSizeError(patch_size)
+
+        self._pool = driver_pool
+        self._service_url = unlock_music_url
+        self._music_dir = music_dir
+        self._unlocked_suffixes = unlocked_suffixes.copy()
+        self._patch_size = patch_size
+        self._budget = budget
+        self._finalizer = finalizer if finalizer is not None else Finalizer(music_dir)
+        self._finalize_workers = max(finalize_workers, 1)
+        self._pipeline_depth = max(pipeline_depth, 1)
+        self._reload_policy = reload_policy
+        self._deadline = deadline
+        self._stream_results = stream_results
+        self._max_batch_errors = max(max_batch_errors, 1)
+        self._batch_errors = 0
+        self._lock = threading.Lock()
+        self.failed_files = set()
+        self.failure_reasons = {}
+        self.unlocked_files = {}
+
+    def _unlock_patch(self, path_patch: list[pathlib.Path],
+                      batcher: Batcher,
+                      finalizer: ThreadPoolExecutor,
+                      slots: threading.BoundedSemaphore
+                      ) -> tuple[Optional[_FinalizeFuture], dict[pathlib.Path, str]]:
+        """浏览器阶段：解锁并下载一批，再将整理工作提交给整理线程（由页面脚本取回结果时已直接发布）
+
+        :param batcher: 分批器，用于报告该批的耗时，以及重新分配超时或出错的文件
+        :param finalizer: 整理阶段的线程池
+        :param slots: 等待整理的批次数限额
+        :return: 整理结果（源文件 -> 发布后的路径，以及未能发布的源文件）的Future（浏览器出错时为None），
+                 以及未能解锁的文件 -> 原因
+        """
+        start = time.monotonic()
+        unlocker = None
+        try:
+            with metrics.span('browser'), self._pool.session() as sel_driver:
+                unlocker = MusicUnlocker(sel_driver, self._service_url, self._music_dir, self._unlocked_suffixes,
+                                         self._reload_policy, self._deadline)
+                if self._stream_results:
+                    streamed = unlocker.unlock_by_script(path_patch, self._finalizer)
+                else:
+                    downloaded = unlocker.unlock_in_browser(path_patch)
+        except WebDriverException as e:  # 会话已被丢弃，二分重试该批
+            batcher.report(path_patch, time.monotonic() - start, ok=False)
+            with self._lock:
+                self._batch_errors += 1
+                if self._batch_errors >= self._max_batch_errors:
+                    raise
+            logging.warning(f'浏览器出错：{e.msg}')
+            metrics.add_result('browser_errors')
+            reason = f'browser error: {e.msg}'
+            future = None
+            remaining = path_patch
+            if unlocker is not None and self._stream_results:  # 出错前已发布的文件不再重试
+                streamed = dict(unlocker.published_files), set(unlocker.publish_failed_files)
+                future = Future()
+                future.set_result(streamed)
+                remaining = [p for p in path_patch if p not in streamed[0].keys() | streamed[1]]
+            return future, _isolate(batcher, remaining, set(remaining), dict.fromkeys(remaining, reason))
+        except Exception:
+            batcher.report(path_patch, time.monotonic() - start, ok=False)
+            raise
+        with self._lock:
+            self._batch_errors = 0
+
+        elapsed = time.monotonic() - start
+        batcher.report(path_patch, elapsed, ok=not unlocker.timed_out_files)
+        for p in path_patch:  # 同一批的文件一同上传、解锁与下载，各文件的耗时即该批的耗时
+            metrics.observe_file('browser', p, elapsed)
+
+        if self._stream_results:  # 已在浏览器阶段发布
+            future = Future()
+            future.set_result(streamed)
+            return future, _isolate(batcher, path_patch, unlocker.timed_out_files, unlocker.failure_reasons)
+
+        self._finalizer.log_downloaded(downloaded)  # 在等待整理之前记录，使退出后下一次运行可直接发布
+        slots.acquire()  # 会话已归还，等待整理阶段有空位
+        future = finalizer.submit(self._finalizer.finalize_paths, downloaded)
+        future.add_done_callback(lambda _: slots.release())
+        return future, _isolate(batcher, path_patch, unlocker.timed_out_files, unlocker.failure_reasons)
+
+    def _run_worker(self, batcher: Batcher,
+                    finalizer: ThreadPoolExecutor,
+                    slots: threading.BoundedSemaphore
+                    ) -> tuple[list[_FinalizeFuture], dict[pathlib.Path, str]]:
+        """不断取批处理，直到分批器中没有剩余的批次
+
+        :return: 各批整理结果的Future，以及未能解锁的文件 -> 原因
+        """
+        finalize_futures = []
+        failure_reasons = {}
+        for path_patch in batcher:
+            try:
+                future, failed_patch = self._unlock_patch(path_patch, batcher, finalizer, slots)
+            except Exception:
+                batcher.close()  # 出错后不再分配新的批次
+                raise
+            if future is not None:
+                finalize_futures.append(future)
+            failure_reasons.update(failed_patch)
+        return finalize_futures, failure_reasons
+
+    def unlock_files(self, files: Iterable[pathlib.Path]) -> set[str]:
+        """
+        :param files: 待解锁的文件路径迭代器
+        :return: 解锁后的音频文件名组成的set
+        """
+        unlocked_files = {}
+        failure_reasons = {}
+        batcher = Batcher(files, self._patch_size, self._budget)
+        slots = threading.BoundedSemaphore(self._pipeline_depth)
+
+        with ThreadPoolExecutor(max_workers=self._finalize_workers) as finalizer, \
+                ThreadPoolExecutor(max_workers=self._pool.size) as executor:
+            workers = [executor.submit(self._run_worker, batcher, finalizer, slots) for _ in range(self._pool.size)]
+
+            finalize_futures = []
+            for worker in workers:
+                worker_futures, failed_patch = worker.result()
+                finalize_futures += worker_futures
+                failure_reasons.update(failed_patch)
+
+            for future in finalize_futures:
+                published_patch, failed_patch = future.result()
+                unlocked_files.update(published_patch)
+                failure_reasons.update(dict.fromkeys(failed_patch, REASON_PUBLISH_FAILED))
+
+        self.unlocked_files = unlocked_files
+        self.failure_reasons = failure_reasons
+        self.failed_files = set(failure_reasons)
+        return {p.name for p in unlocked_files.values()}
@@ -0,0 +1,117 @@
+import logging
+import os
+import pathlib
+import time
+from typing import Callable, Iterator, Optional
+
+from aum.helpers.inotify import IN_CLOSE_WRITE, IN_MOVED_TO, Inotify
+
+
+class MusicDirWatcher:
+    """
+    监视音乐目录，将新出现的文件去抖后分批生成
+
+    优先使用inotify，文件写入关闭或移入目录即视为就绪；不可用时定时扫描目录，
+    此时文件大小在去抖时间内保持不变才视为就绪。以"."开头的文件（临时文件、索引数据库等）被忽略。
+    """
+
+    music_dir: pathlib.Path
+
+    _debounce: float
+    _max_batch: int
+    _poll_interval: float
+    _pending: dict[str, int]  # 文件名 -> 最后观测的大小
+    _seen: set[str]  # 定时扫描时已见过的文件名
+    _last_event: float  # 最后一次出现新文件的时间
+
+    def __init__(self, music_dir: pathlib.Path, debounce: float = 3, max_batch: int = 0, poll_interval: float = 10):
+        """
+        :param music_dir: 音乐目录
+        :param debounce: 最后一个新文件出现后等待多久再生成一批，单位秒
+        :param max_batch: 积累到多少个文件时不再等待，立即生成一批，0表示不限
+        :param poll_interval: 不支持inotify时扫描目录的间隔，单位秒
+        """
+        self.music_dir = music_dir
+        self._debounce = debounce
+        self._max_batch = max_batch
+        self._poll_interval = poll_interval
+        self._pending = {}
+        self._seen = set()
+        self._last_event = 0
+
+    def _add(self, name: str, size: int = -1):
+        if name.startswith('.'):
+            return
+        if name not in self._pending:
+            self._last_event = time.monotonic()
+        self._pending[name] = size
+
+    def _scan(self, initial: bool = False):
+        """扫描目录，把新文件加入待处理；首次扫描时目录中已有的文件全部加入"""
+        names = set()
+        with os.scandir(self.music_dir) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                names.add(entry.name)
+                if initial or entry.name not in self._seen:
+                    self._add(entry.name, entry.stat().st_size)
+                elif entry.name in self._pending:
+                    size = entry.stat().st_size
+                    if size != self._pending[entry.name]:  # 仍在写入，重新开始去抖
+                        self._pending[entry.name] = size
+                        self._last_event = time.monotonic()
+        self._seen = names
+
+    def _ready(self) -> bool:
+        if not self._pending:
+            return False
+        if self._max_batch and len(self._pending) >= self._max_batch:
+            return True
+        return time.monotonic() - self._last_event >= self._debounce
+
+    def _flush(self) -> list[pathlib.Path]:
+        batch = [self.music_dir / name for name in self._pending]
+        self._pending.clear()
+        return sorted(p for p in batch if p.exists())
+
+    def batches(self, should_stop: Callable[[], bool] = lambda: False) -> Iterator[list[pathlib.Path]]:
+        """持续生成新文件组成的批次，首批包含启动时目录中已有的文件
+
+        :param should_stop: 返回True时停止监视
+        """
+        inotify: Optional[Inotify] = None
+        if Inotify.available():
+            try:
+                inotify = Inotify()
+                inotify.add_watch(self.music_dir, IN_CLOSE_WRITE | IN_MOVED_TO)
+            except OSError as e:
+                logging.warning(f'inotify不可用，将每{self._poll_interval}秒扫描一次音乐目录：{e}')
+                if inotify is not None:
+                    inotify.close()
+                inotify = None
+
+        try:
+            self._scan(initial=True)  # 须在开始监视后扫描，以免漏掉其间出现的文件
+            self._last_event = 0  # 已有的文件无需去抖
+            last_scan = time.monotonic()
+            while not should_stop():
+                if self._ready():
+                    batch = self._flush()
+                    if batch:
+                        yield batch
+                    continue
+
+                # 有待处理文件时只需等到去抖结束，否则每秒醒来检查是否需要停止
+                wait = self._debounce if self._pending else 1
+                if inotify is not None:
+                    for event in inotify.read(timeout=wait):
+                        self._add(event.name)
+                else:
+                    time.sleep(min(wait, 1))
+                    if self._pending or time.monotonic() - last_scan >= self._poll_interval:
+                        self._scan()
+                        last_scan = time.monotonic()
+        finally:
+            if inotify is not None:
+                inotify.close()
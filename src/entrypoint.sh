@@ -1,6 +1,8 @@
 #!/bin/bash
 
-# 检查Selenium服务是否成功启动
-while ! `nc -z selenium-server 4444`; do sleep 3; done
+# 检查Selenium服务是否成功启动（scan模式不需要浏览器）
+if [ "$1" != "scan" ]; then
+  while ! `nc -z selenium-server 4444`; do sleep 3; done
+fi
 
-python main.py
+python main.py "$@"
@@ -1,82 +1,685 @@
+import argparse
 import logging
-import shutil
+import pathlib
+import signal
+import sys
+import threading
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional
 
+from aum.batcher import BatchBudget
+from aum.cache import UnlockCache
 from aum.config import ConfigFactory
-from aum.driver import WebDriverFactory, SeleniumHub
-from aum.helpers.dir_filter import filter_dir_by_suffixes
-from aum.unlocker import PatchMusicUnlocker
+from aum.helpers.dir_filter import filter_dir_by_suffixes, match_suffix
+from aum.index import FileIndex
+from aum.journal import JournalLock, UnlockJournal
+from aum.metrics import metrics
+from aum.preflight import JUNK, PLAIN, PreflightClassifier
+from aum.rename import RenameEngine
+from aum.scanner import LibraryScanner
+from aum.schedule import UnlockScheduler
+from aum.tags import TagReader
+from aum.unlocker import Finalizer, LocalDecryptUnlocker, ReloadPolicy, UnlockDeadline
 
+# 浏览器相关的模块依赖selenium，用到时才导入，使scan模式快速启动
+if TYPE_CHECKING:
+    from aum.pool import DriverPool
+
+EXIT_NOTHING_TO_DO = 3  # scan模式下没有需要处理的文件时的退出码
+
+_tag_readers: dict[Optional[pathlib.Path], TagReader] = {}  # 标签缓存路径 -> 整个运行期间共用的TagReader
+
+
+def unlock_all_music(config,
+                     music_files: Optional[Iterable[pathlib.Path]] = None,
+                     index: Optional[FileIndex] = None,
+                     driver_pool: Optional['DriverPool'] = None,
+                     budget: Optional[BatchBudget] = None,
+                     schemes: Optional[dict[pathlib.Path, str]] = None
+                     ) -> set[pathlib.Path]:
+    """
+    :param config: 配置
+    :param music_files: 待检查的文件，默认为音乐目录（及配置的子目录）下的全部文件；加密音乐按其顺序解锁
+    :param index: 文件状态索引，用于记录解锁结果
+    :param driver_pool: 复用的WebDriver会话池，默认在需要时临时创建
+    :param budget: 复用的每批字节数上限，默认按配置新建
+    :param schemes: 预检识别出的加密方式，用于选择解锁后端，未预检的文件只按后缀选择
+    :return: 解锁后的音乐文件
+    """
+    if music_files is None:
+        music_files = create_scanner(config).paths()
 
-def unlock_all_music(config):
     # 筛选出加密音乐
-    locked_music_set = set(filter_dir_by_suffixes(
-        config.music_dir.iterdir(),
-        config.locked_suffixes
-    ))
-    if not locked_music_set:  # 无加密音乐，退出
+    with metrics.span('filter'):
+        locked_music = list(dict.fromkeys(filter_dir_by_suffixes(
+            music_files,
+            config.locked_suffixes
+        )))
+    if not locked_music:  # 无加密音乐，退出
         logging.info('未找到加密音乐。')
-        return
+        return set()
+
+    logging.info(f'找到如下{len(locked_music)}首加密音乐：')
+    for i, p in enumerate(locked_music):
+        logging.info(f'{i + 1}. {p.name}')
+    locked_music_set = set(locked_music)
+
+    file_owner = (config.music_file_uid, config.music_file_gid)  # 各unlocker在产出文件时即修改所有者
+    with metrics.span('unlock'):
+        if config.cache_dir is None:
+            unlocked_files, failed_music = unlock_files(config, locked_music, driver_pool, file_owner, budget,
+                                                        schemes)
+        else:
+            with UnlockCache(config.cache_dir, config.cache_bytes, config.cache_hash) as cache:
+                unlocked_files, failed_music = unlock_files_cached(config, cache, locked_music, driver_pool,
+                                                                   file_owner, budget, schemes)
 
-    logging.info(f'找到如下{len(locked_music_set)}首加密音乐：')
-    for index, p in enumerate(locked_music_set):
-        logging.info(f'{index + 1}. {p.name}')
-
-    # 创建WebDriver
-    sel_hub = SeleniumHub(config.sel_hub_url, config.download_dir)
-    logging.debug('正在创建WebDriver...')
-    sel_driver = WebDriverFactory(sel_hub).create()
-    logging.debug('创建完成。')
-
-    # 解密
-    music_unlocker = PatchMusicUnlocker(
-        sel_driver,
-        unlock_music_url=config.unlock_music_server,
-        music_dir=config.music_dir,
-        unlocked_suffixes=config.unlocked_suffixes,
-        patch_size=config.unlock_patch_size
-    )
-    unlocked_filename_set = music_unlocker.unlock_files(locked_music_set)
-
-    # 关闭WebDriver
-    logging.debug('正在关闭WebDriver...')
-    sel_driver.quit()
-    logging.debug('关闭完成。')
-
-    # 删除解密前的文件
-    for p in locked_music_set:
+    # 删除解密前的文件（各文件在发布时即已删除，此处只是兜底），解锁失败的文件予以保留
+    for p in locked_music_set - failed_music.keys():
         p.unlink(missing_ok=True)
+        if index is not None:
+            index.forget(p)
+
+    # 解锁失败的文件连同原因记入索引，在其发生变化之前不再尝试
+    for p, reason in failed_music.items():
+        logging.warning(f'未能解锁：{p.name}（{reason}）')
+        if index is not None and p.exists():
+            index.record(p, FileIndex.FAILED, reason=reason)
+
+    unlocked_music_set = set(unlocked_files.values())
+    for p in unlocked_music_set:
+        if index is not None:
+            index.record(p, FileIndex.UNLOCKED)
+
+    metrics.add_result('unlocked', len(unlocked_music_set))
+    metrics.add_result('failed', len(failed_music))
+    return unlocked_music_set
+
+
+def unlock_files(config, music_files: list[pathlib.Path],
+                 driver_pool: Optional['DriverPool'] = None,
+                 file_owner: Optional[tuple[int, int]] = None,
+                 budget: Optional[BatchBudget] = None,
+                 schemes: Optional[dict[pathlib.Path, str]] = None
+                 ) -> tuple[dict[pathlib.Path, pathlib.Path], dict[pathlib.Path, str]]:
+    """
+    按配置的后端解锁文件
+
+    :param music_files: 待解锁的文件，按其顺序解锁
+    :param schemes: 预检识别出的加密方式，与后缀对应的本地解码器不符的文件直接交由浏览器
+    :return: 加密的源文件 -> 解锁后在音乐目录中的路径，以及未能解锁的文件 -> 原因
+    """
+    unlocked_files = {}
+    browser_music_files = music_files  # 需要交由浏览器解锁的音乐
+    failed_music = {}  # 解锁失败的音乐 -> 原因
+
+    # 本地解密，不支持或解密失败的音乐交由浏览器处理
+    if config.unlock_backend == 'local':
+        journal = UnlockJournal(config.journal) if config.journal is not None else None
+        try:
+            local_unlocker = LocalDecryptUnlocker(create_finalizer(config, file_owner, journal))
+            schemes = schemes or {}
+            local_music_files = [p for p in music_files if local_unlocker.supports(p, schemes.get(p))]
+            local_unlocker.unlock_files(local_music_files)
+        finally:
+            if journal is not None:
+                journal.close()
+        unlocked_files.update(local_unlocker.unlocked_files)
+        browser_music_files = [p for p in music_files if p not in unlocked_files]
+
+    if browser_music_files:
+        browser_unlocked_files, failed_music = unlock_music_in_browser(config, browser_music_files, driver_pool,
+                                                                       file_owner, budget)
+        unlocked_files.update(browser_unlocked_files)
+    return unlocked_files, failed_music
+
+
+def unlock_files_cached(config, cache: UnlockCache, music_files: list[pathlib.Path],
+                        driver_pool: Optional['DriverPool'] = None,
+                        file_owner: Optional[tuple[int, int]] = None,
+                        budget: Optional[BatchBudget] = None,
+                        schemes: Optional[dict[pathlib.Path, str]] = None
+                        ) -> tuple[dict[pathlib.Path, pathlib.Path], dict[pathlib.Path, str]]:
+    """
+    先从缓存中发布已解锁过的文件，内容相同的文件只解锁一个，解锁结果存入缓存后再复制给其余文件
+
+    :return: 加密的源文件 -> 解锁后在音乐目录中的路径，以及未能解锁的文件 -> 原因
+    """
+    with metrics.span('cache.lookup'):
+        hits, unlocking = cache.partition(music_files)
+
+    # 从缓存发布时保留缓存中的文件，发布的文件名由源文件名与解锁后的后缀组成
+    publisher = Finalizer(config.music_dir, file_owner, fsync=config.finalize_fsync, remove_sources=True,
+                          renamer=create_rename_engine(config), keep_results=True)
+    unlocked_files, failed_hits = publisher.finalize_paths(hits, {p: p.stem + obj.suffix for p, obj in hits.items()})
+    metrics.add_result('cache_hits', len(unlocked_files))
+    if unlocked_files:
+        logging.info(f'{len(unlocked_files)}首音乐已从缓存中解锁。')
+    for p in failed_hits:  # 未能从缓存发布的，照常解锁
+        unlocking[p] = []
+
+    if not unlocking:
+        return unlocked_files, {}
+    new_files, failed_music = unlock_files(config, list(unlocking), driver_pool, file_owner, budget, schemes)
+    unlocked_files.update(new_files)
+
+    with metrics.span('cache.store'):
+        stored = {p: cache.store(p, dst) for p, dst in new_files.items()}
+
+    # 内容相同的文件复用解锁结果，未能存入缓存时复制已发布的文件
+    duplicates = {}
+    for p, same in unlocking.items():
+        if p in failed_music:
+            failed_music.update(dict.fromkeys(same, failed_music[p]))
+            continue
+        for d in same:
+            duplicates[d] = stored[p] or new_files[p]
+    copied, failed_duplicates = publisher.finalize_paths(duplicates,
+                                                         {p: p.stem + obj.suffix for p, obj in duplicates.items()})
+    unlocked_files.update(copied)
+    metrics.add_result('deduplicated', len(copied))
+    failed_music.update(dict.fromkeys(failed_duplicates, 'publish failed'))
+    return unlocked_files, failed_music
+
+
+def create_scanner(config) -> LibraryScanner:
+    return LibraryScanner(config.music_dir, None if config.scan_depth < 0 else config.scan_depth,
+                          config.scan_exclude, config.scan_workers)
+
+
+def create_batch_budget(config) -> BatchBudget:
+    return BatchBudget(config.unlock_patch_bytes,
+                       adaptive=config.unlock_batching == 'adaptive',
+                       target_seconds=config.unlock_batch_seconds)
+
+
+def create_scheduler(config, budget: Optional[BatchBudget] = None, max_batches: Optional[int] = None
+                     ) -> UnlockScheduler:
+    """
+    :param budget: 解锁时使用的每批字节数上限，使按批数上限选取的文件与实际分批一致
+    :param max_batches: 覆盖配置的每次运行批数上限
+    """
+    return UnlockScheduler(config.unlock_order, config.unlock_aging,
+                           config.unlock_max_batches if max_batches is None else max_batches,
+                           config.unlock_patch_size, budget)
 
-    # 更改解锁文件的所有者
-    for i in unlocked_filename_set:
-        shutil.chown(config.music_dir / i, config.music_file_uid, config.music_file_gid)
 
+def create_classifier(config) -> Optional[PreflightClassifier]:
+    """未启用预检时返回None"""
+    return PreflightClassifier(config.scan_workers) if config.unlock_preflight else None
 
-def rename_all_music(config):
+
+def create_driver_pool(config) -> 'DriverPool':
+    from aum.driver import firefox_prefs
+    from aum.hub import SeleniumHub
+    from aum.pool import DriverPool
+
+    sel_hubs = [SeleniumHub(url, config.download_dir, config.remote_download_dir,
+                            music_dir=config.music_dir, remote_music_dir=config.remote_music_dir)
+                for url in config.sel_hub_urls]
+    return DriverPool(sel_hubs, size=config.unlock_workers,
+                      prefs=firefox_prefs(config.firefox_profile, config.firefox_prefs))
+
+
+def unlock_music_in_browser(config, music_files: list[pathlib.Path],
+                            driver_pool: Optional['DriverPool'] = None,
+                            file_owner: Optional[tuple[int, int]] = None,
+                            budget: Optional[BatchBudget] = None
+                            ) -> tuple[dict[pathlib.Path, pathlib.Path], dict[pathlib.Path, str]]:
+    """
+    :param music_files: 待解锁的文件，按其顺序分批
+    :param driver_pool: 复用的WebDriver会话池，为None时临时创建并在完成后关闭
+    :param file_owner: 解锁文件的所有者(uid, gid)，为None时不修改
+    :param budget: 每批的字节数上限，为None时按配置新建
+    :return: 加密的源文件 -> 解锁后在音乐目录中的路径，以及未能解锁的文件 -> 原因
+    """
+    if driver_pool is not None:
+        from aum.unlocker import ParallelMusicUnlocker
+
+        journal = UnlockJournal(config.journal) if config.journal is not None else None
+        try:
+            music_unlocker = ParallelMusicUnlocker(
+                driver_pool,
+                unlock_music_url=config.unlock_music_server,
+                music_dir=config.music_dir,
+                unlocked_suffixes=config.unlocked_suffixes,
+                patch_size=config.unlock_patch_size,
+                budget=budget if budget is not None else create_batch_budget(config),
+                finalizer=create_finalizer(config, file_owner, journal),
+                finalize_workers=config.finalize_workers,
+                pipeline_depth=config.pipeline_depth,
+                reload_policy=ReloadPolicy(config.page_reload_batches, config.page_reload_bytes),
+                deadline=UnlockDeadline(config.unlock_batch_timeout, config.unlock_file_timeout),
+                stream_results=config.unlock_transfer == 'script'
+            )
+            music_unlocker.unlock_files(music_files)
+        finally:
+            if journal is not None:
+                journal.close()
+        return music_unlocker.unlocked_files, music_unlocker.failure_reasons
+
+    # 创建WebDriver会话池
+    driver_pool = create_driver_pool(config)
+    try:
+        return unlock_music_in_browser(config, music_files, driver_pool, file_owner, budget)
+    finally:
+        # 关闭WebDriver
+        logging.debug('正在关闭WebDriver...')
+        driver_pool.quit()
+        logging.debug('关闭完成。')
+
+
+def create_finalizer(config, file_owner: Optional[tuple[int, int]],
+                     journal: Optional[UnlockJournal] = None) -> Finalizer:
+    """发布解锁结果（浏览器或本地解密）的Finalizer：发布时即重命名，并删除加密的源文件"""
+    return Finalizer(config.music_dir, file_owner, fsync=config.finalize_fsync, remove_sources=True,
+                     renamer=create_rename_engine(config), journal=journal)
+
+
+def recover_unlocks(config):
+    """发布上次运行中已下载、尚未发布完成的解锁结果，并删除下载目录中不属于任何记录的残留结果
+
+    须在持有JournalLock的独占锁、即没有其他运行正在进行时调用。
+    """
+    if config.journal is None:
+        return
+
+    with UnlockJournal(config.journal) as journal:
+        for library in config.library_configs():
+            finalizer = create_finalizer(library, (library.music_file_uid, library.music_file_gid), journal)
+            published, failed = finalizer.recover()
+            if published:
+                logging.info(f'已发布上次运行中下载完成的{len(published)}首音乐。')
+            if failed:
+                logging.warning(f'上次运行中下载完成的{len(failed)}首音乐仍未能发布。')
+            metrics.add_result('recovered', len(published))
+        kept = journal.results()
+
+    # 各会话的下载子目录只由本程序使用，其中没有记录的文件（如超时后才下载完成的结果）不会再被发布
+    removed = 0
+    for sub_dir in config.download_dir.glob('session-*'):
+        for p in sub_dir.iterdir():
+            if p.is_file() and p not in kept:
+                p.unlink(missing_ok=True)
+                removed += 1
+    if removed:
+        logging.info(f'已删除下载目录中的{removed}个残留文件。')
+
+
+def create_rename_engine(config) -> RenameEngine:
+    return RenameEngine(config.removing_substr, config.rename_regex, config.rename_template, create_tag_reader(config))
+
+
+def create_tag_reader(config) -> TagReader:
+    """同一标签缓存共用一个TagReader，使内存中的缓存在各批次与各音乐库之间复用"""
+    return _tag_readers.setdefault(config.tag_cache, TagReader(config.tag_cache))
+
+
+def rename_all_music(config,
+                     music_files: Optional[Iterable[pathlib.Path]] = None,
+                     index: Optional[FileIndex] = None,
+                     dry_run: bool = False
+                     ) -> dict[pathlib.Path, pathlib.Path]:
+    """
+    :param config: 配置
+    :param music_files: 待检查的文件，默认为音乐目录（及配置的子目录）下的全部文件
+    :param index: 文件状态索引，用于记录重命名结果
+    :param dry_run: 只输出重命名计划，不修改文件
+    :return: 原路径 -> 新路径
+    """
     logging.info(f'正在移除文件名内的无用子串...')
 
-    music_dir = config.music_dir
-    count = 0
-    for child in music_dir.iterdir():
-        for substr in config.removing_substr:
-            if child.stem.find(substr) != -1:
-                new_name = child.stem.replace(substr, '') + child.suffix  # 从stem中移除子串，得到新文件名
-                shutil.move(child, music_dir / new_name)
+    if music_files is None:
+        music_files = create_scanner(config).paths()
+
+    engine = create_rename_engine(config)
+    with metrics.span('rename.plan'):
+        plan = engine.plan(music_files) if not engine.is_noop else []
+    if dry_run:
+        for i, step in enumerate(plan):
+            note = '' if step.ok else f'（跳过：{step.conflict}）'
+            logging.info(f'{i + 1}. "{step.source.name}" -> "{step.target.relative_to(step.source.parent)}"{note}')
+        return {}
 
-                count += 1
-                logging.info(f'{count}. "{child.name}" -> "{new_name}"')
-                break
+    with metrics.span('rename.apply'):
+        renamed = engine.apply(plan, (config.music_file_uid, config.music_file_gid))
+    metrics.add_result('renamed', len(renamed))
+    for i, (old, new) in enumerate(renamed.items()):
+        if index is not None:
+            index.move(old, new, index.state_of(old) or FileIndex.RENAMED)
+        logging.info(f'{i + 1}. "{old.name}" -> "{new.relative_to(old.parent)}"')
 
-    if count > 0:
+    if renamed:
         logging.info('移除完成。')
     else:
         logging.info('没有文件需要移除。')
+    return renamed
+
+
+def preflight_files(config, music_files: list[pathlib.Path], classifier: PreflightClassifier,
+                    index: Optional[FileIndex] = None
+                    ) -> tuple[list[pathlib.Path], dict[pathlib.Path, str]]:
+    """预检加密音乐：明文音频改为实际的后缀后按普通文件处理，无法解锁的文件不再交给浏览器
+
+    :return: 预检后的文件（明文音频为改名后的路径，不含无法解锁的文件），以及加密音乐 -> 加密方式
+    """
+    suffixes = {s.lower() for s in config.locked_suffixes}
+    with metrics.span('preflight'):
+        results = classifier.classify_all(filter_dir_by_suffixes(music_files, suffixes))
+
+    replaced = {}  # 原路径 -> 改名后的路径，无法解锁的为None
+    schemes = {}
+    for p, result in results.items():
+        if result.kind == JUNK:
+            logging.warning(f'跳过无法解锁的文件：{p.name}（{result.reason}）')
+            if index is not None:
+                index.record(p, FileIndex.FAILED, reason=result.reason)
+            replaced[p] = None
+        elif result.kind == PLAIN:
+            dst = p.with_name(p.name[:-len(match_suffix(p.name, suffixes))] + result.scheme)
+            if dst.exists():
+                logging.warning(f'"{p.name}"实际为明文音频，但"{dst.name}"已存在，照常解锁。')
+                continue
+            try:
+                p.rename(dst)
+            except OSError as e:
+                logging.warning(f'"{p.name}"实际为明文音频，但改名失败，照常解锁：{e}')
+                continue
+            logging.info(f'"{p.name}"实际为明文音频，已改名为"{dst.name}"。')
+            if index is not None:
+                index.forget(p)
+            replaced[p] = dst
+        else:
+            schemes[p] = result.scheme
+
+    rejected = sum(dst is None for dst in replaced.values())
+    if rejected:
+        metrics.add_result('rejected', rejected)
+    if len(replaced) > rejected:
+        metrics.add_result('plain', len(replaced) - rejected)
+    music_files = [replaced.get(p, p) for p in music_files]
+    return [p for p in music_files if p is not None], schemes
+
+
+def process_files(config, music_files: list[pathlib.Path],
+                  index: Optional[FileIndex] = None,
+                  driver_pool: Optional['DriverPool'] = None,
+                  budget: Optional[BatchBudget] = None,
+                  scheduler: Optional[UnlockScheduler] = None,
+                  classifier: Optional[PreflightClassifier] = None):
+    """解锁并重命名给定的文件，以及由此解锁得到的文件
+
+    :param scheduler: 决定加密音乐的解锁顺序与本次解锁的数量，留待之后运行的文件不做任何处理，也不记入索引
+    :param classifier: 解锁前预检加密音乐，为None时不预检
+    """
+    schemes = None
+    if classifier is not None:
+        music_files, schemes = preflight_files(config, music_files, classifier, index)
+
+    if scheduler is not None:
+        locked = set(filter_dir_by_suffixes(music_files, config.locked_suffixes))
+        scheduled, deferred = scheduler.schedule((p for p in music_files if p in locked), index)
+        if deferred:
+            metrics.add_result('deferred', len(deferred))
+        music_files = scheduled + [p for p in music_files if p not in locked]
+
+    unlocked_music_set = unlock_all_music(config, music_files, index, driver_pool, budget, schemes)
+
+    current_files = {p for p in music_files if p.exists()} | unlocked_music_set
+    renamed = rename_all_music(config, current_files, index)
+
+    # 其余文件无需处理，记录下来以免下次重复检查
+    if index is not None:
+        index.record_all((renamed.get(p, p) for p in current_files), FileIndex.CLEAN)
+
+
+def scan(config) -> bool:
+    """只检查音乐目录中是否有需要处理（解锁或重命名）的文件，不启动浏览器，也不修改文件
+
+    设置了文件状态索引时只检查新增或变化的文件。
+
+    :return: 是否有需要处理的文件
+    """
+    scanner = create_scanner(config)
+    if config.state_db is not None:
+        with FileIndex(config.state_db) as index:
+            music_files = [p for directory, entries in scanner.directories()
+                           for p in index.scan(directory, entries)]
+    else:
+        music_files = list(scanner.paths())
+
+    locked = list(filter_dir_by_suffixes(music_files, config.locked_suffixes))
+    engine = create_rename_engine(config)
+    renaming = [] if engine.is_noop else engine.plan(music_files)
+
+    if not locked and not renaming:
+        logging.info('没有需要处理的文件。')
+        return False
+    logging.info(f'有{len(locked)}首加密音乐、{len(renaming)}个文件需要重命名。')
+    return True
+
+
+def split_scanned(config, music_files: Iterable[pathlib.Path],
+                  scheduler: Optional[UnlockScheduler] = None) -> Iterator[list[pathlib.Path]]:
+    """将边扫描边产出的文件分段，每段含每个会话一批的加密音乐，使解锁无需等待扫描完成
+
+    未分批（AUM_UNLOCK_PATCH_SIZE=0），或调度器须看到全部文件才能排序时不分段。
+    """
+    limit = config.unlock_patch_size * config.unlock_workers
+    if scheduler is not None and not scheduler.streaming:
+        limit = 0
+    suffixes = {s.lower() for s in config.locked_suffixes}
+    chunk = []
+    locked = 0
+    for p in music_files:
+        chunk.append(p)
+        if match_suffix(p.name, suffixes) is not None:
+            locked += 1
+            if limit and locked >= limit:
+                yield chunk
+                chunk = []
+                locked = 0
+    if chunk:
+        yield chunk
+
+
+def process_with_index(config,
+                       driver_pool: Optional['DriverPool'] = None,
+                       budget: Optional[BatchBudget] = None):
+    """借助文件状态索引，只处理音乐目录中新增或变化的文件"""
+    scanner = create_scanner(config)
+    scheduler = create_scheduler(config, budget)
+    classifier = create_classifier(config)
+    scanned = []  # 已扫描的目录，全部处理完成后记录其mtime
+
+    def changed_files() -> Iterator[pathlib.Path]:
+        for directory, entries in scanner.directories():
+            with metrics.span('scan'):
+                music_files = index.scan(directory, entries)
+            scanned.append(directory)
+            yield from music_files
+
+    with FileIndex(config.state_db) as index:
+        found = 0
+        for music_files in split_scanned(config, changed_files(), scheduler):
+            found += len(music_files)
+            process_files(config, music_files, index, driver_pool, budget, scheduler, classifier)
+            index.commit()
+        if not found:
+            logging.info(f'{config.music_dir}中没有新增或变化的文件。')
+
+        for directory in scanned:
+            index.mark_scanned(directory, ignore=scanner.excludes)
+
+
+def process_library(config,
+                    driver_pool: Optional['DriverPool'] = None,
+                    budget: Optional[BatchBudget] = None):
+    """处理一次音乐目录：边扫描边解锁并重命名"""
+    if config.state_db is not None:
+        process_with_index(config, driver_pool, budget)
+        return
+
+    scheduler = create_scheduler(config, budget)
+    classifier = create_classifier(config)
+    for music_files in split_scanned(config, create_scanner(config).paths(), scheduler):
+        process_files(config, music_files, None, driver_pool, budget, scheduler, classifier)
+
+
+def run_libraries(config, target: Callable[..., None], *args):
+    """在各音乐库上运行target(library_config, *args)
+
+    只有一个音乐库时直接在当前线程运行；有多个时每个音乐库一个线程，共用args中的会话池等资源。
+    某个音乐库出错不影响其他音乐库，全部结束后再抛出第一个异常。
+    """
+    libraries = config.library_configs()
+    if len(libraries) == 1:
+        target(libraries[0], *args)
+        return
+
+    errors = []
+
+    def run_one(library):
+        try:
+            target(library, *args)
+        except Exception as e:
+            logging.exception(f'处理音乐库{library.library}失败：')
+            errors.append(e)
+
+    threads = [threading.Thread(target=run_one, args=(library,), name=f'library-{library.library}')
+               for library in libraries]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+
+def daemon(config):
+    """常驻运行：监视各音乐目录，新文件出现后立即解锁，浏览器会话在批次间保持并由各音乐库共用"""
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        logging.info('收到退出信号，将在当前批次完成后退出。')
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    driver_pool = None
+    if config.sel_hub_urls:  # 本地解密时也需要浏览器处理不支持的格式
+        driver_pool = create_driver_pool(config)
+        driver_pool.release(driver_pool.acquire())  # 预先启动浏览器，避免第一批等待冷启动
+    budget = create_batch_budget(config)  # 跨批次保留，使自适应分批持续调整
+
+    try:
+        run_libraries(config, watch_library, driver_pool, budget, lambda: stopping)
+    finally:
+        if driver_pool is not None:
+            logging.debug('正在关闭WebDriver...')
+            driver_pool.quit()
+            logging.debug('关闭完成。')
+
+
+def watch_library(config,
+                  driver_pool: Optional['DriverPool'],
+                  budget: BatchBudget,
+                  should_stop: Callable[[], bool]):
+    """监视一个音乐目录直到should_stop()为真，索引在本线程中打开"""
+    from aum.watcher import MusicDirWatcher
+
+    index = FileIndex(config.state_db) if config.state_db is not None else None
+    scheduler = create_scheduler(config, budget, max_batches=0)  # 新文件只出现一次，不能留待之后
+    classifier = create_classifier(config)  # 跨批次保留，同一文件的多次修改事件只检查一次
+    watcher = MusicDirWatcher(config.music_dir, debounce=config.daemon_debounce,
+                              max_batch=config.unlock_patch_size * config.unlock_workers)
+
+    logging.info(f'开始监视音乐目录：{config.music_dir}')
+    try:
+        for music_files in watcher.batches(should_stop=should_stop):
+            if index is not None:  # 跳过已处理过的文件，如本程序自身产生的解锁结果
+                music_files = [p for p in music_files if index.state_of(p) is None]
+            if not music_files:
+                continue
+
+            logging.info(f'发现{len(music_files)}个新文件。')
+            try:
+                process_files(config, music_files, index, driver_pool, budget, scheduler, classifier)
+            except Exception:  # 单批失败不影响之后的批次
+                logging.exception('处理失败：')
+                metrics.add_result('batch_errors')
+            export_metrics(config)
+    finally:
+        if index is not None:
+            index.close()
+
+
+def export_metrics(config):
+    """将运行指标写入配置的textfile与运行报告"""
+    try:
+        if config.metrics_textfile is not None:
+            metrics.write_textfile(config.metrics_textfile)
+        if config.run_report is not None:
+            metrics.write_report(config.run_report)
+    except OSError as e:
+        logging.warning(f'导出运行指标失败：{e}')
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Auto Unlock Music')
+    parser.add_argument('mode', nargs='?', choices=('run', 'daemon', 'rename', 'scan'), default='run',
+                        help='run：处理一次后退出（默认）；daemon：常驻监视音乐目录；rename：只重命名；'
+                             f'scan：只检查是否有需要处理的文件，没有时以{EXIT_NOTHING_TO_DO}退出')
+    parser.add_argument('--dry-run', action='store_true', help='rename模式下只输出重命名计划，不修改文件')
+    args = parser.parse_args()
+
     config = ConfigFactory().create()
+    if args.mode == 'scan':  # 不导出运行指标，以免覆盖上一次实际运行的结果
+        found = [scan(library) for library in config.library_configs()]  # 逐个检查，输出每个音乐库的情况
+        sys.exit(0 if any(found) else EXIT_NOTHING_TO_DO)
+
+    if config.profile_dir is not None:
+        metrics.enable_profiling(config.profile_dir)
+
+    try:
+        run(config, args.mode, args.dry_run)
+    finally:  # 运行失败时同样导出，以便据此告警
+        export_metrics(config)
+
+
+def run(config, mode: str, dry_run: bool = False):
+    if mode not in {'run', 'daemon'} or config.journal is None:
+        run_mode(config, mode, dry_run)
+        return
+
+    # 整个运行期间持有共享锁；没有其他运行时才恢复上次的结果，以免发布或删除其他运行仍在处理的文件
+    with JournalLock(config.journal) as lock:
+        if lock.try_exclusive():
+            recover_unlocks(config)
+        else:
+            logging.info('另一运行正在使用解锁日志，本次不恢复上次运行的结果。')
+        lock.share()
+        run_mode(config, mode, dry_run)
+
+
+def run_mode(config, mode: str, dry_run: bool = False):
+    if mode == 'daemon':
+        daemon(config)
+        return
+
+    if mode == 'rename':
+        for library in config.library_configs():
+            rename_all_music(library, dry_run=dry_run)
+        return
 
-    unlock_all_music(config)
-    rename_all_music(config)
+    # 各段与各音乐库共用一个会话池，会话在首次需要时才创建；多个音乐库的批次按先来后到轮流取得会话
+    driver_pool = create_driver_pool(config) if config.sel_hub_urls else None
+    try:
+        run_libraries(config, process_library, driver_pool, create_batch_budget(config))
+    finally:
+        if driver_pool is not None:
+            driver_pool.quit()
 
 
 if __name__ == '__main__':
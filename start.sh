@@ -1,7 +1,15 @@
 #!/bin/bash
 
+# 下载目录所在的卷browser_download在运行之间保留，使崩溃后残留的下载结果可由下一次运行按解锁日志发布
+
+# 先只启动本程序检查是否有需要处理的文件，没有时不再启动浏览器与Unlock Music服务
+docker compose run --rm --no-deps --build main ./entrypoint.sh scan
+if [ $? -eq 3 ]; then
+  docker compose down
+  exit 0
+fi
+
 docker compose up --build \
   --abort-on-container-exit --exit-code-from main
 
-docker compose down \
-  --volumes
+docker compose down